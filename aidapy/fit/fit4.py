@@ -1,5 +1,7 @@
 from __future__ import print_function
 import aidapy.meta as am
+from aidapy.hist.keys import mc_key
+from aidapy.hist.keys import _tree_pair_names
 import ROOT
 HF = ROOT.RooStats.HistFactory
 RF = ROOT.RooFit
@@ -31,16 +33,12 @@ def setup_channel(name):
     samples["Fakes"]   = HF.Sample("Fakes",  "Fakes_FULL_main_nominal_"+name,  rootFile,"")
     samples["RareSM"]  = HF.Sample("RareSM", "RareSM_FULL_main_nominal_"+name, rootFile,"")
 
-    for treesys in am._systematic_ud_prefixes:
-        downsfx = "__1down"
-        upsfx   = "__1up"
-        if 'MET' in treesys:
-            downsfx = "Down"
-            upsfx   = "Up"
+    for treesys, label in am._systematic_ud_prefixes:
+        up, down = _tree_pair_names(treesys)
         for iproc in ["ttbar","WW","Ztautau","Wt","Diboson","Fakes","RareSM"]:
             samples[iproc].AddHistoSys(treesys,
-                                       iproc+"_FULL_main_"+treesys+downsfx+"_"+name,rootFile,"",
-                                       iproc+"_FULL_main_"+treesys+upsfx+  "_"+name,rootFile,"")
+                                       str(mc_key(iproc+"_FULL_main",down,name)),rootFile,"",
+                                       str(mc_key(iproc+"_FULL_main",up,name)),  rootFile,"")
 
     samples["ttbar"].AddHistoSys("ttbar_AR",
                                  "ttbar_FULL_sysARdown_nominal_"+name,rootFile,"",
@@ -15,22 +15,24 @@ def split4fit(infile, histogram_list=['met_0j','met_1pj']):
       histograms of this variable from all states/samples 
     """
     import ROOT
+    from aidapy.hist.keys import open_index
 
     outpfx = infile.split('.root')[0]
     if '/' in outpfx:
         outpfx = outpfx.split('/')[-1]
+    index  = open_index(infile)
     infile = ROOT.TFile(infile,'read')
-    lok     = [str(o.GetName()) for o in infile.GetListOfKeys()]
 
     def make_a_file(hist_name):
-        thishist = [k for k in lok if (hist_name in k)]
+        # exact match on the histogram part of the names
+        thishist = index.query(hist=hist_name)
         new_thishist_hists = {}
         thishist_file  = ROOT.TFile(outpfx+'_'+hist_name+'.root','RECREATE')
         for k in thishist:
-            cloned_list = k.split('_'+hist_name)
-            cloned_name = cloned_list[0].replace('_nominal','')
-            if 'weightSys' in cloned_list[1]:
-                cloned_name = cloned_name+cloned_list[1]
+            key = index.keys[k]
+            cloned_name = '_'.join(f for f in (key.pname,
+                                               None if key.tree == 'nominal' else key.tree,
+                                               key.weight) if f)
             #print(cloned_name)
             new_thishist_hists[cloned_name] = infile.Get(k).Clone(cloned_name)
             new_thishist_hists[cloned_name].SetDirectory(thishist_file)
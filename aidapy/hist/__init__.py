@@ -2,18 +2,67 @@
 Module for generating and manipulating histograms for AIDA
 """
 
-from .utils import bin_centers
-from .utils import hist2array
-from .utils import array2hist
-from .utils import shift_overflow
-from .utils import tree2hist
-from .utils import np_selection
-from .utils import np_hist
+from .tcut import compile_tcut
+from .binning import IntegerAxis
+from .binning import Binning2D
+from .binning import hist_binning
+from .binning import binning_edges
 
-from .gen import generate_mc_hists
-from .gen import generate_data_hists
-from .gen import generate_hists
-from .gen import total_systematic_histogram
+try:
+    import ROOT as _ROOT
+except ImportError:
+    # without PyROOT only the numpy parts (the TCut compiler and the
+    # binnings) are available
+    _ROOT = None
+
+if _ROOT is not None:
+    from .utils import bin_centers
+    from .utils import hist2array
+    from .utils import array2hist
+    from .utils import shift_overflow
+    from .utils import tree2hist
+    from .utils import np_selection
+    from .utils import SelectionCache
+    from .utils import np_hist
+    from .utils import np_fill
+    from .utils import np_fill_weights
+    from .utils import np_hist_weights
+    from .utils import rdf_hists
+    from .utils import expression_branches
+    from .utils import activate_branches
+
+    from .histogram import Histogram
+    from .histogram import Histogram2D
+    from .histogram import as_histogram
+    from .histogram import load_hists
+    from .histogram import match_keys
+    from .histogram import KeyIndex
+    from .keys import HistKey
+    from .keys import HistIndex
+    from .keys import open_index
+    from .output import HistWriter
+    from .output import merge_shards
+    from .plan import Leaf
+    from .plan import build_plan
+    from .plan import plan_summary
+    from .plan import format_plan
+    from .cost import task_cost
+    from .cost import format_costs
+    from .profiling import Profile
+    from .profiling import profiling
+    from .profiling import enable_profiling
+    from .profiling import disable_profiling
+
+    from .gen import generate_mc_hists
+    from .gen import generate_mc_hists_numpy
+    from .gen import generate_mc_hists_rdf
+    from .gen import generate_data_hists
+    from .gen import generate_hists
+    from .gen import total_systematic_histogram
+    from .gen import systematic_bands
+    from .gen import merge_hist_shards
+    from .gen import plan_hists
+    from .gen import estimate_hists
 
 __ALL__ = [
     'bin_centers',
@@ -22,9 +71,48 @@ __ALL__ = [
     'shift_overflow',
     'tree2hist',
     'generate_mc_hists',
+    'generate_mc_hists_numpy',
+    'generate_mc_hists_rdf',
     'generate_data_hists',
     'generate_hists',
     'total_systematic_histogram',
+    'systematic_bands',
     'np_selection',
-    'np_hist'
+    'SelectionCache',
+    'compile_tcut',
+    'IntegerAxis',
+    'Binning2D',
+    'hist_binning',
+    'binning_edges',
+    'np_hist',
+    'np_fill',
+    'np_fill_weights',
+    'np_hist_weights',
+    'rdf_hists',
+    'expression_branches',
+    'activate_branches',
+    'Histogram',
+    'Histogram2D',
+    'as_histogram',
+    'load_hists',
+    'match_keys',
+    'KeyIndex',
+    'HistKey',
+    'HistIndex',
+    'open_index',
+    'HistWriter',
+    'merge_shards',
+    'merge_hist_shards',
+    'Leaf',
+    'build_plan',
+    'plan_summary',
+    'format_plan',
+    'plan_hists',
+    'task_cost',
+    'format_costs',
+    'estimate_hists',
+    'Profile',
+    'profiling',
+    'enable_profiling',
+    'disable_profiling'
 ]
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Histogram axes. A binning is one of
+
+- a tuple (nbins, xmin, xmax): uniform bins,
+- a numpy array of bin edges: variable width bins,
+- an IntegerAxis(first, last): one bin per integer value (the bin
+  edges are the half integers around the values),
+- a Binning2D(x, y) of two of the above for 2D histograms.
+
+In the histogram YAML file the axis is given by one of the keys
+bins: [nbins, xmin, xmax], edges: [x0, x1, ...] or
+integer: [first, last]. A 2D histogram has two variables (var: [x, y])
+and a list of the two axes, e.g. axes: [{integer: [0, 7]},
+{bins: [20, 0, 200]}].
+
+Histogram contents are arrays of cells in the ROOT order: the flow
+bins included, for 2D the x index running fastest (cell
+ix+(nx+2)*iy).
+"""
+
+from collections import namedtuple
+import numpy as np
+
+class IntegerAxis(namedtuple('IntegerAxis', ['first', 'last'])):
+    """
+    One bin for each integer from first to last (both included), for
+    counts and categories like njets.
+    """
+    __slots__ = ()
+
+    @property
+    def nbins(self):
+        return self.last-self.first+1
+
+class Binning2D(namedtuple('Binning2D', ['x', 'y'])):
+    """
+    The x and y binnings of a 2D histogram.
+    """
+    __slots__ = ()
+
+def hist_binning(hist_props):
+    """
+    The binning of a histogram definition (an entry in the histogram
+    YAML file).
+
+    Parameters
+    ----------
+    hist_props: dict
+      The histogram definition, with one of the keys bins, edges or
+      integer (axes, a list of two of them, for 2D)
+
+    Returns
+    -------
+    tuple, numpy.ndarray, IntegerAxis or Binning2D
+      The binning
+    """
+    if 'axes' in hist_props:
+        if len(hist_props['axes']) != 2 or isinstance(hist_props['var'], str) or len(hist_props['var']) != 2:
+            raise ValueError('A 2D histogram needs two variables and two axes')
+        return Binning2D(*[hist_binning(axis) for axis in hist_props['axes']])
+    given = [k for k in ('bins', 'edges', 'integer') if k in hist_props]
+    if len(given) != 1:
+        raise ValueError('A histogram needs exactly one of bins, edges or integer')
+    if 'edges' in hist_props:
+        edges = np.asarray(hist_props['edges'], dtype=np.float64)
+        if edges.ndim != 1 or edges.size < 2 or np.any(np.diff(edges) <= 0):
+            raise ValueError('edges must be at least two increasing values')
+        return edges
+    if 'integer' in hist_props:
+        first, last = [int(v) for v in hist_props['integer']]
+        if last < first:
+            raise ValueError('integer axis must be [first, last] with first <= last')
+        return IntegerAxis(first, last)
+    if len(hist_props['bins']) != 3:
+        raise ValueError('bins must be [nbins, xmin, xmax]')
+    return tuple(hist_props['bins'])
+
+def binning_spec(hist_props):
+    """
+    The axis of a histogram definition as plain (JSON serializable)
+    values, e.g. for the content digests.
+    """
+    if 'axes' in hist_props:
+        return {'axes' : [binning_spec(axis) for axis in hist_props['axes']]}
+    if 'edges' in hist_props:
+        return {'edges' : [float(e) for e in hist_props['edges']]}
+    if 'integer' in hist_props:
+        return {'integer' : [int(v) for v in hist_props['integer']]}
+    return list(hist_props['bins'])
+
+def hist_vars(hist_props):
+    """
+    The variables of a histogram definition, one per axis.
+    """
+    var = hist_props['var']
+    return [var] if isinstance(var, str) else list(var)
+
+def is_uniform(binning):
+    if isinstance(binning, Binning2D):
+        return is_uniform(binning.x) and is_uniform(binning.y)
+    return isinstance(binning, (tuple, IntegerAxis))
+
+def binning_nbins(binning):
+    """
+    The number of bins (without the flow bins; nx*ny for 2D).
+    """
+    if isinstance(binning, Binning2D):
+        return binning_nbins(binning.x)*binning_nbins(binning.y)
+    if isinstance(binning, IntegerAxis):
+        return binning.nbins
+    if isinstance(binning, np.ndarray):
+        return binning.size-1
+    return int(binning[0])
+
+def binning_shape(binning):
+    """
+    The shape of the bins, (nbins,) or (nx, ny).
+    """
+    if isinstance(binning, Binning2D):
+        return (binning_nbins(binning.x), binning_nbins(binning.y))
+    return (binning_nbins(binning),)
+
+def binning_cells(binning):
+    """
+    The number of cells including the flow bins.
+    """
+    return int(np.prod([n+2 for n in binning_shape(binning)]))
+
+def binning_edges(binning):
+    """
+    The bin edges (nbins+1) of a binning, a Binning2D of the x and y
+    edges for 2D.
+    """
+    if isinstance(binning, Binning2D):
+        return Binning2D(binning_edges(binning.x), binning_edges(binning.y))
+    if isinstance(binning, IntegerAxis):
+        return np.arange(binning.first, binning.last+2, dtype=np.float64)-0.5
+    if isinstance(binning, np.ndarray):
+        return binning
+    return np.linspace(binning[1], binning[2], int(binning[0])+1)
+
+def th1_axis(binning):
+    """
+    The axis arguments of the TH1 constructors: (nbins, xmin, xmax)
+    for uniform and integer axes, (nbins, edges) for variable bins
+    (for 2D the x arguments followed by the y arguments, as in the
+    TH2 constructors).
+    """
+    if isinstance(binning, Binning2D):
+        return th1_axis(binning.x)+th1_axis(binning.y)
+    if isinstance(binning, IntegerAxis):
+        return binning.nbins, binning.first-0.5, binning.last+0.5
+    if isinstance(binning, np.ndarray):
+        return binning.size-1, np.ascontiguousarray(binning, dtype=np.float64)
+    return int(binning[0]), float(binning[1]), float(binning[2])
+
+def bin_index(x, binning):
+    """
+    The bin index (ROOT convention: 0 is the underflow, nbins+1 the
+    overflow) of each value. Uniform axes use the arithmetic index of
+    TAxis::FindBin, variable axes a binary search of the edges and
+    integer axes the values themselves (integer arrays are not
+    converted to floats). For 2D the index is the flattened cell
+    index ix+(nx+2)*iy. NaN values are in the overflow, as in ROOT.
+
+    Parameters
+    ----------
+    x: numpy.ndarray or tuple(numpy.ndarray)
+      The values, a pair (x, y) of arrays for 2D
+    binning: tuple, numpy.ndarray, IntegerAxis or Binning2D
+      The binning
+
+    Returns
+    -------
+    numpy.ndarray
+      The bin indices (numpy.intp)
+    """
+    if isinstance(binning, Binning2D):
+        idx  = bin_index(x[1], binning.y)
+        idx *= binning_nbins(binning.x)+2
+        idx += bin_index(x[0], binning.x)
+        return idx
+    x = np.asarray(x)
+    if isinstance(binning, IntegerAxis):
+        if x.dtype.kind in 'iub':
+            idx = x.astype(np.intp)-(binning.first-1)
+        else:
+            # the bin edges are at the half integers
+            idx = np.floor(x.astype(np.float64)-(binning.first-1.5))
+            np.clip(idx, 0, binning.nbins+1, out=idx)
+            idx[np.isnan(idx)] = binning.nbins+1
+            return idx.astype(np.intp)
+        return np.clip(idx, 0, binning.nbins+1, out=idx)
+    if isinstance(binning, np.ndarray):
+        # edges[i-1] <= x < edges[i] is bin i, as in ROOT
+        return np.searchsorted(binning, x.astype(np.float64, copy=False), side='right').astype(np.intp)
+    nbins, xmin, xmax = int(binning[0]), float(binning[1]), float(binning[2])
+    idx = np.floor((x.astype(np.float64)-xmin)*(nbins/(xmax-xmin)))
+    np.clip(idx, -1, nbins, out=idx)
+    # NaN is not less than xmax: the overflow (TAxis::FindBin)
+    idx[np.isnan(idx)] = nbins
+    return idx.astype(np.intp)+1
+
+def fold_flows(cells, binning, overflow=True, underflow=False):
+    """
+    Add the overflow (underflow) bins into the last (first) real bins
+    in place, along each axis.
+
+    Parameters
+    ----------
+    cells: numpy.ndarray
+      Contents in ROOT cell order along the last axis (e.g. a sum of
+      weights, or a matrix of them for many weight variations)
+    binning: tuple, numpy.ndarray, IntegerAxis or Binning2D
+      The binning
+    overflow: bool
+      Fold the overflow
+    underflow: bool
+      Fold the underflow
+
+    Returns
+    -------
+    numpy.ndarray
+      cells
+    """
+    shape = [n+2 for n in binning_shape(binning)]
+    grid  = cells.reshape(cells.shape[:-1]+tuple(reversed(shape)))
+    for axis in range(-1, -len(shape)-1, -1):
+        g = np.moveaxis(grid, axis, 0)
+        if overflow:
+            g[-2] += g[-1]
+            g[-1]  = 0.0
+        if underflow:
+            g[1] += g[0]
+            g[0]  = 0.0
+    return cells
+
+def inner_bins(cells, binning):
+    """
+    The real bins (a view without the flow bins) of contents in ROOT
+    cell order along the last axis, shaped (..., nbins) or, for 2D,
+    (..., nx, ny).
+    """
+    shape = binning_shape(binning)
+    grid  = cells.reshape(cells.shape[:-1]+tuple(n+2 for n in reversed(shape)))
+    inner = grid[(Ellipsis,)+tuple(slice(1, -1) for n in shape)]
+    return np.swapaxes(inner, -1, -2) if len(shape) == 2 else inner
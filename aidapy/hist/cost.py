@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+A cost model of the histogram generation tasks (see aidapy.hist.plan
+and aidapy.hist.gen), computed from the input file metadata only: file
+sizes, tree entry counts and the number of branches of the trees. No
+events are read.
+
+The estimates are rough (the bytes read assume the branches of a tree
+are of similar size, the times use the throughputs in _rates), they
+are meant to compare tasks, e.g. to start the longest ones first, and
+to size a run before it is started.
+"""
+
+import os
+import glob
+import multiprocessing
+from collections import OrderedDict
+import ROOT
+
+from .binning import hist_binning
+from .binning import binning_cells
+from .plan import leaf_columns
+
+# rough single core throughputs: compressed bytes read per second and
+# histogram fills (event x histogram) per second for each backend
+_rates = {
+    'root'  : {'read' : 50.0e6, 'fill' : 5.0e6},
+    'rdf'   : {'read' : 50.0e6, 'fill' : 2.0e7},
+    'numpy' : {'read' : 50.0e6, 'fill' : 5.0e7},
+}
+
+# bytes per histogram cell (sum of weights and sum of squared weights)
+_cell_bytes   = 16
+# bytes per branch per entry held by numpy (scalar branches)
+_branch_bytes = 8
+# bytes of the basket buffer of each branch read by ROOT
+_basket_bytes = 32000
+
+def file_info(tname, path, cache=None):
+    """
+    The size (bytes), number of entries and number of branches of a
+    tree in a file, (0, 0, 0) if it cannot be read. Results are kept
+    in cache (a dict) if given.
+    """
+    if cache is not None and (tname, path) in cache:
+        return cache[(tname, path)]
+    info = (0, 0, 0)
+    if os.path.exists(path):
+        root_file = ROOT.TFile.Open(path, 'READ')
+        if root_file and not root_file.IsZombie():
+            tree = root_file.Get(tname)
+            if tree:
+                info = (os.path.getsize(path), int(tree.GetEntries()),
+                        int(tree.GetListOfBranches().GetEntries()))
+            root_file.Close()
+    if cache is not None:
+        cache[(tname, path)] = info
+    return info
+
+def _expand(files):
+    return [f for pattern in files for f in (sorted(glob.glob(pattern)) or [pattern])]
+
+def task_cost(task, cache=None):
+    """
+    Estimate the cost of a generation task.
+
+    Parameters
+    ----------
+    task: dict
+      A task (a pass of the plan or a part of it)
+    cache: dict, optional
+      Cache of the file metadata (see file_info), shared by the
+      estimates of many tasks
+
+    Returns
+    -------
+    OrderedDict
+      bytes (compressed bytes read), events, fills (events x
+      histograms filled, before the selections), memory (peak bytes)
+      and seconds (single core)
+    """
+    size, entries, nbranches = 0, 0, 0
+    for f in _expand(task['files']):
+        fsize, fentries, fbranches = file_info(task['tree'], f, cache)
+        size, entries, nbranches = size+fsize, entries+fentries, max(nbranches, fbranches)
+    events = entries
+    if task.get('entries') is not None:
+        events = min(task['entries'][1], max(entries-task['entries'][0], 0))
+    # the bytes of the events of the task in the branches read
+    fraction = float(events)/entries if entries else 0.0
+    per_branch = size*fraction/nbranches if nbranches else 0.0
+    nfills = sum(len(weights) for hist_props, weights in task['hists'])
+    hist_memory = sum(len(weights)*binning_cells(hist_binning(hist_props))*_cell_bytes
+                      for hist_props, weights in task['hists'])
+    backend = task['backend']
+    if backend == 'root':
+        # one TTree::Draw per histogram, each reads its own branches
+        nread = sum(len(leaf_columns(hist_props, weight))
+                    for hist_props, weights in task['hists'] for hname, weight in weights)
+    else:
+        nread = min(len(task['branches']), nbranches)
+    if backend == 'numpy':
+        rows = events
+        if task.get('chunk_size'):
+            rows = min(rows, task['chunk_size'])
+        elif task.get('max_memory'):
+            rows = min(rows, int(task['max_memory']/(2*_branch_bytes*max(nread, 1))))
+        # the chunk and as much again for the masks, values and weights
+        memory = 2*rows*nread*_branch_bytes+hist_memory
+    else:
+        # RDataFrame keeps a copy of each histogram per thread
+        threads = 1
+        if backend == 'rdf' and task.get('implicit_mt'):
+            threads = multiprocessing.cpu_count() if task['implicit_mt'] is True else int(task['implicit_mt'])
+        memory = len(task['branches'])*_basket_bytes+threads*hist_memory
+    rates = _rates[backend]
+    fills = events*nfills
+    cost  = OrderedDict([('bytes', int(per_branch*nread)), ('events', events), ('fills', fills),
+                         ('memory', int(memory))])
+    cost['seconds'] = cost['bytes']/rates['read']+fills/rates['fill']
+    return cost
+
+def longest_first(tasks, costs):
+    """
+    The tasks ordered by decreasing estimated time (the longest
+    processing time first rule: on a pool of workers the longest
+    tasks do not end up last).
+    """
+    order = sorted(range(len(tasks)), key=lambda i: -costs[i]['seconds'])
+    return [tasks[i] for i in order]
+
+def _assign(costs, count):
+    slots, totals = [[] for _ in range(count)], [0.0 for _ in range(count)]
+    for i in sorted(range(len(costs)), key=lambda i: (-costs[i]['seconds'], i)):
+        j = totals.index(min(totals))
+        slots[j].append(i)
+        totals[j] += costs[i]['seconds']
+    return slots, totals
+
+def assign_slots(tasks, costs, count):
+    """
+    Distribute tasks over count batch jobs: longest first, each task
+    to the job with the least estimated time so far. The assignment
+    is deterministic for given tasks and costs.
+
+    Returns
+    -------
+    list(list)
+      The tasks of each job
+    """
+    return [[tasks[i] for i in slot] for slot in _assign(costs, count)[0]]
+
+def format_costs(tasks, costs, jobs=1):
+    """
+    A table of the estimated cost of each task and the totals: the
+    peak memory is the sum of the jobs largest tasks and the wall
+    time the makespan of the longest first schedule on jobs workers.
+    """
+    header = ('group', 'tree', 'part', 'files', 'events', 'fills', 'read MB', 'memory MB', 'seconds')
+    rows   = [header]
+    for task, cost in zip(tasks, costs):
+        rows.append((' '.join(task['group']), task['tree'],
+                     '%d/%d' % (task['part'][0]+1, task['part'][1]), str(len(task['files'])),
+                     str(cost['events']), str(cost['fills']), '%.1f' % (cost['bytes']/1.0e6),
+                     '%.1f' % (cost['memory']/1.0e6), '%.1f' % cost['seconds']))
+    widths = [max(len(r[i]) for r in rows) for i in range(len(header))]
+    lines  = ['  '.join(c.ljust(w) for c, w in zip(r, widths)).rstrip() for r in rows]
+    jobs   = max(min(jobs, len(tasks)), 1)
+    wall   = max(_assign(costs, jobs)[1])
+    memory = sum(sorted([c['memory'] for c in costs], reverse=True)[:jobs])
+    lines.append('')
+    lines += ['tasks: %d' % len(tasks),
+              'read: %.1f MB' % (sum(c['bytes'] for c in costs)/1.0e6),
+              'events: %d' % sum(c['events'] for c in costs),
+              'fills: %d' % sum(c['fills'] for c in costs),
+              'cpu: %.1f s' % sum(c['seconds'] for c in costs),
+              'wall (%d jobs): %.1f s' % (jobs, wall),
+              'peak memory (%d jobs): %.1f MB' % (jobs, memory/1.0e6)]
+    return '\n'.join(lines)
@@ -2,7 +2,14 @@
 
 from __future__ import print_function
 
+import os
+import glob
+import json
 import math
+import uuid
+import hashlib
+import multiprocessing
+from collections import OrderedDict
 import yaml
 import numpy as np
 import ROOT
@@ -12,19 +19,53 @@ from .. import configure_logging
 configure_logging()
 logger  = logging.getLogger('aidapy')
 
-from .utils import array2hist
-from .utils import hist2array
 from .utils import shift_overflow
 from .utils import tree2hist
-from .utils import fast2full
+from .utils import rdf_hists
+from .utils import _negatives_to_zero
+from .utils import _detach
+from .utils import _fast2full_arrays
+from .utils import expression_branches
+from .utils import activate_branches
 from .utils import np_selection
+from .utils import SelectionCache
 from .utils import np_hist
+from .utils import np_fill_weights
+from .tcut import compile_tcut
+from .binning import hist_binning
+from .binning import binning_spec
+from .binning import binning_cells
+from .binning import hist_vars
+from .binning import Binning2D
+from .histogram import Histogram
+from .histogram import new_histogram
+from .histogram import load_hists
+from .histogram import KeyIndex
+from .keys import mc_key
+from .keys import data_key
+from .keys import _tree_pair_names
+from .plan import Leaf
+from .plan import build_plan
+from .cost import task_cost
+from .cost import longest_first
+from .cost import assign_slots
+from .keys import open_index
+from .output import HistWriter
+from .output import _read_manifest
+from .output import _merge_shards
+from .output import _remove_output
+from .profiling import Profile
+from .profiling import profiling
+from .profiling import stage
+from .profiling import active_profile
 
 from aidapy.meta import _systematic_trees
 from aidapy.meta import _systematic_weights
 from aidapy.meta import _systematic_singles
 from aidapy.meta import _systematic_ud_prefixes
 from aidapy.meta import _systematic_btag_weights
+from aidapy.meta import _systematic_modeling
+from aidapy.meta import _lumi_uncertainties
 
 def _unravel_dsids(arr):
     dsids = []
@@ -57,9 +98,534 @@ def _root_file_dict(yaml_file):
                 file_dict[procsimsamp][1] += files
     return file_dict
 
+def _mc_chain_specs(file_dict, mc_prefix, aida_tree, ignore):
+    """
+    Determine the tree name and the list of files for each MC process
+    (key in the file dictionary) for a given AIDA tree. Ignored
+    processes are dropped, and for systematic trees only the main
+    samples are kept.
+    """
+    specs = OrderedDict()
+    for fde, fdk in sorted(file_dict.items()):
+        ckey, tname = fde, fdk[0]
+        if ckey in ignore:
+            continue
+        if aida_tree != 'nominal' and ('fast' in tname or 'main' not in ckey):
+            continue
+        if 'Fakes' in fde:
+            tname = 'AIDAfk_'+aida_tree
+        elif aida_tree == 'nominal':
+            tname = 'AIDA_'+tname
+        else:
+            tname = 'AIDA_'+aida_tree
+        specs[ckey] = (tname, [mc_prefix+'/'+f for f in fdk[1]])
+    return specs
+
+def _hist_weights(pname, aida_tree, hist_name, Z_genWeights=False):
+    """
+    List the (histogram name, weight branch) pairs which are generated
+    for a histogram definition of a process in a given AIDA tree.
+    """
+    key     = mc_key(pname, aida_tree, hist_name)
+    weights = [(str(key), 'nomWeightwLum')]
+    if aida_tree == 'nominal' and key.sim != 'FAST' and key.sample == 'main':
+        for systW in (_systematic_weights+_systematic_btag_weights):
+            for ud in systW[:-1]:
+                weights.append((str(key._replace(weight=ud)), ud))
+    if aida_tree == 'nominal' and key.process == 'Ztautau' and Z_genWeights:
+        for i in range(1,115):
+            weights.append((str(key._replace(weight='genWeight'+str(i))),
+                            'weightSyswLum_genWeight'+str(i)))
+    return weights
+
+def _remote_identity(f):
+    """
+    Identify a file which cannot be stat'ed (e.g. a remote XRootD
+    file) by the size and UUID of the opened TFile. If it cannot be
+    opened either, a random value is used so that its histograms are
+    always regenerated.
+    """
+    root_file = ROOT.TFile.Open(f, 'READ')
+    if root_file and not root_file.IsZombie():
+        ident = [f, int(root_file.GetSize()), str(root_file.GetUUID().AsString())]
+        root_file.Close()
+        return ident
+    logger.warning('Cannot identify '+f+', its histograms are always regenerated')
+    return [f, None, uuid.uuid4().hex]
+
+def _files_identity(files):
+    """
+    Identify input files by path, size and modification time (a path
+    may be a wildcard pattern), or by the TFile size and UUID for files
+    which cannot be stat'ed.
+    """
+    ident = []
+    for pattern in files:
+        for f in (sorted(glob.glob(pattern)) or [pattern]):
+            try:
+                st = os.stat(f)
+                ident.append([f, st.st_size, st.st_mtime])
+            except OSError:
+                ident.append(_remote_identity(f))
+    return ident
+
+def _hist_digest(backend, files_identity, tree, hist_props, weight, lumi):
+    """
+    The content address of a histogram: a hash of everything it is
+    built from.
+    """
+    payload = json.dumps([backend, files_identity, tree, str(hist_props['var']),
+                          str(hist_props['cut']), binning_spec(hist_props), weight, lumi])
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def _up_to_date(hname, digest, rootkeys, manifest):
+    """
+    Check if a histogram is in the output file and was built from the
+    same inputs (same digest in the manifest).
+    """
+    if hname in rootkeys and manifest.get(hname) == digest:
+        logger.info(hname+' up to date in file')
+        return True
+    return False
+
+def _split_chain(tname, files, nparts):
+    """
+    Split the work on a chain into (files, entries) parts. If there
+    are at least as many files as parts, the files are distributed
+    over the parts balanced by file size, otherwise the chain is split
+    into (firstentry, nentries) ranges. entries is None for all
+    entries of the files.
+    """
+    if nparts <= 1 or not files:
+        return [(files, None)]
+    if len(files) >= nparts:
+        groups, sizes = [[] for _ in range(nparts)], [0 for _ in range(nparts)]
+        for f in sorted(files, key=lambda f: os.path.getsize(f) if os.path.exists(f) else 0,
+                        reverse=True):
+            i = sizes.index(min(sizes))
+            groups[i].append(f)
+            sizes[i] += os.path.getsize(f) if os.path.exists(f) else 0
+        return [(g, None) for g in groups if g]
+    chain = ROOT.TChain(tname)
+    [chain.Add(f) for f in files]
+    nentries = int(chain.GetEntries())
+    if nentries == 0:
+        return [(files, None)]
+    step = int(math.ceil(nentries/float(nparts)))
+    return [(files, (first, min(step, nentries-first))) for first in range(0, nentries, step)]
+
+def _mc_leaves(backend, file_dict, hist_dict, mc_prefix, aida_tree, lumi, ignore, Z_genWeights,
+               rootkeys, manifest={}):
+    """
+    The leaves (see aidapy.hist.plan) of the MC histograms of an AIDA
+    tree: each weight of each histogram definition for each process.
+    Histograms in rootkeys whose digest matches the manifest are
+    skipped.
+    """
+    for pname, (tname, files) in _mc_chain_specs(file_dict, mc_prefix, aida_tree, ignore).items():
+        ident = _files_identity(files)
+        for hist_name, hist_props in hist_dict.items():
+            for hname, weight in _hist_weights(pname, aida_tree, hist_name, Z_genWeights):
+                digest = _hist_digest(backend, ident, tname, hist_props, weight, lumi)
+                if not _up_to_date(hname, digest, rootkeys, manifest):
+                    yield Leaf(backend, (aida_tree, pname), tname, files, lumi, hist_props, hname,
+                               weight, digest)
+
+def _data_leaves(data_root_file, hist_dict, rootkeys, manifest={}):
+    """
+    Same as _mc_leaves but for the data histograms (always built with
+    TTree::Draw).
+    """
+    ident = _files_identity([data_root_file])
+    for hist_name, hist_props in hist_dict.items():
+        hname  = str(data_key(hist_name))
+        digest = _hist_digest('root', ident, 'AIDA_nominal', hist_props, '1.0', 1.0)
+        if not _up_to_date(hname, digest, rootkeys, manifest):
+            yield Leaf('root', ('data',), 'AIDA_nominal', [data_root_file], 1.0, hist_props, hname,
+                       '1.0', digest)
+
+def _plan_tasks(plan, nparts=1, implicit_mt=False, chunk_size=None, max_memory=None):
+    """
+    Turn the passes of a plan into tasks: one task per pass (or per
+    part of a pass if nparts > 1). Each task carries everything needed
+    to fill the histograms of that (part of the) chain. Parts which
+    are entry ranges run without implicit multithreading.
+    """
+    tasks = []
+    for p in plan:
+        parts = _split_chain(p['tree'], p['files'], nparts)
+        # RDataFrame cannot run an entry range with implicit multithreading
+        mt = implicit_mt if p['backend'] == 'rdf' else False
+        if mt and parts[0][1] is not None:
+            logger.info('Implicit multithreading off for the entry ranges of '+p['tree']+' ('+
+                        str(len(p['files']))+' files in '+str(len(parts))+' parts)')
+            mt = False
+        for index, (part_files, entries) in enumerate(parts):
+            task = dict(p)
+            task.update({'files'       : part_files,
+                         'entries'     : entries,
+                         'implicit_mt' : mt,
+                         'chunk_size'  : chunk_size,
+                         'max_memory'  : max_memory,
+                         'part'        : (index, len(parts)),
+                         'profile'     : active_profile() is not None})
+            tasks.append(task)
+    return tasks
+
+def _mc_tasks(backend, file_dict, hist_dict, mc_prefix, aida_tree, lumi, ignore, Z_genWeights,
+              rootkeys, nparts=1, implicit_mt=False, chunk_size=None, max_memory=None,
+              manifest={}):
+    """
+    The tasks of the MC histograms of an AIDA tree (see _mc_leaves and
+    _plan_tasks).
+    """
+    plan = build_plan(_mc_leaves(backend, file_dict, hist_dict, mc_prefix, aida_tree, lumi, ignore,
+                                 Z_genWeights, rootkeys, manifest))
+    return _plan_tasks(plan, nparts, implicit_mt, chunk_size, max_memory)
+
+def _data_tasks(data_root_file, hist_dict, rootkeys, nparts=1, manifest={}):
+    """
+    The tasks of the data histograms (see _data_leaves and
+    _plan_tasks).
+    """
+    return _plan_tasks(build_plan(_data_leaves(data_root_file, hist_dict, rootkeys, manifest)), nparts)
+
+def _fill_root(task):
+    """
+    Fill the (raw) histograms of a task with TTree::Draw.
+    """
+    with stage('open'):
+        chain = ROOT.TChain(task['tree'])
+        [chain.Add(f) for f in task['files']]
+        activate_branches(chain, task['branches'])
+    first, nentries = task['entries'] if task['entries'] is not None else (0, None)
+    hists = []
+    for hist_props, weights in task['hists']:
+        for hname, weight in weights:
+            cut = str(task['lumi'])+'*'+weight+'*('+hist_props['cut']+')'
+            hists.append(tree2hist(chain,hname,hist_binning(hist_props),hist_props['var'],cut,
+                                   nentries=nentries,firstentry=first))
+    return hists
+
+def _fill_rdf(task):
+    """
+    Fill the (raw) histograms of a task with ROOT.RDataFrame (a
+    single event loop).
+    """
+    with stage('open'):
+        chain = ROOT.TChain(task['tree'])
+        [chain.Add(f) for f in task['files']]
+    hist_specs = [(hname,hist_binning(hist_props),hist_props['var'],hist_props['cut'],
+                   str(task['lumi'])+'*'+weight)
+                  for hist_props, weights in task['hists'] for hname, weight in weights]
+    return rdf_hists(chain,hist_specs,implicit_mt=task['implicit_mt'],entries=task['entries'])
+
+def _numpy_chunks(tname, files, branches, entries=None, chunk_size=None, max_memory=None):
+    """
+    Iterate over a chain in chunks of entries, each chunk is a numpy
+    recarray of the given branches. The chunk size is either given
+    directly (number of entries) or computed from a memory budget in
+    bytes (half of the budget for the chunk, half for temporaries).
+    If neither is given the whole (part of the) chain is one chunk.
+    """
+    from root_numpy import tree2array
+
+    with stage('open'):
+        chain = ROOT.TChain(tname)
+        [chain.Add(f) for f in files]
+        if entries is not None:
+            first, stop = entries[0], entries[0]+entries[1]
+        else:
+            first, stop = 0, int(chain.GetEntries())
+    if stop <= first:
+        return
+    if chunk_size is None and max_memory is not None:
+        itemsize   = tree2array(chain,branches=branches,start=first,stop=first+1).dtype.itemsize
+        chunk_size = max(1, int(max_memory/(2*itemsize)))
+    if chunk_size is None:
+        chunk_size = stop-first
+    for start in range(first, stop, chunk_size):
+        with stage('read', events=min(start+chunk_size,stop)-start):
+            chunk = tree2array(chain,branches=branches,start=start,stop=min(start+chunk_size,stop))
+        yield chunk.view(np.recarray)
+        del chunk
+
+def _fill_numpy(task):
+    """
+    Fill the histograms of a task with numpy (via root_numpy). The
+    chain is streamed in chunks (see _numpy_chunks); for each
+    histogram definition all weight variations are filled at once
+    (np_fill_weights) and accumulated over chunks. Returns Histogram
+    objects.
+    """
+    from root_numpy import list_branches
+
+    # only read the branches the histograms and weights need
+    branches, files = task['branches'], task['files']
+    if files:
+        with stage('open'):
+            available = set(list_branches(files[0], task['tree']))
+        branches  = [b for b in branches if b in available]
+
+    sumw, sumw2, dtypes = [], [], []
+    binnings = [hist_binning(hist_props) for hist_props, weights in task['hists']]
+    for binning, (hist_props, weights) in zip(binnings, task['hists']):
+        sumw.append(np.zeros((len(weights), binning_cells(binning)), dtype=np.float64))
+        sumw2.append(np.zeros((len(weights), binning_cells(binning)), dtype=np.float64))
+        dtypes.append(np.float64 if isinstance(binning, Binning2D) else np.float32)
+    for chain in _numpy_chunks(task['tree'], files, branches, task['entries'],
+                               task.get('chunk_size'), task.get('max_memory')):
+        masks, values = SelectionCache(chain), {}
+        for i, (hist_props, weights) in enumerate(task['hists']):
+            # the chunk's events are counted once, not per definition
+            with stage('selection', events=len(chain) if i == 0 else 0):
+                selection = masks(hist_props['cut'])
+                # the selected values of a variable are shared by all binnings
+                for var in hist_vars(hist_props):
+                    if (hist_props['cut'], var) not in values:
+                        values[(hist_props['cut'], var)] = compile_tcut(var).evaluate(chain)[selection]
+                x = [values[(hist_props['cut'], var)] for var in hist_vars(hist_props)]
+                w = np.empty((x[0].shape[0], len(weights)), dtype=np.float64)
+                x = x[0] if len(x) == 1 else tuple(x)
+                for j, (hname, weight) in enumerate(weights):
+                    w[:,j] = getattr(chain,weight)[selection]
+                # 2D histograms are TH2D (read back without copies)
+                if not isinstance(binnings[i], Binning2D):
+                    dtypes[i] = getattr(chain,weights[0][1]).dtype
+                w *= task['lumi']
+            with stage('fill', events=w.shape[0], hists=len(weights)):
+                csumw, csumw2, neff = np_fill_weights(x,w,binnings[i])
+                sumw[i]  += csumw
+                sumw2[i] += csumw2
+        del chain, masks, values
+
+    hists = []
+    for i, (hist_props, weights) in enumerate(task['hists']):
+        for j, (hname, weight) in enumerate(weights):
+            # bring the overflow into the last real bin
+            hists.append(new_histogram(hname,binnings[i],sumw[i][j],sumw2[i][j],dtypes[i]).fold_overflow())
+    return hists
+
+_fillers = {
+    'root'  : _fill_root,
+    'numpy' : _fill_numpy,
+    'rdf'   : _fill_rdf,
+}
+
+def _copy_aliases(hists, aliases):
+    """
+    Add the copies of the histograms which are aliases of a filled
+    one (see build_plan).
+    """
+    copies = []
+    for h in hists:
+        name = h.name if isinstance(h, Histogram) else str(h.GetName())
+        for alias in aliases.get(name, []):
+            copies.append(h.copy(alias) if isinstance(h, Histogram) else _detach(h.Clone(alias)))
+    return hists+copies
+
+def _run_task(task):
+    """
+    Run a single task (possibly in a worker process). Returns the
+    task's group, the raw histograms, which are merged, finalized and
+    written by the parent process, and the Profile of the task (None
+    if profiling is off).
+    """
+    profile = Profile(task['tree'], task['group'][-1]) if task.get('profile') else None
+    with profiling(profile):
+        hists = _copy_aliases(_fillers[task['backend']](task), task.get('aliases', {}))
+    return task['group'], hists, profile
+
+def _merge_profile(profile):
+    """
+    Add the profile of a task to the active profile.
+    """
+    if active_profile() is not None:
+        active_profile().merge(profile)
+
+def _merge_hists(partials):
+    """
+    Merge lists of partial histograms (from parts of the same chain)
+    by adding the histograms with the same name (sum of weights and
+    sum of weights squared).
+    """
+    merged = OrderedDict()
+    for hists in partials:
+        for h in hists:
+            if isinstance(h, Histogram):
+                if h.name in merged:
+                    merged[h.name].add(h)
+                else:
+                    merged[h.name] = h
+                continue
+            hname = str(h.GetName())
+            if hname in merged:
+                merged[hname].Add(h)
+            else:
+                merged[hname] = h
+    return list(merged.values())
+
+def _finalize_hists(backend, hists):
+    """
+    Apply the overflow shifting and negatives to zero treatment after
+    all parts are merged. (The numpy backend already keeps the
+    overflow in the last bin.)
+    """
+    if backend != 'numpy':
+        for h in hists:
+            shift_overflow(h)
+            _negatives_to_zero(h)
+    return hists
+
+def _task_digests(tasks):
+    digests = {}
+    for task in tasks:
+        digests.update(task['digests'])
+    return digests
+
+def _task_shard(shard_dir, task):
+    """
+    Path of the shard file of a task.
+    """
+    return os.path.join(shard_dir, '_'.join(task['group'])+'_part'+str(task['part'][0])+'.root')
+
+def _task_costs(tasks):
+    """
+    The estimated cost of each task (see aidapy.hist.cost), the file
+    metadata is read once for all tasks.
+    """
+    cache = {}
+    return [task_cost(task, cache) for task in tasks]
+
+def _run_task_shard(args):
+    """
+    Run a single task (possibly in a worker process) and write its
+    histograms to the task's own shard file. The histograms of a part
+    of a split chain are written with their part number (the overflow
+    is already shifted, the negative bins are set to zero by
+    merge_shards once all parts are added). Returns the shard and the
+    Profile of the task.
+    """
+    task, shard = args
+    group, hists, profile = _run_task(task)
+    index, nparts = task['part']
+    _remove_output(shard)
+    with profiling(profile), HistWriter(shard) as writer:
+        if nparts == 1:
+            with stage('merge'):
+                hists = _finalize_hists(task['backend'], hists)
+            writer.write(hists, task['digests'])
+        else:
+            if task['backend'] != 'numpy':
+                [shift_overflow(h) for h in hists]
+            writer.write(hists, task['digests'],
+                         {'part'              : index,
+                          'nparts'            : nparts,
+                          'negatives_to_zero' : task['backend'] != 'numpy'})
+    return shard, profile
+
+def _run_tasks_shards(tasks, shard_dir, jobs=1):
+    """
+    Run a list of tasks serially or on a pool of jobs processes
+    (longest first), each task writing its own shard file in shard_dir. Returns the paths of
+    the shards.
+    """
+    if not os.path.isdir(shard_dir):
+        os.makedirs(shard_dir)
+    if jobs > 1 and len(tasks) > 1:
+        tasks = longest_first(tasks, _task_costs(tasks))
+    args = [(task, _task_shard(shard_dir, task)) for task in tasks]
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        try:
+            # one task at a time so the longest tasks start first
+            results = pool.map(_run_task_shard, args, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_run_task_shard(arg) for arg in args]
+    [_merge_profile(profile) for shard, profile in results]
+    return [shard for shard, profile in results]
+
+def _run_tasks(tasks, writer, jobs=1, shard_dir=None):
+    """
+    Run a list of tasks serially (jobs=1) or on a pool of jobs
+    processes, the tasks with the longest estimated time first (see
+    aidapy.hist.cost). The parts of each (tree, process) group are merged,
+    finalized and handed to the writer as soon as all of them are
+    done. With a shard_dir, the tasks write shard files which are
+    then merged (see merge_shards).
+    """
+    if not tasks:
+        return
+    if shard_dir is not None:
+        _merge_shards(_run_tasks_shards(tasks, shard_dir, jobs), writer, remove=True)
+        return
+    remaining, backends, trees = {}, {}, {}
+    for task in tasks:
+        remaining[task['group']] = remaining.get(task['group'], 0) + 1
+        backends[task['group']]  = task['backend']
+        trees[task['group']]     = task['tree']
+    digests  = _task_digests(tasks)
+    partials = dict((group, []) for group in remaining)
+    if jobs > 1:
+        pool    = multiprocessing.Pool(min(jobs, len(tasks)))
+        results = pool.imap_unordered(_run_task, longest_first(tasks, _task_costs(tasks)))
+    else:
+        pool    = None
+        results = (_run_task(task) for task in tasks)
+    try:
+        for group, hists, profile in results:
+            _merge_profile(profile)
+            partials[group].append(hists)
+            remaining[group] -= 1
+            if remaining[group] == 0:
+                with stage('merge', tree=trees[group], process=group[-1]):
+                    hists = _finalize_hists(backends[group], _merge_hists(partials.pop(group)))
+                writer.write(hists, digests)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+def _generate_mc(backend, mc_prod_yaml_file, hist_yaml, mc_prefix, aida_tree, lumi, ignore,
+                 output, Z_genWeights, provide_file_dict, do_fast2full, implicit_mt=False, jobs=1,
+                 chunk_size=None, max_memory=None, writer=None):
+    """
+    Shared implementation of the generate_mc_hists* functions. If no
+    writer is given, one is opened (and closed) for the output file.
+    """
+    # provide file dict to not rebuild if it exists somewhere.
+    if provide_file_dict is not None:
+        file_dict = provide_file_dict
+    else:
+        file_dict = _root_file_dict(mc_prod_yaml_file)
+
+    with open(hist_yaml) as hf:
+        hist_dict = yaml.load(hf)
+
+    own_writer = writer is None
+    if own_writer:
+        writer = HistWriter(output)
+    try:
+        tasks = _mc_tasks(backend, file_dict, hist_dict, mc_prefix, aida_tree, lumi, ignore,
+                          Z_genWeights, writer.keys, jobs, implicit_mt,
+                          chunk_size, max_memory, writer.manifest)
+        _run_tasks(tasks, writer, jobs)
+
+        ## Lets try to make some systematic histograms from the
+        ## fastsim samples.  This is hard coded naming based on YAML
+        ## naming defined in the template.
+        if aida_tree == 'nominal' and do_fast2full:
+            gen_fast2full(output, hist_dict, writer)
+    finally:
+        if own_writer:
+            writer.close()
+
 def generate_mc_hists(mc_prod_yaml_file, hist_yaml, mc_prefix='', aida_tree='nominal', lumi=36.1,
                       ignore=['Zll_FULL_main','Wjets_FULL_main'], output='out.root', Z_genWeights=False,
-                      provide_file_dict=None, do_fast2full=True):
+                      provide_file_dict=None, do_fast2full=True, jobs=1):
     """
     Create MC histograms from two YAML config files.
 
@@ -84,91 +650,56 @@ def generate_mc_hists(mc_prod_yaml_file, hist_yaml, mc_prefix='', aida_tree='nom
     do_fast2full: bool
       Do Fast to Full histograms (try scale fast sim hists to appropriate "full" hists).
       Only for nominal trees.
+    jobs: int
+      Number of processes; each process' chain is split into this
+      many parts (by files, or by entry ranges) and the partial
+      histograms are added together.
     """
+    _generate_mc('root', mc_prod_yaml_file, hist_yaml, mc_prefix, aida_tree, lumi, ignore,
+                 output, Z_genWeights, provide_file_dict, do_fast2full, jobs=jobs)
 
-    # provide file dict to not rebuild if it exists somewhere.
-    if provide_file_dict is not None:
-        file_dict = provide_file_dict
-    else:
-        file_dict = _root_file_dict(mc_prod_yaml_file)
-
-    chains = {}
-    for fde, fdk in file_dict.items():
-        ckey, tname = fde, fdk[0]
-        if 'fast' in tname and aida_tree != 'nominal':
-            continue
-        if 'Fakes' in fde:
-            chains[ckey] = ROOT.TChain('AIDAfk_'+aida_tree)
-            [chains[ckey].Add(mc_prefix+'/'+f) for f in fdk[1]]
-        else:
-            if aida_tree == 'nominal':
-                chains[ckey] = ROOT.TChain('AIDA_'+tname)
-            else:
-                chains[ckey] = ROOT.TChain('AIDA_'+aida_tree)
-            [chains[ckey].Add(mc_prefix+'/'+f) for f in fdk[1]]
-    for ig in ignore:
-        if ig in chains:
-            del chains[ig]
+def generate_mc_hists_rdf(mc_prod_yaml_file, hist_yaml, mc_prefix='', aida_tree='nominal', lumi=36.1,
+                          ignore=['Zll_FULL_main','Wjets_FULL_main'], output='out.root', Z_genWeights=False,
+                          provide_file_dict=None, do_fast2full=True, implicit_mt=False, jobs=1):
+    """
+    Create MC histograms from two YAML config files using
+    ROOT.RDataFrame. All histograms (and weight variations) for a
+    process are booked lazily and filled in a single event loop over
+    the process' chain.
 
-    with open(hist_yaml) as hf:
-        hist_dict = yaml.load(hf)
+    Parameters
+    ----------
+    mc_prod_yaml_file: str
+      Path to YAML file which organizes MC files
+    hist_yaml: str
+      Path to YAML file which defines the desired histograms
+    mc_prefix: str
+      The path to where MC files exist
+    aida_tree: str
+      Which AIDA tree to use to build the histograms
+    lumi: float
+      What luminosity to scale to
+    ignore: list
+      Different process prefixes (defined in the MC YAML file) to ignore
+    output: str
+      Path and name of output ROOT file
+    Z_genWeights: bool
+      Build histograms using the generator weights available in Ztautau
+    do_fast2full: bool
+      Do Fast to Full histograms (try scale fast sim hists to appropriate "full" hists).
+      Only for nominal trees.
+    implicit_mt: bool or int
+      Enable ROOT's implicit multithreading for the event loops
+      (if an int, the number of threads to use)
+    jobs: int
+      Number of processes; each process' chain is split into this
+      many parts (by files, or by entry ranges) and the partial
+      histograms are added together.
+    """
+    _generate_mc('rdf', mc_prod_yaml_file, hist_yaml, mc_prefix, aida_tree, lumi, ignore,
+                 output, Z_genWeights, provide_file_dict, do_fast2full, implicit_mt, jobs)
 
-    output_file = ROOT.TFile(output,'UPDATE')
-    rootkeys    = [str(o.GetName()) for o in output_file.GetListOfKeys()]
-    for pname, chain in chains.items():
-        if 'main' not in pname and aida_tree != 'nominal':
-            continue
-        for hist_name, hist_props in hist_dict.items():
-            hname  = pname+'_'+aida_tree+'_'+hist_name
-            if hname in rootkeys:
-                logger.warning(hname+' already in file')
-            else:
-                cut = str(lumi)+'*nomWeightwLum*('+hist_props['cut']+')'
-                h = tree2hist(chain,hname,hist_props['bins'],hist_props['var'],cut,True,True)
-                logger.info(h)
-                h.Write()
-
-            if aida_tree == 'nominal' and 'FAST' not in pname and 'main' in hname:
-                for systW in _systematic_weights:
-                    for ud in systW[:-1]:
-                        hname = pname+'_'+aida_tree+'_'+hist_name+'_'+ud
-                        if hname in rootkeys:
-                            logger.warning(hname+' already in file')
-                        else:
-                            cut = str(lumi)+'*'+ud+'*('+hist_props['cut']+')'
-                            h = tree2hist(chain,hname,hist_props['bins'],hist_props['var'],cut,True,True)
-                            logger.info(h)
-                            h.Write()
-                for bsystW in _systematic_btag_weights:
-                    for ud in bsystW[:-1]:
-                        hname = pname+'_'+aida_tree+'_'+hist_name+'_'+ud
-                        if hname in rootkeys:
-                            logger.warning(hname+' already in file')
-                        else:
-                            cut = str(lumi)+'*'+ud+'*('+hist_props['cut']+')'
-                            h = tree2hist(chain,hname,hist_props['bins'],hist_props['var'],cut,True,True)
-                            logger.info(h)
-                            h.Write()
-
-            if aida_tree == 'nominal' and 'Ztautau' in pname and Z_genWeights:
-                for i in range(1,115):
-                    hname = pname+'_'+aida_tree+'_'+hist_name+'_genWeight'+str(i)
-                    if hname in rootkeys:
-                        logger.warning(hname+' already in file')
-                    else:
-                        cut = str(lumi)+'*weightSyswLum_genWeight'+str(i)+'*('+hist_props['cut']+')'
-                        h = tree2hist(chain,hname,hist_props['bins'],hist_props['var'],cut,True,True)
-                        logger.info(h)
-                        h.Write()
-    output_file.Close()
-
-    ## Reopen the output file and lets try to make some systematic
-    ## histograms from the fastsim samples.  This is hard coded naming
-    ## based on YAML naming defined in the template.
-    if aida_tree == 'nominal' and do_fast2full:
-        gen_fast2full(output, hist_dict)
-
-def generate_data_hists(data_root_file, hist_yaml, output='out.root'):
+def generate_data_hists(data_root_file, hist_yaml, output='out.root', jobs=1):
     """
     Using the histogram YAML config and a single ROOT file containing
     an AIDA ntuple of data, build histograms.
@@ -181,33 +712,150 @@ def generate_data_hists(data_root_file, hist_yaml, output='out.root'):
       Path to a YAML file which defines the desired histograms
     output: str
       Path and name of output ROOT file
+    jobs: int
+      Number of processes (the data is split into entry ranges)
     """
-    chain = ROOT.TChain('AIDA_nominal')
-    chain.Add(data_root_file)
-    output_file = ROOT.TFile(output,'UPDATE')
-    rootkeys = [str(o.GetName()) for o in output_file.GetListOfKeys()]
     with open(hist_yaml) as hf:
         hist_dict = yaml.load(hf)
-    for hist_name, hist_props in hist_dict.items():
-        hname = 'Data_'+hist_name
-        if hname in rootkeys:
-            logger.warning(hname+' already in file')
-        else:
-            cut = '1.0*('+hist_props['cut']+')'
-            h   = tree2hist(chain,hname,hist_props['bins'],hist_props['var'],cut,True,True)
-            logger.info(h)
-            h.Write()
+    with HistWriter(output) as writer:
+        _run_tasks(_data_tasks(data_root_file, hist_dict, writer.keys, jobs, writer.manifest),
+                   writer, jobs)
+
+def _read_config(yaml_config, systematics='ALL', numpy=False, rdf=False):
+    """
+    Read the generate_hists configuration: returns the config, the
+    backend, the systematic trees, the file dictionary and the
+    histogram definitions.
+    """
+    with open(yaml_config) as f:
+        config = yaml.load(f)
+
+    if numpy and rdf:
+        raise ValueError('numpy and rdf cannot both be used!')
+    if numpy:
+        backend = 'numpy'
+    elif rdf:
+        backend = 'rdf'
+    else:
+        backend = 'root'
+
+    if systematics == 'ALL':
+        systematics = _systematic_trees
+    elif not isinstance(systematics,list):
+        raise TypeError('systematics parameter should be a list!')
+
+    file_dict = _root_file_dict(config['mc_config'])
+    with open(config['hist_config']) as hf:
+        hist_dict = yaml.load(hf)
+    return config, backend, systematics, file_dict, hist_dict
+
+def _all_leaves(config, file_dict, hist_dict, backend, systematics, rootkeys, manifest={}):
+    """
+    The leaves of a generate_hists run (data first so it runs
+    alongside the MC).
+    """
+    leaves = list(_data_leaves(config['data_file'], hist_dict, rootkeys, manifest))
+    for tn in ['nominal']+list(systematics):
+        leaves += _mc_leaves(backend, file_dict, hist_dict, config['mc_prefix'], tn, 36.1,
+                             ['Zll_FULL_main','Wjets_FULL_main'], False, rootkeys, manifest)
+    return leaves
+
+def _all_tasks(config, file_dict, hist_dict, backend, systematics, rootkeys, split=1,
+               implicit_mt=False, max_memory=None, manifest={}):
+    """
+    The flat list of tasks of a generate_hists run, planned together
+    (see build_plan).
+    """
+    with stage('plan', tree=None, process=None):
+        plan = build_plan(_all_leaves(config, file_dict, hist_dict, backend, systematics, rootkeys,
+                                      manifest))
+        return _plan_tasks(plan, split, implicit_mt, max_memory=max_memory)
 
-    output_file.Close()
+def plan_hists(yaml_config, output=None, systematics='ALL', numpy=False, rdf=False):
+    """
+    Plan a generate_hists run without reading any data: the passes
+    over the data and the histograms filled in each (see
+    aidapy.hist.plan, format_plan gives a readable table). If the
+    output file exists, the histograms which are up to date in it are
+    left out, as generate_hists would.
 
+    Parameters
+    ----------
+    yaml_config: str
+      Path to the YAML config file
+    output: str, optional
+      Name of the output ROOT file
+    systematics: str or list
+      Which systematic trees to process. If not 'ALL', provide a list
+    numpy: bool
+      Plan for the numpy backend
+    rdf: bool
+      Plan for the ROOT.RDataFrame backend
 
-def generate_hists(yaml_config, output='out.root', systematics='ALL', numpy=False):
+    Returns
+    -------
+    list(dict)
+      The passes
+    """
+    config, backend, systematics, file_dict, hist_dict = _read_config(yaml_config, systematics,
+                                                                      numpy, rdf)
+    rootkeys, manifest = set(), {}
+    if output is not None and os.path.exists(output):
+        rootkeys, manifest = set(open_index(output)), _read_manifest(output)
+    return build_plan(_all_leaves(config, file_dict, hist_dict, backend, systematics, rootkeys,
+                                  manifest))
+
+def estimate_hists(yaml_config, output=None, systematics='ALL', numpy=False, rdf=False,
+                   implicit_mt=False, split=1, max_memory=None):
+    """
+    Dry run of generate_hists: the tasks it would run and their
+    estimated cost (bytes read, events, histogram fills, peak memory
+    and time, see aidapy.hist.cost) from the file sizes and tree entry
+    counts only. format_costs gives a readable table.
+
+    Parameters
+    ----------
+    yaml_config: str
+      Path to the YAML config file
+    output: str, optional
+      Name of the output ROOT file (histograms up to date in it are
+      left out)
+    systematics: str or list
+      Which systematic trees to process. If not 'ALL', provide a list
+    numpy: bool
+      Estimate for the numpy backend
+    rdf: bool
+      Estimate for the ROOT.RDataFrame backend
+    implicit_mt: bool or int
+      ROOT implicit multithreading (only for rdf)
+    split: int
+      Split each chain into this many parts
+    max_memory: int, optional
+      Memory budget in bytes per (numpy) task
+
+    Returns
+    -------
+    tuple(list(dict), list(OrderedDict))
+      The tasks and their costs
+    """
+    config, backend, systematics, file_dict, hist_dict = _read_config(yaml_config, systematics,
+                                                                      numpy, rdf)
+    rootkeys, manifest = set(), {}
+    if output is not None and os.path.exists(output):
+        rootkeys, manifest = set(open_index(output)), _read_manifest(output)
+    tasks = _all_tasks(config, file_dict, hist_dict, backend, systematics, rootkeys, split,
+                       implicit_mt, max_memory, manifest)
+    return tasks, _task_costs(tasks)
+
+def generate_hists(yaml_config, output='out.root', systematics='ALL', numpy=False, rdf=False,
+                   implicit_mt=False, jobs=1, split=1, max_memory=None, shard_dir=None, slot=None,
+                   profile=None):
     """
     Generate histograms based on a single YAML file.
-    This is essentially a wrapper around the functions
-    - generate_data_hists
-    - generate_mc_hists
-    steered by the config file
+    The data and MC histograms of all trees (as in
+    generate_data_hists and generate_mc_hists) are planned together
+    (see plan_hists): each chain is read once for all its histograms
+    and identical histograms are filled once.
 
     Parameters
     ----------
@@ -217,44 +865,137 @@ def generate_hists(yaml_config, output='out.root', systematics='ALL', numpy=Fals
       Name of output ROOT file
     systematics: str or list
       Which systematic trees to process. If not 'ALL', provide a list
+    numpy: bool
+      Generate the MC histograms with numpy (generate_mc_hists_numpy)
+    rdf: bool
+      Generate the MC histograms with ROOT.RDataFrame (generate_mc_hists_rdf)
+    implicit_mt: bool or int
+      Enable ROOT's implicit multithreading (only for rdf)
+    jobs: int
+      Number of processes to use. If greater than 1, the passes of the
+      plan (each (tree, process) chain and the data) are processed as
+      tasks by a pool of workers, the longest (estimated, see
+      estimate_hists) first; only this process writes to the output
+      file.
+    split: int
+      Split each chain into this many parts (by files or by entry
+      ranges) to balance the load over the workers.
+    max_memory: int, optional
+      Memory budget in bytes per (numpy) task; chains are streamed in
+      chunks sized to fit it (only for numpy)
+    shard_dir: str, optional
+      Each task writes its histograms to its own shard file in this
+      directory; the shards are then merged into the output file (see
+      merge_shards).
+    slot: tuple(int, int), optional
+      (index, count) of a batch job: the tasks are distributed over
+      the count jobs balanced by their estimated time (see
+      aidapy.hist.cost.assign_slots) and the tasks of job index are
+      run, its shards are written to shard_dir and not
+      merged (use merge_hist_shards once all jobs are done). The
+      output file is not read, so all histograms are generated.
+    profile: str, optional
+      Profile the run and write the report (time, events, bytes read
+      and histograms per tree, process and stage, see
+      aidapy.hist.profiling) to this JSON file
     """
-    with open(yaml_config) as f:
-        config = yaml.load(f)
+    with profiling(Profile() if profile is not None else None) as run_profile:
+        _generate_hists(yaml_config, output, systematics, numpy, rdf, implicit_mt, jobs, split,
+                        max_memory, shard_dir, slot)
+    if run_profile is not None:
+        run_profile.save(profile)
 
-    if numpy:
-        gmch = generate_mc_hists_numpy
-    else:
-        gmch = generate_mc_hists
+def _generate_hists(yaml_config, output, systematics, numpy, rdf, implicit_mt, jobs, split,
+                    max_memory, shard_dir, slot):
+    config, backend, systematics, provided, hist_dict = _read_config(yaml_config, systematics,
+                                                                     numpy, rdf)
 
-    provided = _root_file_dict(config['mc_config'])
-    gmch(config['mc_config'],config['hist_config'],
-         mc_prefix=config['mc_prefix'], output=output,
-         provide_file_dict=provided)
+    if slot is not None:
+        if shard_dir is None:
+            raise ValueError('a batch slot requires a shard_dir!')
+        index, count = slot
+        if not 0 <= index < count:
+            raise ValueError('slot must be (I, N) with 0 <= I < N, got '+str(tuple(slot)))
+        tasks = _all_tasks(config, provided, hist_dict, backend, systematics, set(), split,
+                           implicit_mt, max_memory)
+        _run_tasks_shards(assign_slots(tasks, _task_costs(tasks), count)[index], shard_dir, jobs)
+        return
 
-    if systematics == 'ALL':
-        for tn in _systematic_trees:
-            gmch(config['mc_config'],config['hist_config'], aida_tree=tn,
-                 mc_prefix=config['mc_prefix'], output=output,
-                 provide_file_dict=provided)
-    else:
-        if not isinstance(systematics,list):
-            raise TypeError('systematics parameter should be a list!')
-        for tn in systematics:
-            gmch(config['mc_config'],config['hist_config'], aida_tree=tn,
-                 mc_prefix=config['mc_prefix'], output=output,
-                 provide_file_dict=provided)
+    # a single writer for the whole run, only this process writes.
+    with HistWriter(output) as writer:
+        tasks = _all_tasks(config, provided, hist_dict, backend, systematics, writer.keys,
+                           split, implicit_mt, max_memory, writer.manifest)
+        _run_tasks(tasks, writer, jobs, shard_dir)
+        gen_fast2full(output, hist_dict, writer)
 
-    generate_data_hists(config['data_file'], config['hist_config'],
-                        output=output)
+def merge_hist_shards(yaml_config, shards, output='out.root', remove=False):
+    """
+    Merge the shard files of generate_hists batch jobs (see the slot
+    parameter) into the output file and build the fast to full sim
+    histograms.
 
+    Parameters
+    ----------
+    yaml_config: str
+      Path to the YAML config file
+    shards: list(str)
+      Paths of the shard ROOT files
+    output: str
+      Name of output ROOT file
+    remove: bool
+      Remove the shards after a successful merge
+    """
+    with open(yaml_config) as f:
+        config = yaml.load(f)
+    with open(config['hist_config']) as hf:
+        hist_dict = yaml.load(hf)
+    with HistWriter(output) as writer:
+        _merge_shards(shards, writer, remove)
+        gen_fast2full(output, hist_dict, writer)
+
+_band_groups = ['tree', 'weight', 'btag', 'genWeight', 'modeling', 'lumi']
+
+def _band_variations(pname, hist_name, do_gen_weights=False):
+    """
+    The variations entering the systematic band of a process as
+    (group, name, reference, factor) tuples. The contribution of each
+    is (factor*(name-reference))**2, a reference of None is the
+    nominal histogram.
+    """
+    nominal, variations = mc_key(pname+'_FULL_main', 'nominal', hist_name), []
+    for prefix, label in _systematic_ud_prefixes:
+        up, down = _tree_pair_names(prefix)
+        variations.append(('tree', str(nominal._replace(tree=up)), str(nominal._replace(tree=down)),
+                           0.5))
+    for name, label in _systematic_singles:
+        variations.append(('tree', str(nominal._replace(tree=name)), None, 1.0))
+    for group, table in [('weight', _systematic_weights), ('btag', _systematic_btag_weights)]:
+        for up, down, label in table:
+            variations.append((group, str(nominal._replace(weight=up)),
+                               str(nominal._replace(weight=down)), 0.5))
+    if pname == 'Ztautau' and do_gen_weights:
+        for i in range(1,115): ## all 115 explode the sys band. need to look into this
+            variations.append(('genWeight', str(nominal._replace(weight='genWeight'+str(i))),
+                               None, 1.0))
+    for name, reference, factor, label in _systematic_modeling.get(pname, []):
+        variations.append(('modeling', str(nominal._replace(sample=name)),
+                           None if reference is None else str(nominal._replace(sample=reference)),
+                           factor))
+    return variations
 
 def total_systematic_histogram(root_file, hist_name=None,
                                proc_names=['ttbar','Wt','WW','Ztautau','Diboson','Fakes'],
-                               return_stat_error=False, do_gen_weights=False):
+                               return_stat_error=False, do_gen_weights=False,
+                               return_breakdown=False):
     """
     A function to calculate and return a histogram with a total
     systematic error band in numpy format.
 
+    All nominal and variation histograms are read at once (see
+    load_hists) and arranged in a (process x variation x bin) tensor;
+    the symmetrized differences are summed in quadrature with array
+    reductions. Missing variations are left out (with one warning).
+
     Parameters
     ----------
     root_file: ROOT.TFile
@@ -263,6 +1004,14 @@ def total_systematic_histogram(root_file, hist_name=None,
       The name of the histogram to generate the band for (must exist in ROOT file!)
     proc_names: str
       The names of the processes contributing to the band (must exist in ROOT file!)
+    return_stat_error: bool
+      Also return the statistical error of the summed nominal
+    do_gen_weights: bool
+      Include the Ztautau generator weight variations
+    return_breakdown: bool
+      Also return the band of each process and of each group of
+      systematics ('tree', 'weight', 'btag', 'genWeight', 'modeling'
+      and 'lumi') as {'process' : {name : band}, 'group' : {name : band}}
 
     Returns
     -------
@@ -272,130 +1021,118 @@ def total_systematic_histogram(root_file, hist_name=None,
        the systematic error in each bin
     numpy.ndarray
        the edges of the histogram bins
+    numpy.ndarray
+       the statistical error in each bin (if return_stat_error)
+    dict
+       the breakdown of the band (if return_breakdown)
     """
     if hist_name is None:
         logger.error('Why no histogram name?')
         exit()
-    listofkeys = root_file.GetListOfKeys()
-    nominals   = { pname : root_file.Get(pname+'_FULL_main_nominal_'+hist_name)
-                   for pname in proc_names }
-    nominals   = { pname : hist2array(h,return_edges=True, return_err=True)
-                   for pname, h in nominals.items() }
-    edges      = nominals['ttbar'][1][0]
-    nbins      = len(nominals['ttbar'][0])
-    total_band = np.zeros(nbins,dtype=np.float32)
-    nom_h      = np.zeros(nbins,dtype=np.float32)
-    nom_stater = np.zeros(nbins,dtype=np.float32)
-    for pname, nom in nominals.items():
-        nom_h = nom_h + nom[0]
-        if return_stat_error:
-            nom_stater = nom_stater + nom[2]*nom[2]
-    for pname in proc_names:
-        pnom = nominals[pname][0]
-        # the two sided systematics in trees
-        for ud in _systematic_ud_prefixes:
-            if 'MET_Soft' in ud[0]: updown = ['Up','Down'] # why does MET use different name... lame
-            else:                updown = ['__1up','__1down']
-            hname_up   = pname+'_FULL_main_'+ud[0]+updown[0]+'_'+hist_name
-            hname_down = pname+'_FULL_main_'+ud[0]+updown[1]+'_'+hist_name
-            if hname_up not in listofkeys:
-                logger.warning(hname_up+' systematic not available for process '+pname+'!')
-                continue
-            if hname_down not in listofkeys:
-                logger.warning(hname_down+' systematic not available for process '+pname+'!')
-                continue
-            arr_up      = hist2array(root_file.Get(hname_up))
-            arr_down    = hist2array(root_file.Get(hname_down))
-            total_band += (0.5*(arr_up-arr_down))*(0.5*(arr_up-arr_down))
-        # the one sided systematics in trees, symmetrize it
-        for osed in _systematic_singles:
-            hname = pname+'_FULL_main_'+osed[0]+'_'+hist_name
-            if hname not in listofkeys:
-                logger.warning(hname+' systematic not available!')
-                continue
-            arr         = hist2array(root_file.Get(hname))
-            total_band += (pnom-arr)*(pnom-arr)
-        # the hists from weights (including b-tagging)
-        for wud in (_systematic_weights+_systematic_btag_weights):
-            u_ws, d_ws  = wud[0].split('wLum_')[-1], wud[1].split('wLum_')[-1]
-            arr_up      = hist2array(root_file.Get(pname+'_FULL_main_nominal_'+hist_name+'_weightSyswLum_'+u_ws))
-            arr_down    = hist2array(root_file.Get(pname+'_FULL_main_nominal_'+hist_name+'_weightSyswLum_'+d_ws))
-            total_band +=(0.5*(arr_up-arr_down))*(0.5*(arr_up-arr_down))
-        # Ztautau generator weights
-        if 'Ztautau' in pname and do_gen_weights:
-            for i in range(1,115): ## all 115 explode the sys band. need to look into this
-                hname = pname+'_FULL_main_'+hist_name+'_genWeight'+str(i)
-                if hname not in listofkeys:
-                    logger.warning(hname+' systematic not available for process '+pname+'!')
-                    continue
-                arr         = hist2array(root_file.Get(hname))
-                total_band += (pnom-arr)*(pnom-arr)
-        # lumi uncertainty on fixed backgrounds
-        if pname == 'Diboson' or pname == 'RareSM' or pname == 'Fakes':
-            total_band += (0.0374*pnom)*(0.0374*pnom)
-        # ttbar modeling uncertainties
-        if pname == 'ttbar' and ('ttbar_FULL_main_nominal_'+hist_name) in listofkeys:
-            if ('ttbar_FULL_sysARup_nominal_'+hist_name) in listofkeys \
-               and('ttbar_FULL_sysARdown_nominal_'+hist_name) in listofkeys:
-                full_ARU    = hist2array(root_file.Get('ttbar_FULL_sysARup_nominal_'+hist_name))
-                full_ARD    = hist2array(root_file.Get('ttbar_FULL_sysARdown_nominal_'+hist_name))
-                total_band += np.power(0.5*(full_ARU-full_ARD),2)
-            else:
-                logger.warning('ttbar additional radiation sys histograms not present')
-            if ('ttbar_FULL_sysFH_nominal_'+hist_name) in listofkeys:
-                full_FH     = hist2array(root_file.Get('ttbar_FULL_sysFH_nominal_'+hist_name))
-                total_band += np.power(pnom-full_FH,2)
-            else:
-                logger.warning('ttbar hadronization sys histograms not present')
-            if ('ttbar_FULL_sysHS_nominal_'+hist_name) in listofkeys:
-                full_HS     = hist2array(root_file.Get('ttbar_FULL_sysHS_nominal_'+hist_name))
-                total_band += np.power(pnom-full_HS,2)
-            else:
-                logger.warning('ttbar hard scattering sys histograms not present')
-        elif pname == 'ttbar':
-            logger.warning('Cannot add ttbar modeling systematics to band')
-        else:
-            pass
-        # Wt modeling uncertainties
-        if pname == 'Wt' and ('Wt_FULL_main_nominal_'+hist_name) in listofkeys:
-            if ('Wt_FULL_sysARup_nominal_'+hist_name) in listofkeys \
-               and ('Wt_FULL_sysARdown_nominal_'+hist_name) in listofkeys:
-                full_ARU    = hist2array(root_file.Get('Wt_FULL_sysARup_nominal_'+hist_name))
-                full_ARD    = hist2array(root_file.Get('Wt_FULL_sysARdown_nominal_'+hist_name))
-                total_band += np.power(0.5*(full_ARU-full_ARD),2)
-            else:
-                logger.warning('Wt additional radiation sys histograms not present')
-            if ('Wt_FULL_sysFH_nominal_'+hist_name) in listofkeys:
-                full_FH     = hist2array(root_file.Get('Wt_FULL_sysFH_nominal_'+hist_name))
-                total_band += np.power(pnom-full_FH,2)
-            else:
-                logger.warning('Wt hadronization sys histograms not present')
-            if ('Wt_FULL_sysHS1_nominal_'+hist_name) in listofkeys \
-               and ('Wt_FULL_sysHS2_nominal_'+hist_name) in listofkeys:
-                full_HS1    = hist2array(root_file.Get('Wt_FULL_sysHS1_nominal_'+hist_name))
-                full_HS2    = hist2array(root_file.Get('Wt_FULL_sysHS2_nominal_'+hist_name))
-                total_band += np.power(full_HS1-full_HS2,2)
-            else:
-                logger.warning('Wt hard scattering sys histograms not present')
-            if ('Wt_FULL_sysDS_nominal_'+hist_name) in listofkeys:
-                full_DS     = hist2array(root_file.Get('Wt_FULL_sysDS_nominal_'+hist_name))
-                total_band += np.power(full_DS-pnom,2)
-        elif pname == 'Wt':
-            logger.warning('Cannot add Wt modeling systematics to band')
-        else:
-            pass
+    band   = _systematic_band(root_file, hist_name, proc_names, do_gen_weights)
+    result = [band['nominal'], band['band'], band['edges']]
+    if return_stat_error:
+        result.append(band['stat_error'])
+    if return_breakdown:
+        result.append(band['breakdown'])
+    return tuple(result)
 
-    # root that summed quadrature.
-    total_band = np.sqrt(total_band)
+def _systematic_band(root_file, hist_name, proc_names, do_gen_weights=False):
+    """
+    The systematic band of one histogram (see total_systematic_histogram)
+    as a dict with the 'nominal', 'band', 'edges', 'stat_error',
+    'processes' (the nominal of each process) and 'breakdown'.
+    """
+    # the rows to read: the nominals first, then each variation once
+    names, rows = [], {}
+    def row(name):
+        if name not in rows:
+            rows[name] = len(names)
+            names.append(name)
+        return rows[name]
+    nominal_rows = [row(str(mc_key(pname+'_FULL_main', 'nominal', hist_name)))
+                    for pname in proc_names]
+    variations   = [_band_variations(pname, hist_name, do_gen_weights) for pname in proc_names]
+    nvar         = max([len(v) for v in variations]+[1])
+    up_rows      = np.zeros((len(proc_names), nvar), dtype=np.intp)
+    down_rows    = np.zeros((len(proc_names), nvar), dtype=np.intp)
+    factors      = np.zeros((len(proc_names), nvar), dtype=np.float64)
+    group_ids    = np.full((len(proc_names), nvar), -1, dtype=np.intp)
+    for i, pvariations in enumerate(variations):
+        for j, (group, name, reference, factor) in enumerate(pvariations):
+            up_rows[i,j]   = row(name)
+            down_rows[i,j] = nominal_rows[i] if reference is None else row(reference)
+            factors[i,j]   = factor
+            group_ids[i,j] = _band_groups.index(group)
 
-    if return_stat_error:
-        nom_stater = np.sqrt(nom_stater)
-        return nom_h, total_band, edges, nom_stater
-    return nom_h, total_band, edges
+    values, edges, found, sumw2 = load_hists(root_file, names, return_sumw2=True)
+    if not found[nominal_rows].all():
+        raise ValueError('Missing nominal histograms: '+
+                         ', '.join(n for n, f in zip(names, found[nominal_rows]) if not f))
+    valid   = found[up_rows] & found[down_rows] & (group_ids >= 0)
+    missing = (group_ids >= 0) & ~valid
+    if missing.any():
+        logger.warning(str(int(missing.sum()))+' systematic histograms for '+hist_name+
+                       ' not available (e.g. '+names[up_rows[missing][0]]+')')
+
+    # (process x variation x bin)
+    nominals = values[nominal_rows]
+    deltas   = (factors*valid)[:,:,np.newaxis]*(values[up_rows]-values[down_rows])
+    squares  = deltas*deltas
+    lumi     = np.array([_lumi_uncertainties.get(pname, 0.0) for pname in proc_names])
+    lumi_sq  = (lumi[:,np.newaxis]*nominals)**2
+    proc_sq  = squares.sum(axis=1)+lumi_sq
+
+    groups = dict((group, np.sqrt(squares[group_ids == i].sum(axis=0)))
+                  for i, group in enumerate(_band_groups) if group != 'lumi')
+    groups['lumi'] = np.sqrt(lumi_sq.sum(axis=0))
+    return {'nominal'    : nominals.sum(axis=0).astype(np.float32),
+            'band'       : np.sqrt(proc_sq.sum(axis=0)).astype(np.float32),
+            'edges'      : edges,
+            'stat_error' : np.sqrt(sumw2[nominal_rows].sum(axis=0)).astype(np.float32),
+            'processes'  : OrderedDict(zip(proc_names, nominals)),
+            'breakdown'  : {'process' : dict(zip(proc_names, np.sqrt(proc_sq))),
+                            'group'   : groups}}
+
+def systematic_bands(root_file, hist_names=None,
+                     proc_names=['ttbar','Wt','WW','Ztautau','Diboson','Fakes'],
+                     do_gen_weights=False):
+    """
+    Compute the systematic bands of many histograms in one pass over
+    the file: the keys are indexed once and each histogram is read
+    once. The results can be given to the plotters (the band argument
+    of hplot_mpl and hplot_root) so they do not read the MC again.
+
+    Parameters
+    ----------
+    root_file: ROOT.TFile
+      The ROOT file with the histograms
+    hist_names: list(str), optional
+      The histograms to compute the band for (all histograms with
+      data in the file if None)
+    proc_names: list(str)
+      The names of the processes contributing to the band
+    do_gen_weights: bool
+      Include the Ztautau generator weight variations
+
+    Returns
+    -------
+    OrderedDict
+      hist_name -> dict with the 'nominal' bin heights, the total
+      systematic 'band', the 'edges', the 'stat_error', the nominal of
+      each process ('processes') and the 'breakdown' (see
+      total_systematic_histogram)
+    """
+    indexed = KeyIndex(root_file)
+    if hist_names is None:
+        hist_names = indexed.index.values('hist', process='Data')
+    return OrderedDict((hist_name, _systematic_band(indexed, hist_name, proc_names, do_gen_weights))
+                       for hist_name in hist_names)
 
 def generate_mc_hists_numpy(mc_prod_yaml_file, hist_yaml, mc_prefix, aida_tree='nominal', lumi=36.1,
                             ignore=['Zll_FULL_main','Wjets_FULL_main'], output='out.root', Z_genWeights=False,
-                            provide_file_dict=None, do_fast2full=True):
+                            provide_file_dict=None, do_fast2full=True, jobs=1,
+                            chunk_size=None, max_memory=None):
     """
     Create MC histograms from two YAML config files.
 
@@ -420,192 +1157,104 @@ def generate_mc_hists_numpy(mc_prod_yaml_file, hist_yaml, mc_prefix, aida_tree='
     do_fast2full: bool
       Do Fast to Full histograms (try scale fast sim hists to appropriate "full" hists).
       Only for nominal trees.
+    jobs: int
+      Number of processes; each process' chain is split into this
+      many parts (by files, or by entry ranges) and the partial
+      histograms are added together.
+    chunk_size: int, optional
+      Read the chains in chunks of this many entries (the histograms
+      are accumulated chunk by chunk)
+    max_memory: int, optional
+      Memory budget in bytes used to size the chunks (if chunk_size
+      is not given)
     """
-    # provide file dict to not rebuild if it exists somewhere.
+    _generate_mc('numpy', mc_prod_yaml_file, hist_yaml, mc_prefix, aida_tree, lumi, ignore,
+                 output, Z_genWeights, provide_file_dict, do_fast2full, jobs=jobs,
+                 chunk_size=chunk_size, max_memory=max_memory)
 
-    from root_numpy import root2array
 
-    if provide_file_dict is not None:
-        file_dict = provide_file_dict
-    else:
-        file_dict = _root_file_dict(mc_prod_yaml_file)
-
-    chains = {}
-    for fde, fdk in file_dict.items():
-        ckey, tname = fde, fdk[0]
-        if 'fast' in tname and aida_tree != 'nominal':
-            continue
-        if 'Fakes' in fde:
-            tname = 'AIDAfk_'+aida_tree
-            files = [mc_prefix+'/'+f for f in fdk[1]]
-            chains[ckey] = root2array(files,tname).view(np.recarray)
-        else:
-            if aida_tree == 'nominal':
-                tname = 'AIDA_'+tname
-            else:
-                tname = 'AIDA_'+aida_tree
-            files = [mc_prefix+'/'+f for f in fdk[1]]
-            chains[ckey] = root2array(files,tname).view(np.recarray)
-
-    for ig in ignore:
-        if ig in chains:
-            del chains[ig]
+def gen_fast2full(output, hist_dict, writer=None):
+    """
+    Scale the fast sim modeling systematic histograms of ttbar and Wt
+    to full sim (see fast2full) for each histogram definition.
 
-    with open(hist_yaml) as hf:
-        hist_dict = yaml.load(hf)
+    Parameters
+    ----------
+    output: str
+      Path and name of output ROOT file
+    hist_dict: dict
+      The histogram definitions (from the histogram YAML file)
+    writer: HistWriter, optional
+      The writer of the output file (if None, one is opened)
+    """
+    own_writer = writer is None
+    if own_writer:
+        writer = HistWriter(output)
+    try:
+        _gen_fast2full(writer, hist_dict)
+    finally:
+        if own_writer:
+            writer.close()
 
-    output_file = ROOT.TFile(output,'UPDATE')
-    rootkeys    = [str(o.GetName()) for o in output_file.GetListOfKeys()]
-    for pname, chain in chains.items():
-        if 'main' not in pname and aida_tree != 'nominal':
-            continue
-        for hist_name, hist_props in hist_dict.items():
-            selection = np_selection(chain,hist_props['cut'])
-            hname  = pname+'_'+aida_tree+'_'+hist_name
-            if hname in rootkeys:
-                logger.warning(hname+' already in file')
+def _fast2full_table(index, hist_names):
+    """
+    The fast to full sim conversions for each histogram definition:
+    every FAST sample other than main (the modeling samples of the
+    production YAML file, e.g. ttbar_FAST_sysARup) whose process has
+    FULL and FAST main nominal histograms gives a row of (FAST
+    variation, FAST nominal, FULL nominal, FULL variation) names.
+    """
+    table = OrderedDict()
+    for hist_name in hist_names:
+        rows = []
+        for name in index.query(sim='FAST', tree='nominal', hist=hist_name, weight=None):
+            key = index.keys[name]
+            if key.sample == 'main':
+                continue
+            fast_nom = str(key._replace(sample='main'))
+            full_nom = str(key._replace(sim='FULL', sample='main'))
+            if fast_nom in index and full_nom in index:
+                rows.append((name, fast_nom, full_nom, str(key._replace(sim='FULL'))))
             else:
-                n, bins, err = np_hist(chain,hist_props['var'],hist_props['bins'],
-                                       selection,'nomWeightwLum',lumi)
-                h = array2hist(n,hname,hist_props['bins'],err)
-                logger.info(h)
-                h.Write()
-
-            if aida_tree == 'nominal' and 'FAST' not in pname and 'main' in hname:
-                for systW in _systematic_weights:
-                    for ud in systW[:-1]:
-                        hname = pname+'_'+aida_tree+'_'+hist_name+'_'+ud
-                        if hname in rootkeys:
-                            logger.warning(hname+' already in file')
-                        else:
-                            n, bins, err = np_hist(chain,hist_props['var'],hist_props['bins'],
-                                                   selection,ud,lumi)
-                            h = array2hist(n,hname,hist_props['bins'],err)
-                            logger.info(h)
-                            h.Write()
-                for bsystW in _systematic_btag_weights:
-                    for ud in bsystW[:-1]:
-                        hname = pname+'_'+aida_tree+'_'+hist_name+'_'+ud
-                        if hname in rootkeys:
-                            logger.warning(hname+' already in file')
-                        else:
-                            n, bins, err = np_hist(chain,hist_props['var'],hist_props['bins'],
-                                                   selection,ud,lumi)
-                            h = array2hist(n,hname,hist_props['bins'],err)
-                            logger.info(h)
-                            h.Write()
-
-    output_file.Close()
-
-    ## Reopen the output file and lets try to make some systematic
-    ## histograms from the fastsim samples.  This is hard coded naming
-    ## based on YAML naming defined in the template.
-    if aida_tree == 'nominal' and do_fast2full:
-        gen_fast2full(output, hist_dict)
-
-
-def gen_fast2full(output, hist_dict):
-    def check_and_write(h, keys):
-        """
-        Check if a histogram name is in a list of keys from a file,
-        if so shoot a warning, if not, shoot info and write the hist.
-        """
-        if str(h.GetName()) in keys:
-            logger.warning(str(h.GetName()+' already in file'))
-        else:
-            logger.info(h)
-            h.Write()
-
-    output_file = ROOT.TFile(output,'UPDATE')
-    listofkeys  = [str(o.GetName()) for o in output_file.GetListOfKeys()]
-
-    for hist_name in hist_dict:
-        hn = hist_name
-
-        ########################################################
-        #### First ttbar #######################################
-        ########################################################
-        if 'ttbar_FULL_main_nominal_'+hn not in listofkeys:
-            continue
-        pnom, edges, perr = hist2array(output_file.Get('ttbar_FULL_main_nominal_'+hn),
-                                       return_edges=True, return_err=True)
-        edges = edges[0]
-        bins = (pnom.size,edges[0],edges[-1])
-        fast_nom, fast_nom_e = hist2array(output_file.Get('ttbar_FAST_main_nominal_'+hn),
-                                          return_err=True)
-
-        ## additonal radiation
-        if 'ttbar_FAST_sysARup_nominal_'+hn in listofkeys \
-           and 'ttbar_FAST_sysARdown_nominal_'+hn in listofkeys:
-            h = fast2full(output_file,'ttbar_FAST_sysARup_nominal_'+hn,
-                          'ttbar_FULL_sysARup_nominal_'+hn,fast_nom,pnom,fast_nom_e,perr,bins)
-            check_and_write(h,listofkeys)
-            h = fast2full(output_file,'ttbar_FAST_sysARdown_nominal_'+hn,
-                          'ttbar_FULL_sysARdown_nominal_'+hn,fast_nom,pnom,fast_nom_e,perr,bins)
-            check_and_write(h,listofkeys)
-        else:
-            logger.warning('Cannot find ttbar additional radiation FAST hists')
+                logger.warning('Cannot scale '+name+' to full sim, nominal histograms missing')
+        if rows:
+            table[hist_name] = rows
+    return table
 
-        ## factorization/hadronization
-        if 'ttbar_FAST_sysFH_nominal_'+hn in listofkeys:
-            h = fast2full(output_file,'ttbar_FAST_sysFH_nominal_'+hn,'ttbar_FULL_sysFH_nominal_'+hn,
-                          fast_nom,pnom,fast_nom_e,perr,bins)
-            check_and_write(h,listofkeys)
-        else:
-            logger.warning('Cannot find ttbar factorization/hadronization FAST hists')
-
-        ## hard scattering
-        if 'ttbar_FAST_sysHS_nominal_'+hn in listofkeys:
-            h = fast2full(output_file,'ttbar_FAST_sysHS_nominal_'+hn,'ttbar_FULL_sysHS_nominal_'+hn,
-                          fast_nom,pnom,fast_nom_e,perr,bins)
-            check_and_write(h,listofkeys)
-        else:
-            logger.warning('Cannot find ttbar hard scattering FAST hists')
-        ########################################################
-        ########################################################
-
-        ########################################################
-        #### Now Wt ############################################
-        ########################################################
-        if 'Wt_FULL_main_nominal_'+hn not in listofkeys:
+def _gen_fast2full(writer, hist_dict):
+    """
+    Scale the FAST variations to FULL (the scaling and error
+    propagation of fast2full) for all processes and variations of a
+    histogram definition at once, on arrays stacked by load_hists.
+    Histograms whose digest (built from the digests of the FULL and
+    FAST nominal and the FAST variation histograms) is unchanged are
+    skipped.
+    """
+    manifest = writer.manifest
+    for hist_name, rows in _fast2full_table(writer.index, hist_dict).items():
+        digests = {}
+        for fast_var, fast_nom, full_nom, full_var in rows:
+            payload = json.dumps([manifest.get(i) for i in [full_nom, fast_nom, fast_var]])
+            digest  = hashlib.sha1(payload.encode('utf-8')).hexdigest()
+            if not _up_to_date(full_var, digest, writer.keys, manifest):
+                digests[full_var] = digest
+        rows = [r for r in rows if r[3] in digests]
+        if not rows:
             continue
-        pnom,perr = hist2array(output_file.Get('Wt_FULL_main_nominal_'+hn),return_err=True)
-        fast_nom,fast_nom_e = hist2array(output_file.Get('Wt_FAST_main_nominal_'+hn),
-                                         return_err=True)
-
-        ## additional radiation
-        if 'Wt_FAST_sysARup_nominal_'+hn in listofkeys \
-           and 'Wt_FAST_sysARdown_nominal_'+hn in listofkeys:
-            h = fast2full(output_file,'Wt_FAST_sysARup_nominal_'+hn,'Wt_FULL_sysARup_nominal_'+hn,
-                          fast_nom,pnom,fast_nom_e,perr,bins)
-            check_and_write(h,listofkeys)
-            h = fast2full(output_file,'Wt_FAST_sysARdown_nominal_'+hn,'Wt_FULL_sysARdown_nominal_'+hn,
-                          fast_nom,pnom,fast_nom_e,perr,bins)
-            check_and_write(h,listofkeys)
-        else:
-            logger.warning('Cannot find Wt addiational radiation FAST histograms')
 
-        ## factorization/hadrontization
-        if 'Wt_FAST_sysFH_nominal_'+hn in listofkeys:
-            h = fast2full(output_file,'Wt_FAST_sysFH_nominal_'+hn,'Wt_FULL_sysFH_nominal_'+hn,
-                          fast_nom,pnom,fast_nom_e,perr,bins)
-            check_and_write(h,listofkeys)
-        else:
-            logger.warning('Cannot find Wt factorization/hadronization FAST hists')
-
-        ## hard scattering
-        if 'Wt_FAST_sysHS1_nominal_'+hn in listofkeys \
-           and 'Wt_FAST_sysHS2_nominal_'+hn in listofkeys:
-            h = fast2full(output_file,'Wt_FAST_sysHS1_nominal_'+hn,'Wt_FULL_sysHS1_nominal_'+hn,
-                          fast_nom,pnom,fast_nom_e,perr,bins)
-            check_and_write(h,listofkeys)
-            h = fast2full(output_file,'Wt_FAST_sysHS2_nominal_'+hn,'Wt_FULL_sysHS2_nominal_'+hn,
-                          fast_nom,pnom,fast_nom_e,perr,bins)
-            check_and_write(h,listofkeys)
-        else:
-            logger.warning('Cannot find Wt hard scattering FAST hists')
-        ########################################################
-        ########################################################
+        with stage('fast2full', hists=len(rows), tree=None, process=None):
+            names = list(OrderedDict.fromkeys(n for r in rows for n in r[:3]))
+            rowof = dict((n, i) for i, n in enumerate(names))
+            values, edges, found, sumw2, dtype = load_hists(writer, names, return_sumw2=True,
+                                                            return_dtype=True)
+            fast_a, fast_nom, pnom = [values[[rowof[r[i]] for r in rows]] for i in range(3)]
+            err, fast_nom_e, perr  = [np.sqrt(sumw2[[rowof[r[i]] for r in rows]]) for i in range(3)]
+            full_a, full_e_term = _fast2full_arrays(fast_a, err, fast_nom, fast_nom_e, pnom, perr)
 
-    ### Finally close up the output file.
-    output_file.Close()
+            hists = []
+            for j, row in enumerate(rows):
+                h = new_histogram(row[3], edges, dtype=dtype)
+                h.values[...]    = full_a[j].reshape(h.values.shape)
+                h.variances[...] = full_e_term[j].reshape(h.values.shape)
+                hists.append(h)
+        writer.write(hists, digests)
@@ -0,0 +1,646 @@
+# -*- coding: utf-8 -*-
+"""
+A lightweight numpy histogram container, converted to ROOT
+histograms only when read from or written to a file.
+"""
+
+import fnmatch
+import numpy as np
+import ROOT
+
+from .keys import HistIndex
+from .binning import Binning2D
+from .binning import binning_edges
+from .binning import fold_flows
+from .binning import inner_bins
+
+def _axis_edges(axis):
+    nbins = axis.GetNbins()
+    edges = np.empty(nbins+1, dtype=np.float64)
+    axis.GetLowEdge(edges)
+    edges[-1] = axis.GetBinUpEdge(nbins)
+    return edges
+
+def _th1_edges(hist):
+    return _axis_edges(hist.GetXaxis())
+
+def _uniform_edges(edges):
+    widths = np.diff(edges)
+    return np.allclose(widths, widths[0], rtol=1e-9, atol=0.0)
+
+def _axis_args(edges):
+    # the TH1/TH2 constructor arguments of an axis
+    if _uniform_edges(edges):
+        return (edges.size-1, edges[0], edges[-1])
+    return (edges.size-1, edges)
+
+def _th_arrays(hist, ncells, copy):
+    # the sum of weights and sum of weights squared of a ROOT histogram
+    dtype = np.float32 if isinstance(hist, (ROOT.TH1F, ROOT.TH2F)) else np.float64
+    sumw  = np.ndarray(shape=(ncells,), dtype=dtype, buffer=hist.GetArray())
+    if hist.GetSumw2N() == ncells:
+        sumw2 = np.ndarray(shape=(ncells,), dtype=np.float64, buffer=hist.GetSumw2().GetArray())
+    else:
+        # unweighted histogram, the variance is the content
+        sumw2 = sumw.astype(np.float64)
+    if copy or dtype != np.float64:
+        sumw = sumw.astype(np.float64)
+    if copy:
+        sumw2 = sumw2.copy()
+    return sumw, sumw2, dtype
+
+def _rebin_starts(old, ngroup, edges):
+    # the new edges and the first old bin of each new bin
+    if ngroup is not None:
+        if (old.size-1) % ngroup != 0:
+            raise ValueError('ngroup must divide the number of bins')
+        return old[::ngroup], np.arange(0, old.size-1, ngroup)
+    edges  = np.asarray(edges, dtype=np.float64)
+    starts = np.searchsorted(old, edges[:-1])
+    if (np.any(starts >= old.size) or
+        not np.allclose(old[starts], edges[:-1]) or
+        not np.isclose(edges[-1], old[-1])):
+        raise ValueError('New edges must be a subset of the edges with the same range')
+    return edges, starts
+
+def _merge_bins(cells, starts, axis):
+    # sum the real bins of cells (with flow bins) along axis from each
+    # of starts, the flow bins are kept
+    n = cells.shape[axis]
+    merged = np.add.reduceat(np.take(cells, np.arange(1, n-1), axis), starts, axis)
+    return np.ascontiguousarray(np.concatenate([np.take(cells, [0], axis), merged,
+                                                np.take(cells, [n-1], axis)], axis))
+
+class Histogram(object):
+    """
+    A 1D histogram backed by contiguous numpy arrays: the bin edges
+    (nbins+1) and the sum of weights and sum of weights squared
+    (nbins+2, the first and last elements are the under and overflow
+    bins, as in ROOT). The arithmetic works in place on the arrays.
+
+    Parameters
+    ----------
+    name: str
+      Name of the histogram (used when written to a ROOT file)
+    edges: numpy.ndarray
+      The bin edges
+    sumw: numpy.ndarray, optional
+      Sum of weights in each bin including the flow bins (zeros if None)
+    sumw2: numpy.ndarray, optional
+      Sum of weights squared in each bin including the flow bins
+      (zeros if None)
+    dtype: numpy.dtype
+      The storage type when converted to ROOT (float32 for a TH1F,
+      float64 for a TH1D); the arrays are always float64
+    """
+    __slots__ = ['name', 'edges', 'sumw', 'sumw2', 'dtype']
+
+    def __init__(self, name, edges, sumw=None, sumw2=None, dtype=np.float64):
+        self.name  = name
+        self.edges = np.ascontiguousarray(edges, dtype=np.float64)
+        nbins      = self.edges.size-1
+        if sumw is None:
+            sumw = np.zeros(nbins+2, dtype=np.float64)
+        if sumw2 is None:
+            sumw2 = np.zeros(nbins+2, dtype=np.float64)
+        self.sumw  = np.ascontiguousarray(sumw, dtype=np.float64)
+        self.sumw2 = np.ascontiguousarray(sumw2, dtype=np.float64)
+        if self.sumw.shape != (nbins+2,) or self.sumw2.shape != (nbins+2,):
+            raise ValueError('sumw and sumw2 must have nbins+2 elements (with flow bins)')
+        self.dtype = np.dtype(dtype)
+
+    @classmethod
+    def uniform(cls, name, binning, dtype=np.float64):
+        """
+        An empty histogram with (nbins, xmin, xmax) uniform binning.
+        """
+        return cls(name, np.linspace(binning[1], binning[2], binning[0]+1), dtype=dtype)
+
+    @classmethod
+    def from_th1(cls, hist, copy=True):
+        """
+        Convert a ROOT TH1F or TH1D. With copy=False the arrays of a
+        TH1D are views of the ROOT histogram's memory (the histogram
+        must outlive the views).
+        """
+        if not isinstance(hist, (ROOT.TH1F, ROOT.TH1D)):
+            raise TypeError('Must be ROOT.TH1F or ROOT.TH1D!')
+        sumw, sumw2, dtype = _th_arrays(hist, hist.GetNbinsX()+2, copy)
+        return cls(str(hist.GetName()), _th1_edges(hist), sumw, sumw2, dtype)
+
+    def to_th1(self):
+        """
+        Convert to a ROOT TH1F or TH1D (by dtype) which is not attached
+        to any directory.
+        """
+        add_directory = ROOT.TH1.AddDirectoryStatus()
+        ROOT.TH1.AddDirectory(False)
+        try:
+            hclass = ROOT.TH1F if self.dtype == np.float32 else ROOT.TH1D
+            h = hclass(self.name, self.name, *_axis_args(self.edges))
+        finally:
+            ROOT.TH1.AddDirectory(add_directory)
+        h.Set(self.sumw.size, np.ascontiguousarray(self.sumw, dtype=self.dtype))
+        h.Sumw2()
+        h.GetSumw2().Set(self.sumw2.size, self.sumw2)
+        h.SetEntries(self.nbins)
+        return h
+
+    @property
+    def binning(self):
+        """
+        The binning (the bin edges, see aidapy.hist.binning)
+        """
+        return self.edges
+
+    @property
+    def shape(self):
+        return (self.edges.size-1,)
+
+    @property
+    def nbins(self):
+        return self.edges.size-1
+
+    @property
+    def values(self):
+        """
+        The bin heights (a view, without flow bins)
+        """
+        return self.sumw[1:-1]
+
+    @property
+    def variances(self):
+        """
+        The sum of weights squared (a view, without flow bins)
+        """
+        return self.sumw2[1:-1]
+
+    @property
+    def errors(self):
+        """
+        The statistical error in each bin (without flow bins)
+        """
+        return np.sqrt(self.sumw2[1:-1])
+
+    def is_uniform(self):
+        return _uniform_edges(self.edges)
+
+    def copy(self, name=None):
+        return Histogram(self.name if name is None else name, self.edges.copy(),
+                         self.sumw.copy(), self.sumw2.copy(), self.dtype)
+
+    def add(self, other, scale=1.0):
+        """
+        Add another histogram (times scale) in place.
+        """
+        if other.edges.shape != self.edges.shape or not np.array_equal(other.edges, self.edges):
+            raise ValueError('Cannot add histograms with different binning')
+        if scale == 1.0:
+            self.sumw  += other.sumw
+            self.sumw2 += other.sumw2
+        else:
+            self.sumw  += scale*other.sumw
+            self.sumw2 += (scale*scale)*other.sumw2
+        return self
+
+    def scale(self, factor):
+        """
+        Scale in place (the sum of weights squared by factor squared).
+        """
+        self.sumw  *= factor
+        self.sumw2 *= factor*factor
+        return self
+
+    def fold_overflow(self):
+        """
+        Add the overflow into the last real bin (in place).
+        """
+        self.sumw[-2]  += self.sumw[-1]
+        self.sumw2[-2] += self.sumw2[-1]
+        self.sumw[-1], self.sumw2[-1] = 0.0, 0.0
+        return self
+
+    def fold_underflow(self):
+        """
+        Add the underflow into the first real bin (in place).
+        """
+        self.sumw[1]  += self.sumw[0]
+        self.sumw2[1] += self.sumw2[0]
+        self.sumw[0], self.sumw2[0] = 0.0, 0.0
+        return self
+
+    def negatives_to_zero(self):
+        """
+        Set the bins with negative content to zero (content and
+        error, in place).
+        """
+        negative = self.sumw < 0
+        self.sumw[negative]  = 0.0
+        self.sumw2[negative] = 0.0
+        return self
+
+    def rebin(self, ngroup=None, edges=None):
+        """
+        Merge bins in place, either every ngroup consecutive bins or
+        into new edges which must be a subset of the current edges.
+        """
+        if (ngroup is None) == (edges is None):
+            raise ValueError('Give either ngroup or edges')
+        edges, starts = _rebin_starts(self.edges, ngroup, edges)
+        self.edges = np.ascontiguousarray(edges)
+        self.sumw  = _merge_bins(self.sumw, starts, 0)
+        self.sumw2 = _merge_bins(self.sumw2, starts, 0)
+        return self
+
+    def __repr__(self):
+        return 'Histogram('+repr(self.name)+', nbins='+str(self.nbins)+')'
+
+class Histogram2D(Histogram):
+    """
+    A 2D histogram backed by contiguous numpy arrays: the x and y bin
+    edges and the sum of weights and sum of weights squared of all
+    (nx+2)*(ny+2) cells in the ROOT order (the x index running
+    fastest, cell ix+(nx+2)*iy), so a TH2D is read and written
+    without reordering. values, variances and errors are (nx x ny).
+
+    Parameters
+    ----------
+    name: str
+      Name of the histogram (used when written to a ROOT file)
+    edges: numpy.ndarray
+      The x bin edges
+    yedges: numpy.ndarray
+      The y bin edges
+    sumw: numpy.ndarray, optional
+      Sum of weights of each cell (zeros if None)
+    sumw2: numpy.ndarray, optional
+      Sum of weights squared of each cell (zeros if None)
+    dtype: numpy.dtype
+      The storage type when converted to ROOT (float32 for a TH2F,
+      float64 for a TH2D); the arrays are always float64
+    """
+    __slots__ = ['yedges']
+
+    def __init__(self, name, edges, yedges, sumw=None, sumw2=None, dtype=np.float64):
+        self.name   = name
+        self.edges  = np.ascontiguousarray(edges, dtype=np.float64)
+        self.yedges = np.ascontiguousarray(yedges, dtype=np.float64)
+        ncells      = (self.edges.size+1)*(self.yedges.size+1)
+        if sumw is None:
+            sumw = np.zeros(ncells, dtype=np.float64)
+        if sumw2 is None:
+            sumw2 = np.zeros(ncells, dtype=np.float64)
+        self.sumw  = np.ascontiguousarray(sumw, dtype=np.float64)
+        self.sumw2 = np.ascontiguousarray(sumw2, dtype=np.float64)
+        if self.sumw.shape != (ncells,) or self.sumw2.shape != (ncells,):
+            raise ValueError('sumw and sumw2 must have (nx+2)*(ny+2) elements (with flow bins)')
+        self.dtype = np.dtype(dtype)
+
+    @classmethod
+    def uniform(cls, name, binning, dtype=np.float64):
+        """
+        An empty histogram with uniform binning on both axes, binning
+        is a Binning2D (or pair) of (nbins, xmin, xmax) tuples.
+        """
+        if len(binning) != 2 or not all(isinstance(b, tuple) for b in binning):
+            raise TypeError('binning must be a pair of (nbins, xmin, xmax) tuples')
+        xbins, ybins = binning
+        return cls(name, np.linspace(xbins[1], xbins[2], xbins[0]+1),
+                   np.linspace(ybins[1], ybins[2], ybins[0]+1), dtype=dtype)
+
+    @classmethod
+    def from_th1(cls, hist, copy=True):
+        """
+        Convert a ROOT TH2F or TH2D. With copy=False the arrays of a
+        TH2D are views of the ROOT histogram's memory (the histogram
+        must outlive the views).
+        """
+        if not isinstance(hist, (ROOT.TH2F, ROOT.TH2D)):
+            raise TypeError('Must be ROOT.TH2F or ROOT.TH2D!')
+        ncells = (hist.GetNbinsX()+2)*(hist.GetNbinsY()+2)
+        sumw, sumw2, dtype = _th_arrays(hist, ncells, copy)
+        return cls(str(hist.GetName()), _axis_edges(hist.GetXaxis()), _axis_edges(hist.GetYaxis()),
+                   sumw, sumw2, dtype)
+
+    def to_th1(self):
+        """
+        Convert to a ROOT TH2F or TH2D (by dtype) which is not attached
+        to any directory.
+        """
+        add_directory = ROOT.TH1.AddDirectoryStatus()
+        ROOT.TH1.AddDirectory(False)
+        try:
+            hclass = ROOT.TH2F if self.dtype == np.float32 else ROOT.TH2D
+            h = hclass(self.name, self.name, *(_axis_args(self.edges)+_axis_args(self.yedges)))
+        finally:
+            ROOT.TH1.AddDirectory(add_directory)
+        h.Set(self.sumw.size, np.ascontiguousarray(self.sumw, dtype=self.dtype))
+        h.Sumw2()
+        h.GetSumw2().Set(self.sumw2.size, self.sumw2)
+        h.SetEntries(self.nbins)
+        return h
+
+    @property
+    def binning(self):
+        return Binning2D(self.edges, self.yedges)
+
+    @property
+    def shape(self):
+        return (self.edges.size-1, self.yedges.size-1)
+
+    @property
+    def nbins(self):
+        return self.shape[0]*self.shape[1]
+
+    @property
+    def values(self):
+        """
+        The bin heights (a view, nx x ny, without flow bins)
+        """
+        return inner_bins(self.sumw, self.binning)
+
+    @property
+    def variances(self):
+        """
+        The sum of weights squared (a view, nx x ny, without flow bins)
+        """
+        return inner_bins(self.sumw2, self.binning)
+
+    @property
+    def errors(self):
+        """
+        The statistical error in each bin (nx x ny, without flow bins)
+        """
+        return np.sqrt(self.variances)
+
+    def is_uniform(self):
+        return _uniform_edges(self.edges) and _uniform_edges(self.yedges)
+
+    def copy(self, name=None):
+        return Histogram2D(self.name if name is None else name, self.edges.copy(),
+                           self.yedges.copy(), self.sumw.copy(), self.sumw2.copy(), self.dtype)
+
+    def add(self, other, scale=1.0):
+        """
+        Add another histogram (times scale) in place.
+        """
+        if (not isinstance(other, Histogram2D) or other.yedges.shape != self.yedges.shape or
+            not np.array_equal(other.yedges, self.yedges)):
+            raise ValueError('Cannot add histograms with different binning')
+        return Histogram.add(self, other, scale)
+
+    def fold_overflow(self):
+        """
+        Add the overflow into the last real bin of each axis (in
+        place).
+        """
+        fold_flows(self.sumw, self.binning)
+        fold_flows(self.sumw2, self.binning)
+        return self
+
+    def fold_underflow(self):
+        """
+        Add the underflow into the first real bin of each axis (in
+        place).
+        """
+        fold_flows(self.sumw, self.binning, overflow=False, underflow=True)
+        fold_flows(self.sumw2, self.binning, overflow=False, underflow=True)
+        return self
+
+    def rebin(self, ngroup=None, edges=None):
+        """
+        Merge bins in place, either every ngroup consecutive bins (the
+        same for both axes, or an (x, y) pair) or into new (x, y) edges
+        which must be subsets of the current edges (None keeps an
+        axis). The flow bins of each axis are merged along the other.
+        """
+        if (ngroup is None) == (edges is None):
+            raise ValueError('Give either ngroup or edges')
+        if ngroup is not None:
+            xgroup, ygroup = (ngroup, ngroup) if np.isscalar(ngroup) else ngroup
+            xedges, xstarts = _rebin_starts(self.edges, xgroup, None)
+            yedges, ystarts = _rebin_starts(self.yedges, ygroup, None)
+        else:
+            xedges, yedges = edges
+            xedges, xstarts = _rebin_starts(self.edges, 1 if xedges is None else None, xedges)
+            yedges, ystarts = _rebin_starts(self.yedges, 1 if yedges is None else None, yedges)
+        shape = (self.yedges.size+1, self.edges.size+1)
+        self.sumw, self.sumw2 = [
+            _merge_bins(_merge_bins(a.reshape(shape), xstarts, 1), ystarts, 0).ravel()
+            for a in (self.sumw, self.sumw2)]
+        self.edges  = np.ascontiguousarray(xedges)
+        self.yedges = np.ascontiguousarray(yedges)
+        return self
+
+    def __repr__(self):
+        return 'Histogram2D('+repr(self.name)+', shape='+str(self.shape)+')'
+
+def new_histogram(name, binning, sumw=None, sumw2=None, dtype=np.float64):
+    """
+    A Histogram (a Histogram2D for a Binning2D) with the given binning
+    (see aidapy.hist.binning) and contents.
+    """
+    edges = binning_edges(binning)
+    if isinstance(edges, Binning2D):
+        return Histogram2D(name, edges.x, edges.y, sumw, sumw2, dtype)
+    return Histogram(name, edges, sumw, sumw2, dtype)
+
+def as_histogram(hist, copy=True):
+    """
+    Get a Histogram from a ROOT TH1F/TH1D (see Histogram.from_th1), a
+    Histogram2D from a TH2F/TH2D or return a Histogram unchanged.
+    """
+    if isinstance(hist, Histogram):
+        return hist
+    if isinstance(hist, ROOT.TH2):
+        return Histogram2D.from_th1(hist, copy=copy)
+    return Histogram.from_th1(hist, copy=copy)
+
+class KeyIndex(object):
+    """
+    A ROOT file (or HistWriter) with its key names indexed once in a
+    set, for many lookups (see load_hists and match_keys), and in a
+    HistIndex for queries on the parts of the names.
+
+    Parameters
+    ----------
+    root_file: ROOT.TFile or HistWriter
+      The ROOT file with the histograms
+    """
+    __slots__ = ['file', 'keys', '_index']
+
+    def __init__(self, root_file):
+        self.file   = root_file
+        self.keys   = _key_names(root_file)
+        self._index = getattr(root_file, 'index', None)
+
+    @property
+    def index(self):
+        """
+        The HistIndex of the keys (built on first use)
+        """
+        if self._index is None:
+            self._index = HistIndex(self.keys)
+        return self._index
+
+    def __contains__(self, name):
+        return name in self.keys
+
+    def Get(self, name):
+        return self.file.Get(name)
+
+def _key_names(root_file):
+    # a HistWriter keeps the names in a set, for a TFile read the keys once
+    keys = getattr(root_file, 'keys', None)
+    if isinstance(keys, set):
+        return keys
+    return set(str(k.GetName()) for k in root_file.GetListOfKeys())
+
+def match_keys(root_file, pattern):
+    """
+    The sorted names of the histograms in a file matching a shell
+    style pattern (e.g. 'ttbar_FULL_main_*_met_1pj').
+
+    Parameters
+    ----------
+    root_file: ROOT.TFile or HistWriter
+      The ROOT file with the histograms
+    pattern: str
+      The pattern (see fnmatch)
+
+    Returns
+    -------
+    list(str)
+      The matching names
+    """
+    return sorted(fnmatch.filter(_key_names(root_file), pattern))
+
+def _th_shape(hist):
+    if isinstance(hist, ROOT.TH2):
+        return (hist.GetNbinsX(), hist.GetNbinsY())
+    return (hist.GetNbinsX(),)
+
+def _hist_edges(hist):
+    # the bin edges of a Histogram or ROOT histogram (a copy)
+    if isinstance(hist, Histogram2D):
+        return Binning2D(hist.edges.copy(), hist.yedges.copy())
+    if isinstance(hist, Histogram):
+        return hist.edges.copy()
+    if isinstance(hist, ROOT.TH2):
+        return Binning2D(_axis_edges(hist.GetXaxis()), _axis_edges(hist.GetYaxis()))
+    return _th1_edges(hist)
+
+def _copy_bins(row, cells, edges, include_overflow):
+    # copy the cells of a histogram into a row of load_hists, for 2D
+    # flattened in (x, y) order
+    if not include_overflow:
+        bins = inner_bins(cells, edges)
+    elif isinstance(edges, Binning2D):
+        bins = cells.reshape(edges.y.size+1, edges.x.size+1).T
+    else:
+        bins = cells
+    row.reshape(bins.shape)[...] = bins
+
+def load_hists(root_file, names, include_overflow=False, return_sumw2=False, check_edges=True,
+               return_dtype=False):
+    """
+    Read many histograms with the same binning into one preallocated
+    array (one row per name). Each histogram is read with a single
+    Get and its bins are copied straight into its row. Missing
+    histograms are reported in a mask (their rows are zero). The bins
+    of 2D histograms are flattened in (x, y) order, i.e. a row is
+    the histogram's values (nx x ny) raveled.
+
+    Parameters
+    ----------
+    root_file: ROOT.TFile or HistWriter
+      The ROOT file with the histograms
+    names: list(str) or str
+      The histogram names, or a pattern (the rows are then ordered as
+      match_keys(root_file, names))
+    include_overflow: bool
+      If true, the under and overflow bins are part of the rows
+    return_sumw2: bool
+      If true, also return the sum of weights squared
+    check_edges: bool
+      If true, check that all histograms have the same bin edges
+      (otherwise only the number of bins is checked)
+    return_dtype: bool
+      If true, also return the storage type of the first histogram
+      found (float32 for a TH1F or TH2F, float64 for a TH1D or TH2D)
+
+    Returns
+    -------
+    numpy.ndarray
+      The bin heights (n_hists x nbins)
+    numpy.ndarray
+      The bin edges (a Binning2D of the x and y edges for 2D, None if
+      no histogram was found)
+    numpy.ndarray
+      The mask of the histograms found (n_hists, bools)
+    numpy.ndarray
+      The sum of weights squared (n_hists x nbins, if return_sumw2)
+    numpy.dtype
+      The storage type (if return_dtype)
+    """
+    if isinstance(names, str):
+        names = match_keys(root_file, names)
+    keys  = _key_names(root_file)
+    mask  = np.zeros(len(names), dtype=np.bool_)
+    edges, values, sumw2, dtype = None, None, None, None
+    for i, name in enumerate(names):
+        if name not in keys:
+            continue
+        h = root_file.Get(name)
+        if not h:
+            continue
+        if isinstance(h, Histogram):
+            shape, hsumw, hsumw2 = h.shape, h.sumw, (h.sumw2 if return_sumw2 else None)
+            hdtype = h.dtype
+        else:
+            if isinstance(h, (ROOT.TH1F, ROOT.TH2F)):
+                hdtype = np.float32
+            elif isinstance(h, (ROOT.TH1D, ROOT.TH2D)):
+                hdtype = np.float64
+            else:
+                raise TypeError(name+' must be a ROOT.TH1F, ROOT.TH1D, ROOT.TH2F or ROOT.TH2D!')
+            shape  = _th_shape(h)
+            ncells = int(np.prod([n+2 for n in shape]))
+            hsumw  = np.ndarray(shape=(ncells,), dtype=hdtype, buffer=h.GetArray())
+            hsumw2 = None
+            if return_sumw2:
+                if h.GetSumw2N() == ncells:
+                    hsumw2 = np.ndarray(shape=(ncells,), dtype=np.float64,
+                                        buffer=h.GetSumw2().GetArray())
+                else:
+                    hsumw2 = hsumw
+        if values is None:
+            dtype  = np.dtype(hdtype)
+            edges  = _hist_edges(h)
+            nshape = shape
+            ncols  = int(np.prod([n+2 if include_overflow else n for n in shape]))
+            values = np.zeros((len(names), ncols), dtype=np.float64)
+            if return_sumw2:
+                sumw2 = np.zeros((len(names), ncols), dtype=np.float64)
+        elif shape != nshape:
+            raise ValueError(name+' has '+'x'.join(map(str, shape))+' bins, expected '+
+                             'x'.join(map(str, nshape)))
+        elif check_edges:
+            hedges = _hist_edges(h)
+            pairs  = zip(hedges, edges) if isinstance(edges, Binning2D) else [(hedges, edges)]
+            if not all(np.array_equal(a, b) for a, b in pairs):
+                raise ValueError(name+' has different bin edges')
+        _copy_bins(values[i], hsumw, edges, include_overflow)
+        if return_sumw2:
+            _copy_bins(sumw2[i], hsumw2, edges, include_overflow)
+        mask[i] = True
+    if values is None:
+        values = np.zeros((len(names), 0), dtype=np.float64)
+        if return_sumw2:
+            sumw2 = np.zeros((len(names), 0), dtype=np.float64)
+    result = (values, edges, mask)
+    if return_sumw2:
+        result += (sumw2,)
+    if return_dtype:
+        result += (dtype,)
+    return result
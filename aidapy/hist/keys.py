@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+The naming schema of the histograms in the AIDA output file and an
+index of the names.
+
+MC histograms are named process_sim_sample_tree_hist[_weight] (e.g.
+ttbar_FULL_main_nominal_met_1pj_weightSyswLum_jvt_UP), data
+histograms Data_hist.
+"""
+
+import os
+import re
+import json
+from collections import namedtuple
+import ROOT
+
+from aidapy.meta import _systematic_trees
+
+import logging
+logger = logging.getLogger('aidapy')
+
+_trees        = sorted(set(['nominal']+list(_systematic_trees)), key=len, reverse=True)
+_weight_re    = re.compile(r'_(weightSyswLum_.+|genWeight\d+)$')
+_sims         = ('FULL', 'FAST')
+
+class HistKey(namedtuple('HistKey', ['process', 'sim', 'sample', 'tree', 'hist', 'weight'])):
+    """
+    The parts of a histogram name (fields which do not apply, like the
+    sim, sample and tree of data or the weight of a nominal histogram,
+    are None). str() gives the histogram name.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return '_'.join(f for f in self if f is not None)
+
+    @property
+    def pname(self):
+        """
+        The process_sim_sample part of the name (the sample name in
+        the production YAML file)
+        """
+        return '_'.join(f for f in self[:3] if f is not None)
+
+    @classmethod
+    def parse(cls, name):
+        """
+        Parse a histogram name, returns None if it does not follow the
+        schema.
+        """
+        if name.startswith('Data_'):
+            return cls('Data', None, None, None, name[len('Data_'):], None)
+        parts = name.split('_', 3)
+        if len(parts) != 4 or parts[1] not in _sims:
+            return None
+        process, sim, sample, rest = parts
+        for tree in _trees:
+            if rest.startswith(tree+'_'):
+                rest = rest[len(tree)+1:]
+                break
+        else:
+            return None
+        weight = None
+        m = _weight_re.search(rest)
+        if m is not None:
+            weight, rest = m.group(1), rest[:m.start()]
+        if not rest:
+            return None
+        return cls(process, sim, sample, tree, rest, weight)
+
+def mc_key(pname, tree, hist, weight=None):
+    """
+    The key of an MC histogram from the process_sim_sample name (as
+    in the production YAML file).
+    """
+    process, sim, sample = pname.split('_', 2)
+    return HistKey(process, sim, sample, tree, hist, weight)
+
+def data_key(hist):
+    return HistKey('Data', None, None, None, hist, None)
+
+def _tree_pair_names(prefix):
+    # MET uses a different naming for its up and down trees
+    if 'MET_Soft' in prefix:
+        return prefix+'Up', prefix+'Down'
+    return prefix+'__1up', prefix+'__1down'
+
+def _index_path(output):
+    return output+'.index.json'
+
+class HistIndex(object):
+    """
+    An index of histogram names: membership is a hash lookup and
+    queries on any combination of the key fields intersect the sets
+    of names sharing each field value (starting with the smallest),
+    e.g. index.query(process='ttbar', hist='met_0j') for all
+    variations of ttbar for met_0j. Names which do not follow the
+    schema are kept but only found by membership.
+
+    Parameters
+    ----------
+    names: iterable(str)
+      The histogram names to index
+    """
+    __slots__ = ['keys', '_by']
+
+    def __init__(self, names=()):
+        self.keys = {}
+        self._by  = {}
+        for name in names:
+            self.add(name)
+
+    def add(self, name, key=None):
+        if name in self.keys:
+            return
+        if key is None:
+            key = HistKey.parse(name)
+        self.keys[name] = key
+        if key is None:
+            return
+        for field, value in zip(HistKey._fields, key):
+            self._by.setdefault((field, value), set()).add(name)
+
+    def __contains__(self, name):
+        return name in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def query(self, **fields):
+        """
+        The sorted names matching all given fields (exact matches, a
+        field given as None matches names without that field).
+        """
+        for field in fields:
+            if field not in HistKey._fields:
+                raise ValueError('Unknown key field '+field)
+        if not fields:
+            return sorted(self.keys)
+        sets = sorted([self._by.get((f, v), set()) for f, v in fields.items()], key=len)
+        result = set(sets[0])
+        for s in sets[1:]:
+            result &= s
+        return sorted(result)
+
+    def values(self, field, **fields):
+        """
+        The sorted distinct values of a field among the names
+        matching the given fields (e.g. index.values('hist',
+        process='Data') for all histogram definitions).
+        """
+        i = HistKey._fields.index(field)
+        keys = [self.keys[n] for n in self.query(**fields)]
+        return sorted(set(k[i] for k in keys if k is not None) - set([None]))
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(dict((n, None if k is None else list(k)) for n, k in self.keys.items()),
+                      f, indent=0, sort_keys=True)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            stored = json.load(f)
+        index = cls()
+        for name, key in stored.items():
+            index.add(name, None if key is None else HistKey(*key))
+        return index
+
+def open_index(output, keys=None):
+    """
+    The index of the histograms in an output file, read from its
+    sidecar (output+'.index.json') if it indexes exactly the keys in
+    the file, otherwise built from the keys and saved as the sidecar
+    (if it can be written, e.g. not on read-only storage).
+
+    Parameters
+    ----------
+    output: str
+      Path and name of the ROOT file
+    keys: set(str), optional
+      The key names in the file (read from the file if None)
+
+    Returns
+    -------
+    HistIndex
+      The index
+    """
+    if keys is None:
+        root_file = ROOT.TFile(output, 'READ')
+        keys      = set(str(k.GetName()) for k in root_file.GetListOfKeys())
+        root_file.Close()
+    path = _index_path(output)
+    if os.path.exists(path):
+        try:
+            index = HistIndex.load(path)
+        except ValueError:
+            # a truncated or corrupt sidecar is rebuilt
+            index = None
+        if index is not None and len(index) == len(keys) and all(k in index for k in keys):
+            return index
+    index = HistIndex(keys)
+    try:
+        index.save(path)
+    except (IOError, OSError) as err:
+        logger.debug('Cannot save the key index '+path+': '+str(err))
+    return index
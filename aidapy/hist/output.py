@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Writing histograms to the AIDA histogram output file
+"""
+
+import os
+import json
+from collections import OrderedDict
+import ROOT
+
+from .utils import _negatives_to_zero
+from .histogram import Histogram
+from .keys import open_index
+from .keys import _index_path
+from .profiling import stage
+
+import logging
+logger = logging.getLogger('aidapy')
+
+def _manifest_path(output):
+    return output+'.manifest.json'
+
+def _parts_path(output):
+    return output+'.parts.json'
+
+def _read_json(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def _read_manifest(output):
+    """
+    Read the cache manifest (histogram name -> content digest) which
+    lives next to the output file (empty if it does not exist).
+    """
+    return _read_json(_manifest_path(output))
+
+def _remove_output(output):
+    """
+    Remove an output file and its manifest, parts and index files.
+    """
+    for path in [output, _manifest_path(output), _parts_path(output), _index_path(output)]:
+        if os.path.exists(path):
+            os.remove(path)
+
+class HistWriter(object):
+    """
+    A persistent writer for the histogram output file, meant to be
+    used for a whole generation run. The file is opened once (in
+    UPDATE mode), the names of the stored histograms are kept in a
+    hashed index and histograms handed to the writer are detached
+    from their directory, written in batches and freed after each
+    batch. Histogram objects are converted to ROOT histograms only
+    when they are written. The key index (see HistIndex) is kept up to
+    date and saved next to the output file.
+
+    Parameters
+    ----------
+    output: str
+      Path and name of output ROOT file
+    batch_size: int
+      Number of histograms to hold before they are written and freed
+    """
+    def __init__(self, output, batch_size=500):
+        self.output     = output
+        self.batch_size = batch_size
+        self.file       = ROOT.TFile(output,'UPDATE')
+        self.keys       = set(str(k.GetName()) for k in self.file.GetListOfKeys())
+        self.index      = open_index(output, self.keys)
+        self.manifest   = _read_manifest(output)
+        self.parts      = _read_json(_parts_path(output))
+        self._pending   = OrderedDict()
+        self._digests   = {}
+
+    def __contains__(self, name):
+        return name in self.keys
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, hists, digests=None, part=None):
+        """
+        Queue histograms to be written (replacing histograms with the
+        same name), with their content digests for the manifest. For
+        shards, part describes partial histograms (see merge_shards).
+        """
+        for h in hists:
+            if isinstance(h, Histogram):
+                name = h.name
+            else:
+                name = str(h.GetName())
+                h.SetDirectory(0)
+                ROOT.SetOwnership(h, True)
+            self._pending[name] = h
+            self.keys.add(name)
+            self.index.add(name)
+            if digests and name in digests:
+                self._digests[name] = digests[name]
+            if part is not None:
+                self.parts[name] = part
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def get(self, name):
+        """
+        Get a histogram from the output file, or the pending histogram
+        of that name (a Histogram or a ROOT histogram).
+        """
+        if name in self._pending:
+            return self._pending[name]
+        return self.file.Get(name)
+
+    # so the writer can stand in for the TFile (e.g. in fast2full)
+    Get = get
+
+    def flush(self):
+        """
+        Write the pending histograms and free them.
+        """
+        if not self.file or not self.file.IsOpen():
+            raise RuntimeError(self.output+' is not open')
+        with stage('write', hists=len(self._pending), tree=None, process=None):
+            self.file.cd()
+            for h in self._pending.values():
+                logger.info(h)
+                if isinstance(h, Histogram):
+                    h = h.to_th1()
+                h.Write('', ROOT.TObject.kOverwrite)
+            self.file.Flush()
+        # new histograms should not end up in the output file directory
+        ROOT.gROOT.cd()
+        self._pending = OrderedDict()
+        self.manifest.update(self._digests)
+        self._digests = {}
+
+    def close(self):
+        """
+        Write everything that is pending, close the output file and
+        save the cache manifest (only histograms actually written are
+        recorded, so an interrupted run is regenerated, never reused).
+        """
+        if self.file and self.file.IsOpen():
+            self.flush()
+            self.file.Close()
+            with open(_manifest_path(self.output),'w') as f:
+                json.dump(self.manifest, f, indent=0, sort_keys=True)
+            self.index.save(_index_path(self.output))
+            if self.parts:
+                with open(_parts_path(self.output),'w') as f:
+                    json.dump(self.parts, f, indent=0, sort_keys=True)
+
+def merge_shards(shards, output, remove=False):
+    """
+    Merge shard files (each written by a single worker or batch job)
+    into the output file. The shards are streamed: histograms are read
+    one at a time and handed to a HistWriter, only partial histograms
+    are held until all their parts are added.
+
+    A histogram name may appear in more than one shard only if it is a
+    partial histogram (a part of a split chain, recorded in the
+    shard's parts file), the parts are then added and the negative
+    bins are set to zero afterwards if requested. Identical duplicates
+    (same digest) are skipped, other duplicates are an error.
+
+    Parameters
+    ----------
+    shards: list(str)
+      Paths of the shard ROOT files
+    output: str
+      Path and name of output ROOT file
+    remove: bool
+      Remove the shards (and their manifest and parts files) after a
+      successful merge
+    """
+    with HistWriter(output) as writer:
+        _merge_shards(shards, writer, remove)
+
+def _merge_shards(shards, writer, remove=False):
+    seen, partials = {}, {}
+    for shard in shards:
+        manifest, parts = _read_manifest(shard), _read_json(_parts_path(shard))
+        shard_file = ROOT.TFile(shard,'READ')
+        if not shard_file or shard_file.IsZombie():
+            raise IOError('Cannot open shard '+shard)
+        for key in shard_file.GetListOfKeys():
+            name   = str(key.GetName())
+            digest = manifest.get(name)
+            part   = parts.get(name)
+            if name in seen:
+                prev_digest, indices = seen[name]
+                if (part is not None and indices is not None and name in partials
+                    and part['part'] not in indices and digest == prev_digest):
+                    indices.add(part['part'])
+                else:
+                    if part is None and indices is None and digest is not None and digest == prev_digest:
+                        logger.warning('Skipping identical duplicate '+name+' in '+shard)
+                        continue
+                    raise ValueError('Duplicate histogram '+name+' in '+shard)
+            else:
+                seen[name] = (digest, set([part['part']]) if part is not None else None)
+            h = key.ReadObj()
+            h.SetDirectory(0)
+            ROOT.SetOwnership(h, True)
+            if part is None:
+                writer.write([h], {name : digest} if digest else None)
+                continue
+            if name in partials:
+                partials[name][0].Add(h)
+            else:
+                partials[name] = (h, part)
+            if len(seen[name][1]) == part['nparts']:
+                merged, part = partials.pop(name)
+                if part.get('negatives_to_zero'):
+                    _negatives_to_zero(merged)
+                writer.write([merged], {name : digest} if digest else None)
+        shard_file.Close()
+    if partials:
+        raise ValueError('Missing parts of '+', '.join(sorted(partials)))
+    if remove:
+        [_remove_output(shard) for shard in shards]
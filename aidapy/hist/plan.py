@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+The job graph of a histogram generation run. Every histogram to be
+filled is a leaf (the chain it is read from, its selection, variable,
+binning and weight); leaves reading the same chain share one pass over
+its files, identical leaves are filled once and copied, and within a
+pass the leaves are grouped by histogram definition so the selections
+and variables are computed once for all weights. The passes are what
+the backends (see the fillers in aidapy.hist.gen) run.
+"""
+
+import json
+from collections import OrderedDict
+from collections import namedtuple
+
+from .binning import hist_vars
+from .binning import binning_spec
+from .utils import expression_branches
+
+class Leaf(namedtuple('Leaf', ['backend', 'group', 'tree', 'files', 'lumi',
+                               'props', 'name', 'weight', 'digest'])):
+    """
+    A histogram to fill: with the backend, from the files of a tree
+    (of a (tree, process) group), the histogram definition props
+    (variable, selection and binning) with a weight expression, scaled
+    by lumi, written as name with a content digest.
+    """
+    __slots__ = ()
+
+    @property
+    def read(self):
+        """
+        What is read: leaves with the same read share a pass
+        """
+        return (self.backend, self.tree, tuple(self.files), self.lumi)
+
+    @property
+    def definition(self):
+        """
+        The selection, variables and binning
+        """
+        return (self.props['cut'], tuple(hist_vars(self.props)),
+                json.dumps(binning_spec(self.props), sort_keys=True))
+
+    @property
+    def columns(self):
+        """
+        The branches the leaf needs
+        """
+        return leaf_columns(self.props, self.weight)
+
+def leaf_columns(props, weight):
+    """
+    The branches needed to fill a histogram definition props with a
+    weight expression (the selection, variables and weight).
+    """
+    columns = expression_branches(props['cut']) | expression_branches(weight)
+    for var in hist_vars(props):
+        columns |= expression_branches(var)
+    return columns
+
+def build_plan(leaves):
+    """
+    Group leaves into passes. A pass is a dict with the read (backend,
+    group, tree, files, lumi), the branches to read, the histograms
+    as a list of (props, [(name, weight), ...]) (one entry per
+    histogram definition), the digests of the names and the aliases:
+    a leaf identical to an earlier one (same read, definition and
+    weight, e.g. a process sharing all files with another) is not
+    filled again, its name is an alias copied from the first one.
+
+    Parameters
+    ----------
+    leaves: iterable(Leaf)
+      The histograms to fill
+
+    Returns
+    -------
+    list(dict)
+      The passes
+    """
+    passes = OrderedDict()
+    for leaf in leaves:
+        if leaf.read not in passes:
+            passes[leaf.read] = {'backend'  : leaf.backend,
+                                 'group'    : leaf.group,
+                                 'tree'     : leaf.tree,
+                                 'files'    : list(leaf.files),
+                                 'lumi'     : leaf.lumi,
+                                 'branches' : set(),
+                                 'hists'    : OrderedDict(),
+                                 'digests'  : {},
+                                 'aliases'  : {}}
+        p = passes[leaf.read]
+        p['digests'][leaf.name] = leaf.digest
+        props, weights = p['hists'].setdefault(leaf.definition, (leaf.props, OrderedDict()))
+        if leaf.weight in weights:
+            p['aliases'].setdefault(weights[leaf.weight], []).append(leaf.name)
+            continue
+        weights[leaf.weight] = leaf.name
+        p['branches'] |= leaf.columns
+    plan = []
+    for p in passes.values():
+        p['branches'] = sorted(p['branches'])
+        p['hists']    = [(props, [(name, weight) for weight, name in weights.items()])
+                         for props, weights in p['hists'].values()]
+        plan.append(p)
+    return plan
+
+def plan_summary(plan):
+    """
+    Count the work of a plan: passes over the data, files read,
+    histograms written, histograms filled (the rest are copies),
+    distinct selections and (selection, variable) pairs summed over
+    the passes, and the largest number of branches read in a pass.
+    """
+    summary = OrderedDict([('passes', len(plan)), ('files', 0), ('histograms', 0), ('fills', 0),
+                           ('selections', 0), ('variables', 0), ('max_branches', 0)])
+    files = set()
+    for p in plan:
+        files.update(p['files'])
+        summary['histograms']   += len(p['digests'])
+        summary['fills']        += sum(len(weights) for props, weights in p['hists'])
+        summary['selections']   += len(set(props['cut'] for props, weights in p['hists']))
+        summary['variables']    += len(set((props['cut'], var) for props, weights in p['hists']
+                                           for var in hist_vars(props)))
+        summary['max_branches']  = max(summary['max_branches'], len(p['branches']))
+    summary['files'] = len(files)
+    return summary
+
+def format_plan(plan):
+    """
+    A table of the passes of a plan and the totals (see plan_summary).
+    """
+    header = ('group', 'tree', 'files', 'branches', 'selections', 'fills', 'copies')
+    rows   = [header]
+    for p in plan:
+        rows.append((' '.join(p['group']), p['tree'], str(len(p['files'])), str(len(p['branches'])),
+                     str(len(set(props['cut'] for props, weights in p['hists']))),
+                     str(sum(len(weights) for props, weights in p['hists'])),
+                     str(sum(len(a) for a in p['aliases'].values()))))
+    widths = [max(len(r[i]) for r in rows) for i in range(len(header))]
+    lines  = ['  '.join(c.ljust(w) for c, w in zip(r, widths)).rstrip() for r in rows]
+    lines.append('')
+    lines += [k+': '+str(v) for k, v in plan_summary(plan).items()]
+    return '\n'.join(lines)
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in per-stage profiling of histogram generation runs. When a
+Profile is active (see enable_profiling, or the profile argument of
+generate_hists), the instrumented stages of aidapy.hist.gen,
+aidapy.hist.utils and aidapy.hist.output record the wall and CPU time,
+the events processed, the bytes read from ROOT files and the
+histograms produced, per (tree, process, stage):
+
+- open: building a chain (and opening its files as far as the
+  backend does it up front),
+- read: reading the events into numpy (numpy backend),
+- selection: the selections and variables (numpy backend),
+- fill: filling the histograms (for TTree::Draw and RDataFrame this is
+  the event loop, reading and selection included),
+- merge: adding the parts of a split chain and the final overflow and
+  negative bin treatment,
+- write: writing histograms to a ROOT file,
+- fast2full: the fast to full simulation scaling,
+- plan: planning the run.
+
+Stages of the whole run (not of a single chain) have no tree and
+process. When no profile is active a stage costs one global lookup.
+"""
+
+import os
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+import ROOT
+
+_fields = ('calls', 'wall', 'cpu', 'events', 'bytes', 'hists')
+
+_active = None
+
+def _cpu():
+    t = os.times()
+    return t[0]+t[1]
+
+class Profile(object):
+    """
+    The records of a profiled run: (tree, process, stage) -> calls,
+    wall and cpu time (seconds), events, bytes read and histograms
+    produced. tree and process are the defaults of the stages
+    recorded (the chain being processed).
+    """
+    __slots__ = ['records', 'tree', 'process', 'start']
+
+    def __init__(self, tree=None, process=None):
+        self.records = OrderedDict()
+        self.tree    = tree
+        self.process = process
+        self.start   = time.time()
+
+    def add(self, tree, process, stage, calls=1, wall=0.0, cpu=0.0, events=0, nbytes=0, hists=0):
+        record = self.records.setdefault((tree, process, stage), [0, 0.0, 0.0, 0, 0, 0])
+        for i, v in enumerate((calls, wall, cpu, events, nbytes, hists)):
+            record[i] += v
+
+    def merge(self, other):
+        """
+        Add the records of another profile (e.g. of a worker process).
+        """
+        if other is None:
+            return
+        for (tree, process, stage), record in other.records.items():
+            self.add(tree, process, stage, *record)
+
+    def report(self):
+        """
+        The records as a JSON serializable dict: the run wall time, a
+        list of stages and the totals of each stage over all chains.
+        """
+        stages, totals = [], OrderedDict()
+        for (tree, process, stage), record in self.records.items():
+            entry = OrderedDict([('tree', tree), ('process', process), ('stage', stage)])
+            entry.update(zip(_fields, record))
+            stages.append(entry)
+            total = totals.setdefault(stage, OrderedDict((f, 0) for f in _fields))
+            for f, v in zip(_fields, record):
+                total[f] += v
+        return OrderedDict([('wall', time.time()-self.start),
+                            ('stages', stages),
+                            ('totals', totals)])
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=1)
+
+class _Stage(object):
+    """
+    A stage being recorded (a context manager). The events and
+    histograms can be counted inside the stage with count().
+    """
+    __slots__ = ['profile', 'key', 'events', 'hists', 'wall', 'cpu', 'nbytes']
+
+    def __init__(self, profile, key, events, hists):
+        self.profile = profile
+        self.key     = key
+        self.events  = events
+        self.hists   = hists
+
+    def count(self, events=0, hists=0):
+        self.events += events
+        self.hists  += hists
+
+    def __enter__(self):
+        self.nbytes = ROOT.TFile.GetFileBytesRead()
+        self.cpu    = _cpu()
+        self.wall   = time.time()
+        return self
+
+    def __exit__(self, *args):
+        wall = time.time()-self.wall
+        self.profile.add(*self.key, wall=wall, cpu=_cpu()-self.cpu, events=self.events,
+                         nbytes=ROOT.TFile.GetFileBytesRead()-self.nbytes, hists=self.hists)
+
+class _NoStage(object):
+    """
+    The stage when profiling is off: does nothing.
+    """
+    __slots__ = ()
+
+    def count(self, events=0, hists=0):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+_no_stage = _NoStage()
+
+def stage(name, events=0, hists=0, tree=False, process=False):
+    """
+    Record a stage (use as a context manager) in the active profile,
+    if any, for the tree and process of the profile unless given.
+
+    Parameters
+    ----------
+    name: str
+      The stage
+    events: int
+      Events processed
+    hists: int
+      Histograms produced
+    tree: str or None, optional
+      The tree (None for the whole run)
+    process: str or None, optional
+      The process (None for the whole run)
+    """
+    if _active is None:
+        return _no_stage
+    key = (_active.tree if tree is False else tree,
+           _active.process if process is False else process, name)
+    return _Stage(_active, key, events, hists)
+
+def active_profile():
+    """
+    The active Profile, None if profiling is off.
+    """
+    return _active
+
+def enable_profiling(profile=None):
+    """
+    Start recording the stages in profile (a new Profile if not
+    given), returns the profile that was active before.
+    """
+    global _active
+    previous, _active = _active, (profile if profile is not None else Profile())
+    return previous
+
+def disable_profiling(previous=None):
+    """
+    Stop recording (or go back to the previous profile), returns the
+    profile that was active.
+    """
+    global _active
+    profile, _active = _active, previous
+    return profile
+
+@contextmanager
+def profiling(profile):
+    """
+    Record the stages of a block in profile (a Profile, or None to
+    leave profiling as it is), e.g.
+
+        with profiling(Profile()) as profile:
+            generate_mc_hists(...)
+        profile.save('profile.json')
+    """
+    if profile is None:
+        yield None
+        return
+    previous = enable_profiling(profile)
+    try:
+        yield profile
+    finally:
+        disable_profiling(previous)
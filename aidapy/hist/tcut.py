@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+Compile ROOT TCut (TTree::Draw) style expressions into vectorized
+numpy evaluation plans.
+"""
+
+import re
+import numpy as np
+
+_token_re = re.compile(r'''
+    \s*(?:
+    (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?) |
+    (?P<name>[A-Za-z_]\w*(?:::[A-Za-z_]\w*)*)        |
+    (?P<op>\|\||&&|==|!=|<=|>=|\*\*|[-+*/%^&|<>!(),])
+    )''', re.VERBOSE)
+
+def _truth(v):
+    if isinstance(v, np.ndarray):
+        return v if v.dtype == np.bool_ else (v != 0)
+    return bool(v)
+
+def _divide(a, b):
+    # TTreeFormula returns 0 when dividing by zero
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        a, b = np.broadcast_arrays(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64))
+        out = np.zeros(a.shape, dtype=np.float64)
+        np.divide(a, b, out=out, where=(b != 0))
+        return out
+    return float(a)/b if b != 0 else 0.0
+
+def _modulo(a, b):
+    # integer modulo (as in TTreeFormula), 0 when b is 0
+    a, b = np.asarray(a).astype(np.int64), np.asarray(b).astype(np.int64)
+    return np.where(b != 0, np.fmod(a, np.where(b != 0, b, 1)), 0)
+
+def _bitwise(func):
+    # on the values cast to integers (as in TTreeFormula)
+    return lambda a, b: func(np.asarray(a).astype(np.int64), np.asarray(b).astype(np.int64))
+
+def _power(a, b):
+    return np.power(np.asarray(a, dtype=np.float64), b)
+
+_binary_ops = {
+    '||' : lambda a, b: _truth(a) | _truth(b),
+    '&&' : lambda a, b: _truth(a) & _truth(b),
+    '|'  : _bitwise(np.bitwise_or),
+    '&'  : _bitwise(np.bitwise_and),
+    '==' : lambda a, b: a == b,
+    '!=' : lambda a, b: a != b,
+    '<'  : lambda a, b: a < b,
+    '<=' : lambda a, b: a <= b,
+    '>'  : lambda a, b: a > b,
+    '>=' : lambda a, b: a >= b,
+    '+'  : lambda a, b: a + b,
+    '-'  : lambda a, b: a - b,
+    '*'  : lambda a, b: a * b,
+    '/'  : _divide,
+    '%'  : _modulo,
+}
+
+_precedence = [['||'], ['&&'], ['|'], ['&'], ['==','!='], ['<','<=','>','>='], ['+','-'],
+               ['*','/','%']]
+
+# TTreeFormula reads ^ (and **) as the power, binding tighter than the
+# signs: -x^2 is -(x^2), 2^3^2 is 2^(3^2)
+_power_ops = ('^', '**')
+
+_functions = {
+    'abs'  : np.abs,   'fabs'  : np.abs,   'TMath::Abs'   : np.abs,
+    'sqrt' : np.sqrt,  'TMath::Sqrt'  : np.sqrt,
+    'exp'  : np.exp,   'TMath::Exp'   : np.exp,
+    'log'  : np.log,   'TMath::Log'   : np.log,
+    'log10': np.log10, 'TMath::Log10' : np.log10,
+    'sin'  : np.sin,   'TMath::Sin'   : np.sin,
+    'cos'  : np.cos,   'TMath::Cos'   : np.cos,
+    'tan'  : np.tan,   'TMath::Tan'   : np.tan,
+    'asin' : np.arcsin,'TMath::ASin'  : np.arcsin,
+    'acos' : np.arccos,'TMath::ACos'  : np.arccos,
+    'atan' : np.arctan,'TMath::ATan'  : np.arctan,
+    'sinh' : np.sinh,  'cosh' : np.cosh, 'tanh' : np.tanh,
+    'atan2': np.arctan2, 'TMath::ATan2' : np.arctan2,
+    'pow'  : np.power, 'TMath::Power' : np.power,
+    'min'  : np.minimum, 'TMath::Min' : np.minimum,
+    'max'  : np.maximum, 'TMath::Max' : np.maximum,
+}
+
+_constants = {
+    'true'  : True,
+    'false' : False,
+    'kTRUE' : True,
+    'kFALSE': False,
+    'TMath::Pi' : np.pi,
+}
+
+def _tokenize(tcut):
+    tokens, pos, tcut = [], 0, tcut.rstrip()
+    while pos < len(tcut):
+        m = _token_re.match(tcut, pos)
+        if m is None or m.end() == pos:
+            raise ValueError('Cannot parse "'+tcut+'" at position '+str(pos))
+        kind = m.lastgroup
+        tokens.append((kind, m.group(kind)))
+        pos = m.end()
+    return tokens
+
+class _Parser(object):
+    """
+    Recursive descent parser which builds the evaluation plan as a
+    tree of closures taking the column source.
+    """
+    def __init__(self, tcut):
+        self.tcut     = tcut
+        self.tokens   = _tokenize(tcut)
+        self.pos      = 0
+        self.branches = set()
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        tok = self.peek()
+        if tok[0] is None:
+            raise ValueError('Unexpected end of "'+self.tcut+'"')
+        if value is not None and tok[1] != value:
+            raise ValueError('Expected "'+value+'" in "'+self.tcut+'"')
+        self.pos += 1
+        return tok
+
+    def parse(self):
+        node = self.binary(0)
+        if self.pos != len(self.tokens):
+            raise ValueError('Unexpected "'+self.peek()[1]+'" in "'+self.tcut+'"')
+        return node
+
+    def binary(self, level):
+        if level == len(_precedence):
+            return self.unary()
+        node = self.binary(level+1)
+        while self.peek()[0] == 'op' and self.peek()[1] in _precedence[level]:
+            op    = self.take()[1]
+            right = self.binary(level+1)
+            node  = _combine(_binary_ops[op], node, right)
+        return node
+
+    def unary(self):
+        kind, value = self.peek()
+        if kind == 'op' and value in ('!','-','+'):
+            self.take()
+            operand = self.unary()
+            if value == '!':
+                return _combine(lambda a: ~_truth(a) if isinstance(a, np.ndarray) else not a, operand)
+            if value == '-':
+                return _combine(lambda a: -a, operand)
+            return operand
+        return self.power()
+
+    def power(self):
+        node = self.primary()
+        if self.peek()[0] == 'op' and self.peek()[1] in _power_ops:
+            self.take()
+            node = _combine(_power, node, self.unary())
+        return node
+
+    def primary(self):
+        kind, value = self.take()
+        if kind == 'number':
+            number = float(value) if any(c in value for c in '.eE') else int(value)
+            return _constant(number)
+        if kind == 'op' and value == '(':
+            node = self.binary(0)
+            self.take(')')
+            return node
+        if kind == 'name':
+            if self.peek() == ('op','('):
+                if value not in _functions:
+                    raise ValueError('Unknown function "'+value+'" in "'+self.tcut+'"')
+                self.take('(')
+                args = [self.binary(0)]
+                while self.peek() == ('op',','):
+                    self.take(',')
+                    args.append(self.binary(0))
+                self.take(')')
+                return _combine(_functions[value], *args)
+            if value in _constants:
+                return _constant(_constants[value])
+            self.branches.add(value)
+            return _column(value)
+        raise ValueError('Unexpected "'+str(value)+'" in "'+self.tcut+'"')
+
+def _constant(value):
+    f = lambda cols: value
+    f.constant = True
+    return f
+
+def _column(name):
+    return lambda cols: cols(name)
+
+def _combine(func, *args):
+    # fold constant sub-expressions at compile time
+    if all(getattr(a, 'constant', False) for a in args):
+        return _constant(func(*[a(None) for a in args]))
+    if len(args) == 1:
+        a, = args
+        return lambda cols: func(a(cols))
+    if len(args) == 2:
+        a, b = args
+        return lambda cols: func(a(cols), b(cols))
+    return lambda cols: func(*[a(cols) for a in args])
+
+class CompiledCut(object):
+    """
+    A TCut style expression compiled into a vectorized evaluation
+    plan. Call it with a numpy structured array (or recarray) to get
+    the boolean selection array. The branches used are listed in the
+    branches attribute.
+    """
+    __slots__ = ['tcut', 'branches', '_plan']
+
+    def __init__(self, tcut):
+        self.tcut = tcut
+        if tcut.strip():
+            parser        = _Parser(tcut)
+            self._plan    = parser.parse()
+            self.branches = frozenset(parser.branches)
+        else:
+            self._plan    = _constant(True)
+            self.branches = frozenset()
+
+    def evaluate(self, x):
+        """
+        Evaluate the expression (numerically, like TTree::Draw would
+        for a variable) for each event of x.
+        """
+        cache = {}
+        def cols(name):
+            if name not in cache:
+                col = x[name]
+                # ROOT evaluates formulas in double precision
+                if col.dtype.kind == 'f' and col.dtype.itemsize < 8:
+                    col = col.astype(np.float64)
+                cache[name] = col
+            return cache[name]
+        value = self._plan(cols)
+        if not isinstance(value, np.ndarray) or value.shape != (x.shape[0],):
+            value = np.broadcast_to(np.asarray(value), (x.shape[0],)).copy()
+        return value
+
+    def __call__(self, x):
+        value = self.evaluate(x)
+        return value if value.dtype == np.bool_ else (value != 0)
+
+    def __repr__(self):
+        return 'CompiledCut('+repr(self.tcut)+')'
+
+def split_and(tcut):
+    """
+    Split a TCut style string into the atoms combined by top level
+    '&&' operators (e.g. '!SS&&elmu&&(njets==0||njets>2)' gives
+    ['!SS', 'elmu', '(njets==0||njets>2)']). Whitespace is removed
+    from the atoms. If the cut has a top level '||' it cannot be split
+    and is returned as a single atom.
+
+    Parameters
+    ----------
+    tcut: str
+        The ROOT style TCut
+
+    Returns
+    -------
+    list(str)
+        The atoms
+    """
+    atoms, current, depth, has_or = [], [], 0, False
+    for kind, value in _tokenize(tcut):
+        if value == '(':
+            depth += 1
+        elif value == ')':
+            depth -= 1
+        if depth == 0 and value == '||':
+            has_or = True
+        if depth == 0 and value == '&&':
+            atoms.append(''.join(current))
+            current = []
+        else:
+            current.append(value)
+    atoms.append(''.join(current))
+    if has_or:
+        return [''.join(v for k, v in _tokenize(tcut))]
+    return [a for a in atoms if a]
+
+_compiled = {}
+
+def compile_tcut(tcut):
+    """
+    Compile a ROOT TCut style string into a vectorized evaluation
+    plan (compiled plans are cached by string).
+
+    Supported are the logical operators (||, &&, !), the bitwise
+    operators on integers (|, &), comparisons (==, !=, <, <=, >, >=),
+    arithmetic (+, -, *, /, %, and ^ or ** for the power),
+    parentheses, numbers, branch names and common math functions (abs,
+    sqrt, TMath::Abs, pow, ...). The precedence is that of
+    TTreeFormula. Like TTree::Draw, non-zero values are true and
+    division by zero gives zero.
+
+    Parameters
+    ----------
+    tcut: str
+        The ROOT style TCut
+
+    Returns
+    -------
+    CompiledCut
+        Callable returning the selection array of bools for a numpy
+        structured array of events
+    """
+    if not isinstance(tcut, str):
+        raise TypeError('cuts must be a string!')
+    if tcut not in _compiled:
+        _compiled[tcut] = CompiledCut(tcut)
+    return _compiled[tcut]
@@ -1,6 +1,25 @@
 import numpy as np
 import ROOT
 import math
+import re
+from contextlib import contextmanager
+
+from .tcut import compile_tcut
+from .tcut import split_and
+from .histogram import new_histogram
+from .histogram import as_histogram
+from .binning import binning_shape
+from .binning import binning_edges
+from .binning import th1_axis
+from .binning import bin_index
+from .binning import is_uniform
+from .binning import binning_cells
+from .binning import fold_flows
+from .binning import inner_bins
+from .binning import Binning2D
+from .profiling import stage
+
+_identifier_re = re.compile(r'(?<![\w.:])([A-Za-z_]\w*)(?!\s*\(|\w|::)')
 
 def bin_centers(arr):
     """
@@ -24,12 +43,12 @@ def hist2array(hist, include_overflow=False, copy=True, return_edges=False, retu
     This algorithm is Copyright (c) 2012-2017, The root_numpy developers
     See disclaimer here: https://github.com/scikit-hep/root_numpy/blob/master/LICENSE
 
-    This function is an incomplete clone of root_numpy.hist2array for 1D histograms
+    This function is an incomplete clone of root_numpy.hist2array for 1D and 2D histograms
     https://github.com/scikit-hep/root_numpy/blob/master/root_numpy/_hist.py
 
     Parameters
     ----------
-    hist: ROOT.TH1
+    hist: ROOT.TH1 or ROOT.TH2
         The ROOT histogram to convert
     include_overflow: bool, optional (default=False)
         If true, the over and underflow bins will be part of the array
@@ -43,26 +62,27 @@ def hist2array(hist, include_overflow=False, copy=True, return_edges=False, retu
     Returns
     -------
     numpy.ndarray
-        NumPy array with bin heights
+        NumPy array with bin heights (nx x ny for a 2D histogram)
     list(numpy.ndarray)
         A list of arrays. One for each axis' bin edges
     numpy.ndarray
         NumPy array of sqrt(sum(weights squared))
     """
-    if isinstance(hist, ROOT.TH1F):
+    if isinstance(hist, (ROOT.TH1F, ROOT.TH2F)):
         dtype = 'f4'
-    elif isinstance(hist, ROOT.TH1D):
+    elif isinstance(hist, (ROOT.TH1D, ROOT.TH2D)):
         dtype = 'f8'
     else:
-        raise TypeError('Must be ROOT.TH1F or ROOT.TH1D!')
-    shape = (hist.GetNbinsX() +2,)
+        raise TypeError('Must be ROOT.TH1F, ROOT.TH1D, ROOT.TH2F or ROOT.TH2D!')
+    ndim  = 2 if isinstance(hist, ROOT.TH2) else 1
+    shape = (hist.GetNbinsY() + 2, hist.GetNbinsX() + 2)[2 - ndim:]
     array = np.ndarray(shape=shape, dtype=dtype, buffer=hist.GetArray())
     if return_err:
         error = np.sqrt(np.ndarray(shape=shape, dtype='f8',
                                    buffer=hist.GetSumw2().GetArray()))
     if return_edges:
-        axis_getters, simple_hist, edges = ['GetXaxis'], True, []
-        for idim, axis_getter in zip(range(1), axis_getters):
+        axis_getters, simple_hist, edges = ['GetXaxis', 'GetYaxis'], True, []
+        for idim, axis_getter in zip(range(ndim), axis_getters):
             ax = getattr(hist, axis_getter)(*(() if simple_hist else (idim,)))
             edges.append(np.empty(ax.GetNbins() + 1, dtype=np.double))
             ax.GetLowEdge(edges[-1])
@@ -95,39 +115,54 @@ def array2hist(array, hist_name='hist_name', binning=(10,0,100), errors=None):
     Parameters
     ----------
     array: np.ndarray
-      numpy array where the elements are bin heights
+      numpy array where the elements are bin heights (nx x ny for a
+      2D histogram)
     hist_name: str
       name for ROOT histogram
-    binning: tuple
-      binning for ROOT histogram
+    binning: tuple, numpy.ndarray, IntegerAxis or Binning2D
+      binning for ROOT histogram, (nbins,xmin,xmax), the bin edges,
+      an integer axis or the two axes of a 2D histogram
 
     Returns
     -------
     ROOT.TH1
-      a ROOT TH1F or TH1D (dependent on the array dtype)
+      a ROOT TH1F or TH1D (dependent on the array dtype), a TH2F or
+      TH2D for 2D
     """
-    if array.size != binning[0]:
+    if array.shape != binning_shape(binning):
         raise ValueError('Array size must be number of bins!')
-    padded = np.pad(array,(1,1),'constant')
+    # ROOT stores the cells with the x index running fastest
+    padded = np.ascontiguousarray(np.pad(array,1,'constant').T)
+    hclasses = (ROOT.TH2F, ROOT.TH2D) if isinstance(binning, Binning2D) else (ROOT.TH1F, ROOT.TH1D)
     if array.dtype == np.float32:
-        h = ROOT.TH1F(hist_name,hist_name,binning[0],binning[1],binning[2])
+        h = hclasses[0](hist_name,hist_name,*th1_axis(binning))
     elif array.dtype == np.float64:
-        h = ROOT.TH1D(hist_name,hist_name,binning[0],binning[1],binning[2])
+        h = hclasses[1](hist_name,hist_name,*th1_axis(binning))
     else:
         raise TypeError('We can only handle np.float32 and np.float64')
     h.Set(padded.size, padded)
     h.SetEntries(array.size)
     if errors is not None:
-        if errors.size != array.size:
+        if errors.shape != array.shape:
             raise ValueError('Error is not the same size as the array')
-        pe = np.pad(np.ascontiguousarray(errors, dtype=np.float64), (1,1), 'constant')
+        pe = np.ascontiguousarray(np.pad(np.asarray(errors, dtype=np.float64),1,'constant').T)
         h.SetError(pe)
     return h
 
+def _add_bin(hist, src, dst):
+    # move the content of cell src into cell dst (errors in quadrature)
+    val1, val2 = hist.GetBinContent(src), hist.GetBinContent(dst)
+    err1, err2 = hist.GetBinError(src), hist.GetBinError(dst)
+    hist.SetBinContent(dst, val1+val2)
+    hist.SetBinError(dst, math.sqrt(err1*err1 + err2*err2))
+    hist.SetBinContent(src, 0.0)
+    hist.SetBinError(src, 0.0)
+
 def shift_overflow(hist):
     """
     A function to shift the overflow bin in a ROOT
-    histogram into the last bin. Only supports 1D histograms.
+    histogram into the last bin. For 2D histograms the overflow of
+    each axis is shifted (first x, then y).
 
     Parameters
     ----------
@@ -135,16 +170,19 @@ def shift_overflow(hist):
       The ROOT histogram
     """
     if not isinstance(hist, ROOT.TH1):
-        raise TypeError('Argument must be 1D ROOT histogram!')
+        raise TypeError('Argument must be 1D or 2D ROOT histogram!')
     nb = hist.GetNbinsX()
-    val1, val2 = hist.GetBinContent(nb+1), hist.GetBinContent(nb)
-    err1, err2 = hist.GetBinError(nb+1), hist.GetBinError(nb)
-    hist.SetBinContent(nb, val1+val2)
-    hist.SetBinError(nb, math.sqrt(err1*err1 + err2*err2))
-    hist.SetBinContent(nb+1, 0.0)
-    hist.SetBinError(nb+1, 0.0)
+    if isinstance(hist, ROOT.TH2):
+        ny = hist.GetNbinsY()
+        for iy in range(ny+2):
+            _add_bin(hist, hist.GetBin(nb+1, iy), hist.GetBin(nb, iy))
+        for ix in range(nb+1):
+            _add_bin(hist, hist.GetBin(ix, ny+1), hist.GetBin(ix, ny))
+        return
+    _add_bin(hist, nb+1, nb)
 
-def tree2hist(tree, hist_name, binning, var, cut, overflow=False, negatives_to_zero=False):
+def tree2hist(tree, hist_name, binning, var, cut, overflow=False, negatives_to_zero=False,
+              nentries=None, firstentry=0):
     """
     A function to create a histogram using TTree::Draw()
 
@@ -154,45 +192,254 @@ def tree2hist(tree, hist_name, binning, var, cut, overflow=False, negatives_to_z
       The ROOT tree or chain
     hist_name: str
       The name-in-memory of the histogram to be created
-    binning: tuple
-      The binning of the histogram (nbins,xmin,xmax)
-    var: str
-      The variable (branch name) in the tree to histogram
+    binning: tuple, numpy.ndarray, IntegerAxis or Binning2D
+      The binning of the histogram, (nbins,xmin,xmax), the bin edges,
+      an integer axis or the two axes of a 2D histogram
+    var: str or tuple(str)
+      The variable (branch name) in the tree to histogram, the x and
+      y variables for a 2D histogram
     cut: str
       The selection string handed to TTree::Draw
     overflow: bool
       Shift the overflow bin the the last real bin
     negatives_to_zero:
       Make negative valued bins zero.
+    nentries: int, optional
+      Number of entries to process (default: all)
+    firstentry: int
+      The first entry to process
     Returns
     -------
     ROOT.TH1F
-        The ROOT histogram created
+        The ROOT histogram created (a TH2D for 2D), owned by python
+        and not attached to any directory
     """
     if not isinstance(tree, ROOT.TTree):
         raise TypeError('Must be ROOT TTree or TChain')
     #ROOT.TH1.SetDefaultSumw2() hist with weights != 1 are automatically Sumw2'ed
-    bin_str  = '('+str(binning[0])+','+str(binning[1])+','+str(binning[2])+')'
+    hclass = ROOT.TH1F
+    if isinstance(binning, Binning2D):
+        # TTree::Draw takes 2D variables as y:x; 2D histograms are
+        # TH2D with every backend
+        hclass, var = ROOT.TH2D, var[1]+':'+var[0]
 
     # if the tree/chain is empty, just make an empty histogram.
     if tree.GetEntries() == 0:
-        hist = ROOT.TH1F(hist_name,hist_name,binning[0],binning[1],binning[2])
-        return hist
+        hist = hclass(hist_name,hist_name,*th1_axis(binning))
+        return _detach(hist)
 
-    tree.Draw(var+'>>'+hist_name+bin_str, cut, 'goff')
-    hist = ROOT.gDirectory.Get(str(hist_name))
+    hist = None
+    if is_uniform(binning) and hclass is ROOT.TH1F:
+        bin_str = '('+','.join(str(b) for b in th1_axis(binning))+')'
+    else:
+        # variable bins cannot be given in the draw string (and it
+        # would make a TH2F), Draw fills the existing histogram of
+        # that name instead.
+        hist    = hclass(hist_name,hist_name,*th1_axis(binning))
+        bin_str = ''
+
+    with stage('fill', hists=1) as s:
+        if nentries is None and firstentry == 0:
+            tree.Draw(var+'>>'+hist_name+bin_str, cut, 'goff')
+            s.count(events=int(tree.GetEntries()))
+        else:
+            if nentries is None:
+                nentries = tree.GetEntries()-firstentry
+            tree.Draw(var+'>>'+hist_name+bin_str, cut, 'goff', nentries, firstentry)
+            s.count(events=int(nentries))
+    if hist is None:
+        hist = ROOT.gDirectory.Get(str(hist_name))
+    # a later Draw into the same name would reset or replace it
+    _detach(hist)
     if overflow:
         shift_overflow(hist)
     if negatives_to_zero:
-        for idx in (np.where(hist2array(hist) < 0)[0]):
-            hist.SetBinContent(int(idx)+1,0.0)
+        _negatives_to_zero(hist)
     return hist
 
+def expression_branches(expr):
+    """
+    Find the names of the (possible) branches used in a TTree::Draw
+    style expression (a variable, cut or weight). Function calls,
+    namespaces and boolean literals are not considered branches.
+
+    Parameters
+    ----------
+    expr: str
+      The expression (e.g. '!SS&&elmu&&njets>=1')
+
+    Returns
+    -------
+    set
+      Set of the branch names
+    """
+    if not isinstance(expr, str):
+        expr = str(expr)
+    return set(n for n in _identifier_re.findall(expr) if n not in ('true','false'))
+
+def activate_branches(tree, branches):
+    """
+    Turn off all branches of a tree except those listed (branches
+    which are not in the tree are ignored).
+
+    Parameters
+    ----------
+    tree: ROOT.TTree or ROOT.TChain
+      The ROOT tree or chain
+    branches: iterable
+      The names of branches to keep active
+    """
+    if not isinstance(tree, ROOT.TTree):
+        raise TypeError('Must be ROOT TTree or TChain')
+    tree.SetBranchStatus('*',0)
+    for b in branches:
+        if tree.GetBranch(b):
+            tree.SetBranchStatus(b,1)
+
+def _detach(hist):
+    """
+    Take a histogram out of gDirectory and give it to python (it is
+    freed when dropped), returns the histogram.
+    """
+    hist.SetDirectory(0)
+    ROOT.SetOwnership(hist, True)
+    return hist
+
+def _negatives_to_zero(hist):
+    """
+    Set the content of all negative valued (real) bins to zero.
+    """
+    if isinstance(hist, ROOT.TH2):
+        for ix, iy in zip(*np.where(hist2array(hist) < 0)):
+            hist.SetBinContent(int(ix)+1, int(iy)+1, 0.0)
+        return
+    for idx in (np.where(hist2array(hist) < 0)[0]):
+        hist.SetBinContent(int(idx)+1,0.0)
+
+def rdf_hists(tree, hist_specs, overflow=False, negatives_to_zero=False, implicit_mt=False,
+              entries=None):
+    """
+    A function to create many histograms from a tree in a single
+    event loop using ROOT.RDataFrame. All histograms are booked lazily
+    and filled when the first result is requested.
+
+    Parameters
+    ----------
+    tree: ROOT.TTree or ROOT.TChain
+      The ROOT tree or chain
+    hist_specs: list
+      List of (hist_name, binning, var, cut, weight) tuples, where
+      binning is (nbins,xmin,xmax), the bin edges, an integer axis or
+      a Binning2D, var is the variable (branch name or expression, a
+      pair (x, y) for 2D), cut is the selection and weight is the
+      weight expression.
+    overflow: bool
+      Shift the overflow bin the the last real bin
+    negatives_to_zero:
+      Make negative valued bins zero.
+    implicit_mt: bool or int
+      Run the event loop with ROOT's implicit multithreading (if an
+      int greater than zero, with that many threads); otherwise it is
+      run without. The process wide setting is restored afterwards.
+    entries: tuple, optional
+      (firstentry, nentries) range of entries to process (cannot be
+      used with implicit_mt)
+
+    Returns
+    -------
+    list(ROOT.TH1)
+        The ROOT histograms created (same order as hist_specs)
+    """
+    if not isinstance(tree, ROOT.TTree):
+        raise TypeError('Must be ROOT TTree or TChain')
+
+    # if the tree/chain is empty, just make empty histograms.
+    nentries = int(tree.GetEntries())
+    if nentries == 0:
+        return [_detach((ROOT.TH2D if isinstance(b, Binning2D) else ROOT.TH1F)(hn,hn,*th1_axis(b)))
+                for hn, b, _, _, _ in hist_specs]
+
+    if entries is not None and implicit_mt:
+        raise ValueError('An entry range cannot be used with implicit multithreading')
+    # implicit multithreading is process wide (an earlier call may have
+    # left it on, and a range fails with it on)
+    with _implicit_mt(implicit_mt):
+        df      = ROOT.RDataFrame(tree)
+        columns = set(str(c) for c in df.GetColumnNames())
+        if entries is not None:
+            df  = df.Range(entries[0], entries[0]+entries[1])
+        nodes   = {}
+        defined = {}
+        results = []
+        for hist_name, binning, var, cut, weight in hist_specs:
+            # one filter node per unique selection, new columns for
+            # expressions are defined on that node.
+            if cut not in nodes:
+                nodes[cut] = df.Filter(cut) if cut.strip() else df
+            exprs = [var, weight] if isinstance(var, str) else list(var)+[weight]
+            for expr in exprs:
+                if expr in columns or (cut, expr) in defined:
+                    continue
+                defined[(cut, expr)] = '_aidapy_col'+str(len(defined))
+                nodes[cut] = nodes[cut].Define(defined[(cut, expr)], expr)
+            cols = [expr if expr in columns else defined[(cut, expr)] for expr in exprs]
+            if isinstance(binning, Binning2D):
+                model = ROOT.RDF.TH2DModel(hist_name, hist_name, *th1_axis(binning))
+                results.append(nodes[cut].Histo2D(model, *cols))
+            else:
+                model = ROOT.RDF.TH1DModel(hist_name, hist_name, *th1_axis(binning))
+                results.append(nodes[cut].Histo1D(model, *cols))
+
+        # the event loop runs when the first result is requested
+        with stage('fill', events=(entries[1] if entries is not None else nentries),
+                   hists=len(results)):
+            for r in results:
+                r.GetValue()
+    hists = []
+    for r in results:
+        hist = _detach(r.GetValue().Clone())
+        if overflow:
+            shift_overflow(hist)
+        if negatives_to_zero:
+            _negatives_to_zero(hist)
+        hists.append(hist)
+    return hists
+
+def _imt_pool_size():
+    # GetThreadPoolSize since ROOT 6.22
+    size = getattr(ROOT.ROOT, 'GetThreadPoolSize', None) or ROOT.ROOT.GetImplicitMTPoolSize
+    return int(size())
+
+@contextmanager
+def _implicit_mt(implicit_mt):
+    """
+    Run a block with ROOT's implicit multithreading on (implicit_mt
+    True, or the number of threads) or off, then restore the process
+    wide setting as it was.
+    """
+    enabled = bool(ROOT.ROOT.IsImplicitMTEnabled())
+    threads = _imt_pool_size() if enabled else 0
+    if implicit_mt and not enabled:
+        if implicit_mt is True:
+            ROOT.ROOT.EnableImplicitMT()
+        else:
+            ROOT.ROOT.EnableImplicitMT(int(implicit_mt))
+    elif not implicit_mt and enabled:
+        ROOT.ROOT.DisableImplicitMT()
+    try:
+        yield
+    finally:
+        if implicit_mt and not enabled:
+            ROOT.ROOT.DisableImplicitMT()
+        elif not implicit_mt and enabled:
+            ROOT.ROOT.EnableImplicitMT(threads)
+
 def fast2full(root_file, faststr, fullstr, fast_nom, pnom, fast_nom_e, pnom_err, bins):
     """
     This function does the fast to full histogram scaling.  Error is
     assigned using standard error propagation.. since the error is
-    just statistical. The new "FULL" histogram is written to the tree.
+    just statistical. The new "FULL" histogram is returned (to be
+    written to the output file).
 
     Parameters
     ----------
@@ -210,22 +457,37 @@ def fast2full(root_file, faststr, fullstr, fast_nom, pnom, fast_nom_e, pnom_err,
         The statistical uncertainty in each bin (fast sim nominal)
     pnom_err: numpy.ndarray
         The statistical uncertainty in each bin (full sim nominal)
-    bin: tuple
-        The number of bins, left edge, and right edge (nbins,xmin,xmax)
+    bins: tuple, numpy.ndarray, IntegerAxis or Binning2D
+        The number of bins, left edge, and right edge (nbins,xmin,xmax),
+        the bin edges, an integer axis or the axes of a 2D histogram
 
     Returns
     -------
-    ROOT.TH1
-        "Full Sim" ROOT histogram associated with the original fast sim histogram.
-    """
-    fast_a, err  = hist2array(root_file.Get(faststr), return_err=True)
-    full_a       = (pnom/fast_nom)*fast_a
-    full_e_term  = np.power(fast_a/fast_nom*pnom_err,2)
-    full_e_term += np.power(pnom/fast_nom*err,2)
-    full_e_term += np.power(pnom*fast_a/(fast_nom*fast_nom)*fast_nom_e,2)
-    full_h       = array2hist(full_a, fullstr, bins, errors=np.sqrt(full_e_term))
+    Histogram
+        "Full Sim" histogram associated with the original fast sim histogram.
+    """
+    fast   = as_histogram(root_file.Get(faststr), copy=False)
+    full_a, full_e_term = _fast2full_arrays(fast.values, fast.errors, fast_nom, fast_nom_e,
+                                            pnom, pnom_err)
+    full_h = new_histogram(fullstr, bins, dtype=fast.dtype)
+    full_h.values[...]    = full_a
+    full_h.variances[...] = full_e_term
     return full_h
 
+def _fast2full_arrays(fast_a, err, fast_nom, fast_nom_e, pnom, pnom_err):
+    """
+    The fast to full scaling of bin heights and its (statistical)
+    error propagation, on arrays of any matching or broadcastable
+    shapes (e.g. variations x bins stacked). Returns the full sim
+    bin heights and variances.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        full_a       = (pnom/fast_nom)*fast_a
+        full_e_term  = np.power(fast_a/fast_nom*pnom_err,2)
+        full_e_term += np.power(pnom/fast_nom*err,2)
+        full_e_term += np.power(pnom*fast_a/(fast_nom*fast_nom)*fast_nom_e,2)
+    return full_a, full_e_term
+
 def np_selection(x, tcut):
     """
     Parse a ROOT TCut style string and construct a
@@ -236,8 +498,10 @@ def np_selection(x, tcut):
     x: np.array
         The numpy array for the set of events
     tcut: str
-        The ROOT style TCut. This is a limited cut
-        that can only interpret "&&" combinations.
+        The ROOT style TCut. It is compiled once into a vectorized
+        plan (see aidapy.hist.tcut.compile_tcut) supporting logical
+        operators, comparisons, arithmetic, parentheses and common
+        math functions.
 
     Returns
     -------
@@ -248,32 +512,213 @@ def np_selection(x, tcut):
         raise TypeError('x must be a numpy array!')
     if not isinstance(tcut,str):
         raise TypeError('cuts must be a string!')
-    cuts = tcut.split(tcut[tcut.find('&&')])
-    while '' in cuts:
-        cuts.remove('')
-
-    sel = np.array([True for _ in range(x.shape[0])])
-    for c in cuts:
-        if '==' in c:
-            cc = c.split('==')
-            sel = (sel)&(getattr(x,cc[0])==float(cc[1]))
-        elif '!=' in c:
-            cc = c.split('!=')
-            sel = (sel)&(getattr(x,cc[0])!=float(cc[1]))
-        elif '>=' in c:
-            cc = c.split('>=')
-            sel = (sel)&(getattr(x,cc[0])>=float(cc[1]))
-        elif '<=' in c:
-            cc = c.split('<=')
-            sel = (sel)&(getattr(x,cc[0])<=float(cc[1]))
-        elif '!' in c:
-            cc = c.split('!')
-            sel = (sel)&(getattr(x,cc[1])==False)
-        else:
-            sel = (sel)&(getattr(x,c)==True)
-    return sel
+    return compile_tcut(tcut)(x)
+
+class SelectionCache(object):
+    """
+    Memoize selection masks for one set of events (a chain or a chunk
+    of it). Cuts are split into their '&&' atoms; the mask of each
+    atom and of each combination of atoms is computed once and reused
+    by all cuts sharing them. The cache is dropped when it is used
+    with a different set of events.
+
+    Parameters
+    ----------
+    x: np.array
+        The numpy array for the set of events
+    """
+    __slots__ = ['_x', '_masks']
+
+    def __init__(self, x=None):
+        self._x     = x
+        self._masks = {}
+
+    def reset(self, x=None):
+        """
+        Drop all cached masks (and use a new set of events).
+        """
+        self._x     = x
+        self._masks = {}
+
+    def __call__(self, tcut, x=None):
+        """
+        Get the selection array of bools for a TCut style string.
+        """
+        if x is not None and x is not self._x:
+            self.reset(x)
+        if self._x is None:
+            raise ValueError('No events to select from')
+        atoms = tuple(sorted(set(split_and(tcut))))
+        if atoms in self._masks:
+            return self._masks[atoms]
+        # start from the longest cached prefix, cache every step.
+        k = len(atoms)
+        while k > 0 and atoms[:k] not in self._masks:
+            k -= 1
+        mask = self._masks[atoms[:k]] if k > 0 else None
+        for i in range(k, len(atoms)):
+            atom = atoms[i:i+1]
+            if atom not in self._masks:
+                self._masks[atom] = compile_tcut(atoms[i])(self._x)
+            mask = self._masks[atom] if mask is None else (mask & self._masks[atom])
+            self._masks[atoms[:i+1]] = mask
+        if mask is None:
+            mask = np.ones(self._x.shape[0], dtype=np.bool_)
+            self._masks[atoms] = mask
+        return mask
+
+def np_fill(x, weights, binning, fold_overflow=False, fold_underflow=False):
+    """
+    Single pass histogram kernel: compute the sum of weights and the
+    sum of weights squared (bin index computed as in TAxis::FindBin,
+    see bin_index, filled with np.bincount). 2D histograms are filled
+    in the same single pass on the flattened cell index.
+
+    Parameters
+    ----------
+    x: numpy.ndarray or tuple(numpy.ndarray)
+        The values to histogram, a pair (x, y) for 2D
+    weights: numpy.ndarray
+        The weight for each value
+    binning: tuple, numpy.ndarray, IntegerAxis or Binning2D
+        A tuple of (nbins, xmin, xmax), the bin edges, an integer
+        axis or the two axes of a 2D histogram
+    fold_overflow: bool
+        Add the overflow into the last real bin
+    fold_underflow: bool
+        Add the underflow into the first real bin
+
+    Returns
+    -------
+    numpy.ndarray
+        The sum of weights in each bin (nbins+2, including the under
+        and overflow bins; the cells in ROOT order for 2D)
+    numpy.ndarray
+        The sum of weights squared in each bin (nbins+2)
+    float
+        The effective number of entries, (sum w)^2/(sum w^2)
+    """
+    ncells  = binning_cells(binning)
+    idx     = bin_index(x, binning)
+    weights = np.asarray(weights, dtype=np.float64)
+    sumw  = np.bincount(idx, weights=weights, minlength=ncells)
+    sumw2 = np.bincount(idx, weights=weights*weights, minlength=ncells)
+    if fold_overflow or fold_underflow:
+        fold_flows(sumw, binning, fold_overflow, fold_underflow)
+        fold_flows(sumw2, binning, fold_overflow, fold_underflow)
+    totw2 = sumw2.sum()
+    neff  = sumw.sum()**2/totw2 if totw2 > 0 else 0.0
+    return sumw, sumw2, neff
+
+def np_fill_weights(x, weights, binning, fold_overflow=False, fold_underflow=False):
+    """
+    Multi-weight version of np_fill: histogram the same values with
+    many weight variations at once. The bin indices are computed once
+    and all variations are reduced together.
+
+    Parameters
+    ----------
+    x: numpy.ndarray or tuple(numpy.ndarray)
+        The values to histogram (n_events), a pair (x, y) for 2D
+    weights: numpy.ndarray
+        The weight matrix (n_events x n_variations)
+    binning: tuple, numpy.ndarray, IntegerAxis or Binning2D
+        A tuple of (nbins, xmin, xmax), the bin edges, an integer
+        axis or the two axes of a 2D histogram
+    fold_overflow: bool
+        Add the overflow into the last real bin
+    fold_underflow: bool
+        Add the underflow into the first real bin
+
+    Returns
+    -------
+    numpy.ndarray
+        The sum of weights (n_variations x nbins+2, including the
+        under and overflow bins; the cells in ROOT order for 2D)
+    numpy.ndarray
+        The sum of weights squared (n_variations x nbins+2)
+    numpy.ndarray
+        The effective number of entries for each variation
+    """
+    ncells  = binning_cells(binning)
+    weights = np.asarray(weights, dtype=np.float64)
+    idx     = bin_index(x, binning)
+    if weights.ndim != 2 or weights.shape[0] != idx.shape[0]:
+        raise ValueError('weights must be a (n_events x n_variations) matrix')
+
+    sumw  = np.zeros((ncells, weights.shape[1]), dtype=np.float64)
+    sumw2 = np.zeros((ncells, weights.shape[1]), dtype=np.float64)
+    if idx.size > 0:
+        # sort the events by bin once, then reduce each bin's slice.
+        order  = np.argsort(idx, kind='stable')
+        counts = np.bincount(idx, minlength=ncells)
+        filled = np.nonzero(counts)[0]
+        starts = (np.cumsum(counts)-counts)[filled]
+        sorted_w      = weights[order]
+        sumw[filled]  = np.add.reduceat(sorted_w, starts, axis=0)
+        sumw2[filled] = np.add.reduceat(sorted_w*sorted_w, starts, axis=0)
+    sumw, sumw2 = sumw.T.copy(), sumw2.T.copy()
+    if fold_overflow or fold_underflow:
+        fold_flows(sumw, binning, fold_overflow, fold_underflow)
+        fold_flows(sumw2, binning, fold_overflow, fold_underflow)
+    totw2 = sumw2.sum(axis=1)
+    neff  = np.where(totw2 > 0, sumw.sum(axis=1)**2/np.where(totw2 > 0, totw2, 1.0), 0.0)
+    return sumw, sumw2, neff
+
+def _np_values(dataset, var, selection):
+    # the selected values of a variable, or of each of a pair for 2D
+    if isinstance(var, str):
+        return getattr(dataset,var)[selection]
+    return tuple(getattr(dataset,v)[selection] for v in var)
+
+def np_hist_weights(dataset, var, binning, selection, weights, lumi=36.1, shift_overflow=True):
+    """
+    Create histograms of a variable for many weights at once from
+    purely numpy stored event data (see np_fill_weights)
+
+    Parameters
+    ----------
+    dataset: numpy.ndarray (recarray)
+        The numpy recarray for the dataset
+    var: str or tuple(str)
+        The variable name that we're histogramming (x and y names for
+        a 2D histogram)
+    binning: tuple, numpy.ndarray, IntegerAxis or Binning2D
+        A tuple of (nbins, xmin, xmax), the bin edges, an integer
+        axis or the two axes of a 2D histogram
+    selection: np.ndarray (of bools)
+        A numpy array of bools for event selection
+    weights: list(str) or numpy.ndarray
+        The weight variables in the dataset to use, or a weight
+        matrix (n_events x n_variations) for the full dataset
+    lumi: float
+        The luminosity to scale to
+    shift_overflow: bool
+        Bring the overflow into the last real bin.
+
+    Returns
+    -------
+    numpy.ndarray
+        The bin heights (n_variations x nbins, or n_variations x nx x
+        ny for 2D)
+    numpy.ndarray
+        The bin edges (a Binning2D of the x and y edges for 2D)
+    numpy.ndarray
+        The statistical error in each bin (n_variations x nbins)
+    """
+    x = _np_values(dataset,var,selection)
+    if isinstance(weights, np.ndarray):
+        w = weights[selection]
+    else:
+        w = np.empty((np.count_nonzero(selection), len(weights)), dtype=np.float64)
+        for i, weight in enumerate(weights):
+            w[:,i] = getattr(dataset,weight)[selection]
+    bins = binning_edges(binning)
+    sumw, sumw2, neff = np_fill_weights(x,w*lumi,binning,fold_overflow=shift_overflow)
+    return inner_bins(sumw,binning), bins, np.sqrt(inner_bins(sumw2,binning))
 
-def np_hist(dataset, var, binning, selection, weight, lumi=36.1, shift_overflow=True):
+def np_hist(dataset, var, binning, selection, weight, lumi=36.1, shift_overflow=True,
+            return_neff=False):
     """
     Create a histogram from purely numpy stored event data
 
@@ -281,10 +726,12 @@ def np_hist(dataset, var, binning, selection, weight, lumi=36.1, shift_overflow=
     ----------
     dataset: numpy.ndarray (recarray)
         The numpy recarray for the dataset
-    var: str
-        The variable name that we're histogramming
-    binning: tuple
-        A tuple of (nbins, xmin, xmax)
+    var: str or tuple(str)
+        The variable name that we're histogramming (x and y names for
+        a 2D histogram)
+    binning: tuple, numpy.ndarray, IntegerAxis or Binning2D
+        A tuple of (nbins, xmin, xmax), the bin edges, an integer
+        axis or the two axes of a 2D histogram
     selection: np.ndarray (of bools)
         A numpy array of bools for event selection
     weight: str
@@ -293,30 +740,26 @@ def np_hist(dataset, var, binning, selection, weight, lumi=36.1, shift_overflow=
         The luminosity to scale to
     shift_overflow: bool
         Bring the overflow into the last real bin.
+    return_neff: bool
+        Also return the effective number of entries
 
     Returns
     -------
     numpy.ndarray
-        The bin heights
+        The bin heights (nx x ny for 2D)
     numpy.ndarray
-        The bin edges
+        The bin edges (a Binning2D of the x and y edges for 2D)
     numpy.ndarray
         The statistical error in each bin
+    float
+        The effective number of entries (if return_neff)
     """
-    x = getattr(dataset,var)[selection]
+    x = _np_values(dataset,var,selection)
     w = getattr(dataset,weight)[selection]*lumi
-    bins = np.linspace(binning[1],binning[2],binning[0]+1)
-    ofbs = np.array([binning[2],1.0e6],dtype=np.float32)
-
-    h, bins = np.histogram(x,bins=bins,weights=w)
-    of, trh = np.histogram(x,bins=ofbs,weights=w)
-    h[-1] += of[0]
-
-    digitized = np.digitize(x,bins)
-    digiti_of = np.digitize(x,ofbs)
-    bin_sumw2 = np.zeros(binning[0],dtype=w.dtype)
-    for i in range(1,binning[0]+1):
-        bin_sumw2[i-1] = sum(np.power(w[np.where(digitized==i)[0]],2))
-    bin_sumw2[-1] += sum(np.power(w[np.where(digiti_of==1)[0]],2))
-    err = np.sqrt(bin_sumw2)
+    bins = binning_edges(binning)
+    sumw, sumw2, neff = np_fill(x,w,binning,fold_overflow=shift_overflow)
+    h   = inner_bins(sumw,binning).astype(w.dtype)
+    err = np.sqrt(inner_bins(sumw2,binning)).astype(w.dtype)
+    if return_neff:
+        return h, bins, err, neff
     return h, bins, err
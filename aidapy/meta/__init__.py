@@ -8,6 +8,8 @@ from .meta import _systematic_ud_prefixes
 from .meta import _systematic_weights
 from .meta import _systematic_singles
 from .meta import _systematic_btag_weights
+from .meta import _systematic_modeling
+from .meta import _lumi_uncertainties
 
 __ALL__ = [
     'get_proc_gen',
@@ -279,3 +279,22 @@ _systematic_btag_weights = [
     ["weightSyswLum_bTagSF_77_extrapolation_from_charm_up","weightSyswLum_bTagSF_77_extrapolation_from_charm_down","b-tag extrap from charm" ],
     ["weightSyswLum_bTagSF_77_extrapolation_up",           "weightSyswLum_bTagSF_77_extrapolation_down",           "b-tag extrap"            ]
 ]
+
+## modeling variations entering the band: [variation, reference (None
+## for the nominal), factor on the difference, label]
+_systematic_modeling = {
+    'ttbar' : [['sysARup', 'sysARdown', 0.5, 'ttbar Additional Radiation'    ],
+               ['sysFH',   None,        1.0, 'ttbar Fragmentation/Hadronization'],
+               ['sysHS',   None,        1.0, 'ttbar Hard Scattering'         ]],
+    'Wt'    : [['sysARup', 'sysARdown', 0.5, 'Wt Additional Radiation'       ],
+               ['sysFH',   None,        1.0, 'Wt Fragmentation/Hadronization'],
+               ['sysHS1',  'sysHS2',    1.0, 'Wt Hard Scattering'            ],
+               ['sysDS',   None,        1.0, 'Wt Diagram Subtraction'        ]]
+}
+
+## relative luminosity uncertainty of the fixed backgrounds
+_lumi_uncertainties = {
+    'Diboson' : 0.0374,
+    'RareSM'  : 0.0374,
+    'Fakes'   : 0.0374
+}
@@ -1,8 +1,8 @@
 import os
 import shutil
 
-from aidapy.hist import total_systematic_histogram
-from aidapy.hist import hist2array
+from aidapy.hist import systematic_bands
+from aidapy.hist import as_histogram
 #from .style_mpl import atlas_mpl_style
 
 import numpy as np
@@ -40,20 +40,21 @@ def canvas_with_ratio(figsize=(8,7),height_ratios=[3.65,1],
     return fig, ax0, ax1
 
 def hplot_mpl(root_file, hist_name='met_1pj', outdir='outs', xtitle='', ytitle='',logy=False,
-              proc_names=['Wt','ttbar','Fakes','WW','Diboson','Ztautau','RareSM']):
+              proc_names=['Wt','ttbar','Fakes','WW','Diboson','Ztautau','RareSM'], band=None):
     if os.path.exists(outdir):
         pass
     else:
         os.makedirs(outdir)
-    nominals = { pname : root_file.Get(pname+'_FULL_main_nominal_'+hist_name) for pname in proc_names }
-    nominals = { pname : hist2array(h,return_edges=True) for pname, h in nominals.items() }
+    # band from aidapy.hist.systematic_bands (computed for many plots at once)
+    if band is None:
+        band = systematic_bands(root_file,[hist_name],proc_names)[hist_name]
+    nominals = band['processes']
     data     = root_file.Get('Data_'+hist_name)
-    data     = hist2array(data)
-    nom_h, total_band, edges, staterr = total_systematic_histogram(root_file,hist_name,proc_names,
-                                                                   return_stat_error=True)
+    data     = as_histogram(data).values
+    nom_h, total_band, edges, staterr = band['nominal'], band['band'], band['edges'], band['stat_error']
     centers  = np.delete(edges,[0])-(np.ediff1d(edges)/2.0)
 
-    to_stack = [nominals[name][0] for name in ['RareSM','Diboson','Fakes','WW','Wt','Ztautau','ttbar']]
+    to_stack = [nominals[name] for name in ['RareSM','Diboson','Fakes','WW','Wt','Ztautau','ttbar']]
     cols     = ['darkred','black','gray','green','blue','orange','white']
     labels   = [r'Rare SM',r'Diboson',r'Fake/NP (MC)',r'WW',r'Wt',r'$Z\rightarrow\tau\tau$',r'$t\bar{t}$']
     #to_stack = [nominals[name][0] for name in ['RareSM','Diboson','Fakes','WW','Ztautau','ttbar','Wt']]
@@ -3,8 +3,8 @@ import ROOT
 ROOT.gROOT.SetBatch()
 import numpy as np
 from aidapy.hist import array2hist
-from aidapy.hist import hist2array
-from aidapy.hist import total_systematic_histogram
+from aidapy.hist import as_histogram
+from aidapy.hist import systematic_bands
 from .root_utils import styling
 styling()
 def canvas_with_ratio(name, xdim=450, ydim=475,
@@ -63,23 +63,28 @@ def hist_formatting(chist,isdata=False,logging=False):
 
 def hplot_root(root_file, hist_name='met_1pj', xtitle='', ytitle='', logy=False,
                proc_names=['ttbar','Wt','Ztautau','WW','Diboson','Fakes','RareSM'],
-               colors=[ROOT.kWhite,ROOT.kBlue,ROOT.kOrange,ROOT.kGreen,ROOT.kBlack,ROOT.kGray,ROOT.kRed]):
+               colors=[ROOT.kWhite,ROOT.kBlue,ROOT.kOrange,ROOT.kGreen,ROOT.kBlack,ROOT.kGray,ROOT.kRed],
+               band=None):
     """
-    Plot histograms using ROOT
+    Plot histograms using ROOT (band is the hist_name entry of
+    aidapy.hist.systematic_bands, computed if None)
     """
-    nominals = { pname : root_file.Get(pname+'_FULL_main_nominal_'+hist_name) for pname in proc_names }
+    if band is None:
+        band = systematic_bands(root_file, [hist_name], proc_names)[hist_name]
+    edges    = band['edges']
+    nominals = { pname : array2hist(band['processes'][pname], pname+'_FULL_main_nominal_'+hist_name,
+                                    edges)
+                 for pname in proc_names }
     data     = root_file.Get('Data_'+hist_name)
     data.SetMinimum(0.0)
-    data_a   = hist2array(data)
-    nom_h, total_band, edges, staterr = total_systematic_histogram(root_file, hist_name, proc_names,
-                                                                   return_stat_error=True)
+    data_a   = as_histogram(data).values
+    nom_h, total_band, staterr = band['nominal'], band['band'], band['stat_error']
     ratio_a         = data_a/nom_h
     ratio_a_staterr = np.sqrt(1/(nom_h*nom_h)*data_a + np.power(data_a/(nom_h*nom_h)*staterr,2))
-    ratio_root_h    = array2hist(ratio_a, errors=ratio_a_staterr,
-                                 binning=(ratio_a.shape[0],edges[0],edges[-1]))
-    sysh = array2hist(nom_h, 'totalSys_'+hist_name, (nom_h.size,edges[0],edges[-1]), errors=total_band)
+    ratio_root_h    = array2hist(ratio_a, errors=ratio_a_staterr, binning=edges)
+    sysh = array2hist(nom_h, 'totalSys_'+hist_name, edges, errors=total_band)
     ratiosysh = array2hist(np.array(np.ones(nom_h.size)), 'totalSysRatio_'+hist_name,
-                           (nom_h.size,edges[0],edges[-1]), errors=total_band/nom_h)
+                           edges, errors=total_band/nom_h)
     root_stack = ROOT.THStack('stack_'+hist_name, 'stack_'+hist_name)
     for pname, col in zip(proc_names[::-1], colors[::-1]):
         nominals[pname].SetFillColor(col)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmark of the MC histogram generation: runs
+generate_mc_hists (TTree::Draw) and generate_mc_hists_numpy (and
+optionally generate_mc_hists_rdf) on synthetic AIDA ntuples (see
+ntuples.py) for the nominal and some systematic trees, records the
+wall and CPU time, events per second and peak RSS of each backend,
+checks that the histograms of the backends agree and appends the
+results to a JSON history, comparing them to the last run with the
+same parameters.
+
+    $ python benchmarks/generation.py --events 100000 --trees 2
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import resource
+import argparse
+import traceback
+import subprocess
+import multiprocessing
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+import numpy as np
+
+AIDAPYDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ntuples import write_ntuples
+
+_generators = {
+    'root'  : 'generate_mc_hists',
+    'numpy' : 'generate_mc_hists_numpy',
+    'rdf'   : 'generate_mc_hists_rdf',
+}
+
+def _peak_rss():
+    """
+    Peak resident set size in bytes of this process and its (waited
+    for) children.
+    """
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return scale*max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                     resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+def _run_backend(queue, backend, prod_yaml, hist_yaml, workdir, trees, output, jobs):
+    """
+    Generate the histograms of all trees with one backend (in a fresh
+    process, so the peak RSS is its own). The measurements, or the
+    traceback of a failure, are put on the queue.
+    """
+    try:
+        import aidapy.hist as aph
+        generate = getattr(aph, _generators[backend])
+        t0, c0 = time.time(), os.times()
+        for tree in ['nominal']+trees:
+            generate(prod_yaml, hist_yaml, mc_prefix=workdir, aida_tree=tree, output=output,
+                     do_fast2full=(tree == 'nominal'), jobs=jobs)
+        c1 = os.times()
+        queue.put({'wall'  : time.time()-t0,
+                   'cpu'   : sum(c1[:4])-sum(c0[:4]),
+                   'rss'   : _peak_rss()})
+    except Exception:
+        queue.put({'error' : traceback.format_exc()})
+        raise
+
+def _result(queue, process):
+    """
+    The result put on the queue by the backend process, None if it
+    died without one (e.g. killed or crashed in ROOT).
+    """
+    while True:
+        try:
+            return queue.get(timeout=1.0)
+        except Empty:
+            if not process.is_alive():
+                break
+    try:
+        # put just before it exited
+        return queue.get(timeout=1.0)
+    except Empty:
+        return None
+
+def _events(prod_yaml, workdir, trees, entries):
+    """
+    The number of events read by one generation of all trees.
+    """
+    from aidapy.hist.gen import _root_file_dict
+    from aidapy.hist.gen import _mc_chain_specs
+
+    file_dict, events = _root_file_dict(prod_yaml), 0
+    for tree in ['nominal']+trees:
+        for tname, files in _mc_chain_specs(file_dict, workdir, tree,
+                                            ['Zll_FULL_main','Wjets_FULL_main']).values():
+            events += sum(entries.get((os.path.normpath(f), tname), 0) for f in files)
+    return events
+
+def _read_hists(output):
+    import ROOT
+    from aidapy.hist import as_histogram
+
+    root_file, hists = ROOT.TFile(output, 'READ'), {}
+    for key in root_file.GetListOfKeys():
+        h = as_histogram(key.ReadObj())
+        hists[h.name] = (np.asarray(h.values, dtype=np.float64),
+                         np.asarray(h.variances, dtype=np.float64))
+    root_file.Close()
+    return hists
+
+def compare_outputs(reference, other, rtol):
+    """
+    Compare the histograms of two output files: the contents and the
+    variances of each histogram must agree within rtol (relative to
+    the largest bin of the histogram).
+
+    Returns
+    -------
+    dict
+      Number of histograms compared, the names missing from either
+      file, the names which differ and the largest relative difference
+    """
+    ref, oth = _read_hists(reference), _read_hists(other)
+    common   = sorted(set(ref) & set(oth))
+    result   = {'compared' : len(common),
+                'missing'  : sorted(set(ref) ^ set(oth)),
+                'differ'   : [],
+                'max_diff' : 0.0}
+    for name in common:
+        for a, b in zip(ref[name], oth[name]):
+            if a.shape != b.shape:
+                result['differ'].append(name)
+                break
+            scale = max(np.abs(a).max() if a.size else 0.0, np.finfo(np.float32).tiny)
+            diff  = float(np.abs(a-b).max()/scale) if a.size else 0.0
+            result['max_diff'] = max(result['max_diff'], diff)
+            if diff > rtol:
+                result['differ'].append(name)
+                break
+    return result
+
+def _version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=AIDAPYDIR,
+                                       stderr=subprocess.STDOUT).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _previous(history, params):
+    for record in reversed(history):
+        if record['params'] == params:
+            return record
+    return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the MC histogram generation backends')
+    parser.add_argument('--events', type=int, default=100000,
+                        help='Entries of each synthetic tree')
+    parser.add_argument('--trees', type=int, default=2,
+                        help='Number of systematic trees (besides nominal)')
+    parser.add_argument('--processes', nargs='+', default=['ttbar', 'Wt', 'WW'],
+                        help='Processes of the production YAML file to generate')
+    parser.add_argument('--extra-branches', type=int, default=20,
+                        help='Filler branches per tree (not read by the histograms)')
+    parser.add_argument('--backends', nargs='+', default=['root', 'numpy'],
+                        choices=sorted(_generators), help='Backends to run (the first is the reference)')
+    parser.add_argument('--jobs', type=int, default=1, help='Processes per generation')
+    parser.add_argument('--rtol', type=float, default=1.0e-4,
+                        help='Tolerance of the histogram comparison (relative to the largest bin)')
+    parser.add_argument('--workdir', default=os.path.join(AIDAPYDIR, 'benchmarks', 'work'),
+                        help='Directory of the synthetic ntuples and outputs')
+    parser.add_argument('--production', default=os.path.join(AIDAPYDIR, 'data', 'production.yaml'))
+    parser.add_argument('--hists', default=os.path.join(AIDAPYDIR, 'data', 'hists.yaml'))
+    parser.add_argument('--history', default=os.path.join(AIDAPYDIR, 'benchmarks', 'history.json'),
+                        help='JSON file the results are appended to')
+    args = parser.parse_args(argv)
+
+    prod_yaml, trees, entries = write_ntuples(args.workdir, args.production, args.hists,
+                                              args.processes, args.events, args.trees,
+                                              args.extra_branches)
+    entries = dict(((os.path.normpath(p), t), n) for (p, t), n in entries.items())
+    events  = _events(prod_yaml, args.workdir, trees, entries)
+
+    results, outputs = {}, {}
+    for backend in args.backends:
+        output = os.path.join(args.workdir, 'out_'+backend+'.root')
+        for suffix in ['', '.manifest.json', '.index.json', '.parts.json']:
+            if os.path.exists(output+suffix):
+                os.remove(output+suffix)
+        queue   = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_run_backend,
+                                          args=(queue, backend, prod_yaml, args.hists, args.workdir,
+                                                trees, output, args.jobs))
+        process.start()
+        measured = _result(queue, process)
+        process.join()
+        if measured is None or 'error' in measured or process.exitcode != 0:
+            raise RuntimeError(backend+' generation failed (exit code '+str(process.exitcode)+')'+
+                               (':\n'+measured['error'] if measured and 'error' in measured else ''))
+        results[backend] = {'wall'          : measured['wall'],
+                            'cpu'           : measured['cpu'],
+                            'events'        : events,
+                            'events_per_s'  : events/measured['wall'] if measured['wall'] else None,
+                            'peak_rss_mb'   : measured['rss']/1.0e6}
+        outputs[backend] = output
+        print('%-6s %8.2f s wall %8.2f s cpu %12.0f events/s %8.1f MB peak RSS'
+              % (backend, measured['wall'], measured['cpu'], results[backend]['events_per_s'] or 0,
+                 results[backend]['peak_rss_mb']))
+
+    agreement, ok = {}, True
+    reference = args.backends[0]
+    for backend in args.backends[1:]:
+        agreement[backend] = compare_outputs(outputs[reference], outputs[backend], args.rtol)
+        a = agreement[backend]
+        ok = ok and not a['differ'] and not a['missing'] and a['compared'] > 0
+        print('%s vs %s: %d histograms compared, %d differ, %d missing, max relative difference %.2g'
+              % (backend, reference, a['compared'], len(a['differ']), len(a['missing']), a['max_diff']))
+
+    import ROOT
+    params = {'events' : args.events, 'trees' : args.trees, 'processes' : sorted(args.processes),
+              'extra_branches' : args.extra_branches, 'jobs' : args.jobs,
+              'hists' : os.path.basename(args.hists)}
+    record = {'time'     : time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'version'  : _version(),
+              'host'     : socket.gethostname(),
+              'python'   : platform.python_version(),
+              'numpy'    : np.__version__,
+              'root'     : ROOT.gROOT.GetVersion(),
+              'params'   : params,
+              'results'  : results,
+              'agreement': agreement}
+    history = []
+    if os.path.exists(args.history):
+        with open(args.history) as f:
+            history = json.load(f)
+    previous = _previous(history, params)
+    if previous is not None:
+        for backend in results:
+            if backend in previous['results'] and previous['results'][backend]['events_per_s']:
+                ratio = results[backend]['events_per_s']/previous['results'][backend]['events_per_s']
+                print('%-6s %.2fx the events/s of %s (%s)' % (backend, ratio, previous['version'],
+                                                              previous['time']))
+    history.append(record)
+    with open(args.history, 'w') as f:
+        json.dump(history, f, indent=1, sort_keys=True)
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks of the aidapy.hist.utils kernels (np_selection,
+np_hist, np_hist_weights, hist2array, array2hist, tree2hist and
+fast2full) over a grid of event counts, bin counts and numbers of
+weights. Each case reports the time per call (best of the repeats),
+the throughput (events, or bins for the kernels working on
+histograms, per second) and the peak memory allocated by a call
+(traced with tracemalloc in a separate, untimed call).
+
+The times are compared to a stored baseline (kernels_baseline.json,
+written with --save-baseline on the reference machine): the script
+exits with 1 if a case is slower than the baseline by more than the
+threshold, and with 2 if a case has no baseline (record it with
+--save-baseline, or pass --allow-missing).
+
+The events of each size are generated for each kernel separately,
+with only the branches the kernel reads, so the largest sizes fit in
+memory.
+
+    $ python benchmarks/kernels.py --save-baseline
+    $ python benchmarks/kernels.py --threshold 0.2
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+from collections import OrderedDict
+
+import numpy as np
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+import yaml
+
+AIDAPYDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ntuples import aida_dtype
+from ntuples import synthetic_events
+from ntuples import weight_branches
+
+_cut = '!SS&&elmu&&njets>=1'
+
+class _Source(object):
+    """
+    Stands in for the output file in fast2full.
+    """
+    def __init__(self, hists):
+        self.hists = hists
+
+    def Get(self, name):
+        return self.hists[name]
+
+def _columns(kernel, nweights):
+    """
+    The branches a kernel reads: those of the cut, met and the weights
+    (nweights of them for np_hist_weights, the nominal otherwise).
+    """
+    from aidapy.hist.utils import expression_branches
+    weights = weight_branches()[:nweights if kernel == 'np_hist_weights' else 1]
+    return tuple(sorted(expression_branches(_cut) | set(['met'])))+tuple(weights)
+
+def _bench_np_selection(events, bins, nweights):
+    from aidapy.hist import np_selection
+    return lambda: np_selection(events, _cut), len(events)
+
+def _bench_np_hist(events, bins, nweights):
+    from aidapy.hist import np_selection, np_hist
+    selection = np_selection(events, _cut)
+    return lambda: np_hist(events, 'met', (bins, 0, 200), selection, 'nomWeightwLum'), len(events)
+
+def _bench_np_hist_weights(events, bins, nweights):
+    from aidapy.hist import np_selection, np_hist_weights
+    selection = np_selection(events, _cut)
+    weights   = weight_branches()[:nweights]
+    return (lambda: np_hist_weights(events, 'met', (bins, 0, 200), selection, weights),
+            len(events))
+
+def _bench_tree2hist(events, bins, nweights):
+    from root_numpy import array2tree
+    from aidapy.hist import tree2hist
+    tree = array2tree(np.asarray(events), name='AIDA_nominal')
+    def run():
+        # the histogram is owned by python and freed when dropped
+        tree2hist(tree, 'h_bench', (bins, 0, 200), 'met', '36.1*nomWeightwLum*('+_cut+')')
+    return run, len(events)
+
+def _random_hist(name, bins, seed):
+    from aidapy.hist import array2hist
+    rng = np.random.RandomState(seed)
+    return array2hist(rng.exponential(10.0, bins), name, (bins, 0, 200), rng.uniform(0, 1, bins))
+
+def _bench_hist2array(events, bins, nweights):
+    from aidapy.hist import hist2array
+    h = _random_hist('h_bench', bins, 1)
+    return lambda: hist2array(h, return_err=True), bins
+
+def _bench_array2hist(events, bins, nweights):
+    from aidapy.hist import array2hist
+    rng = np.random.RandomState(1)
+    contents, errors = rng.exponential(10.0, bins), rng.uniform(0, 1, bins)
+    # the histogram is owned by python and freed when dropped
+    return lambda: array2hist(contents, 'h_bench', (bins, 0, 200), errors), bins
+
+def _bench_fast2full(events, bins, nweights):
+    from aidapy.hist import hist2array
+    from aidapy.hist.utils import fast2full
+    source = _Source({'fast_sys' : _random_hist('fast_sys', bins, 1)})
+    fast_nom, fast_nom_e = hist2array(_random_hist('fast_nom', bins, 2), return_err=True)
+    pnom, pnom_e         = hist2array(_random_hist('full_nom', bins, 3), return_err=True)
+    return (lambda: fast2full(source, 'fast_sys', 'full_sys', fast_nom, pnom, fast_nom_e, pnom_e,
+                              (bins, 0, 200)), bins)
+
+# kernel -> (benchmark, which grid axes it uses)
+_kernels = OrderedDict([
+    ('np_selection',    (_bench_np_selection,    ('events',))),
+    ('np_hist',         (_bench_np_hist,         ('events', 'bins'))),
+    ('np_hist_weights', (_bench_np_hist_weights, ('events', 'bins', 'weights'))),
+    ('tree2hist',       (_bench_tree2hist,       ('events', 'bins'))),
+    ('hist2array',      (_bench_hist2array,      ('bins',))),
+    ('array2hist',      (_bench_array2hist,      ('bins',))),
+    ('fast2full',       (_bench_fast2full,       ('bins',))),
+])
+
+def _time(func, repeat, min_time):
+    """
+    The best time of a call: func is called once to warm up, then
+    repeat times (at least min_time seconds in total).
+    """
+    func()
+    best, total, n = float('inf'), 0.0, 0
+    while n < repeat or total < min_time:
+        t0 = time.time()
+        func()
+        dt = time.time()-t0
+        best, total, n = min(best, dt), total+dt, n+1
+    return best
+
+def _peak_alloc(func):
+    """
+    The peak memory (bytes) allocated during a call, None without
+    tracemalloc. numpy traces its array buffers.
+    """
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        func()
+        return tracemalloc.get_traced_memory()[1]-start
+    finally:
+        tracemalloc.stop()
+
+def _cases(kernels, events, bins, weights):
+    for kernel in kernels:
+        bench, axes = _kernels[kernel]
+        for nevents in (events if 'events' in axes else [None]):
+            for nbins in (bins if 'bins' in axes else [None]):
+                for nweights in (weights if 'weights' in axes else [None]):
+                    params = [('events', nevents), ('bins', nbins), ('weights', nweights)]
+                    name   = '/'.join([kernel]+[k+'='+str(v) for k, v in params if v is not None])
+                    yield name, kernel, nevents, nbins, nweights
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the aidapy.hist.utils kernels')
+    parser.add_argument('--kernels', nargs='+', default=list(_kernels), choices=list(_kernels),
+                        help='Kernels to run')
+    parser.add_argument('--events', nargs='+', type=float, default=[1e4, 1e5, 1e6],
+                        help='Event counts (e.g. 1e4 1e6 1e8)')
+    parser.add_argument('--bins', nargs='+', type=int, default=[10, 100, 1000],
+                        help='Bin counts')
+    parser.add_argument('--weights', nargs='+', type=int, default=[1, 10, 50],
+                        help='Numbers of weights (np_hist_weights)')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed calls per case (at least)')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='Minimum total time per case in seconds')
+    parser.add_argument('--baseline', default=os.path.join(AIDAPYDIR, 'benchmarks', 'kernels_baseline.json'),
+                        help='Baseline JSON file')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed slowdown relative to the baseline (0.25 is 25%%)')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store the results as the baseline (cases not run are kept)')
+    parser.add_argument('--allow-missing', action='store_true',
+                        help='Do not fail on cases without a baseline')
+    parser.add_argument('--output', default=None, help='Also write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    with open(os.path.join(AIDAPYDIR, 'data', 'hists.yaml')) as f:
+        dtype = aida_dtype(yaml.load(f))
+    nevents  = [int(n) for n in args.events]
+    baseline = {'cases' : {}}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    sample, sample_key = None, None
+    results  = OrderedDict()
+    failed   = []
+    missing  = []
+    print('%-55s %12s %14s %10s %8s' % ('case', 'seconds', 'items/s', 'alloc MB', 'ratio'))
+    for name, kernel, n, nbins, nweights in _cases(args.kernels, nevents, args.bins, args.weights):
+        events = None
+        if n is not None:
+            # one sample at a time, of the branches the kernel reads
+            columns = _columns(kernel, max(args.weights))
+            if sample_key != (n, columns):
+                sample     = None
+                sample     = synthetic_events(n, np.dtype([(c, dtype[c]) for c in columns]), 1)
+                sample     = sample.view(np.recarray)
+                sample_key = (n, columns)
+            events = sample
+        func, items = _kernels[kernel][0](events, nbins, nweights)
+        seconds     = _time(func, args.repeat, args.min_time)
+        alloc       = _peak_alloc(func)
+        results[name] = {'seconds' : seconds, 'items_per_s' : items/seconds if seconds else None,
+                         'alloc_bytes' : alloc}
+        ref, status = baseline['cases'].get(name), 'no baseline'
+        if ref is None:
+            missing.append(name)
+        else:
+            ratio  = seconds/ref['seconds']
+            status = '%.2f' % ratio
+            if ratio > 1.0+args.threshold:
+                failed.append(name)
+                status += ' SLOWER'
+        print('%-55s %12.6f %14.4g %10s %8s' % (name, seconds, results[name]['items_per_s'] or 0,
+                                                 '%.2f' % (alloc/1.0e6) if alloc is not None else '-',
+                                                 status))
+
+    record = {'time'    : time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'host'    : socket.gethostname(),
+              'numpy'   : np.__version__,
+              'cases'   : results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(record, f, indent=1)
+    if args.save_baseline:
+        cases = baseline['cases']
+        cases.update(results)
+        record['cases'] = cases
+        with open(args.baseline, 'w') as f:
+            json.dump(record, f, indent=1, sort_keys=True)
+        print('Baseline saved to '+args.baseline)
+        return 0
+    if failed:
+        print('%d case(s) slower than the baseline by more than %d%%: %s'
+              % (len(failed), int(args.threshold*100), ', '.join(failed)))
+        return 1
+    if missing:
+        print('%d case(s) without a baseline in %s (record them with --save-baseline): %s'
+              % (len(missing), args.baseline, ', '.join(missing)))
+        if not args.allow_missing:
+            return 2
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
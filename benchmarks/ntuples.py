@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Deterministic synthetic AIDA ntuples for the benchmarks.
+
+The files follow the production layout: one file per DSID
+(process_dsid.root) holding the AIDA_<OutTreeName> tree of each sample
+using it; the files of the FULL main samples also hold the systematic
+trees (AIDA_<tree>) and the fake trees (AIDAfk_nominal and
+AIDAfk_<tree>). The branches are those of the histogram definitions,
+the nominal and systematic weights of aidapy.meta and optional filler
+branches (to make the I/O realistic). Same arguments, same files.
+"""
+
+import os
+import json
+import zlib
+import yaml
+import numpy as np
+
+from aidapy.meta import _systematic_trees
+from aidapy.meta import _systematic_weights
+from aidapy.meta import _systematic_btag_weights
+from aidapy.hist.binning import hist_vars
+from aidapy.hist.utils import expression_branches
+
+_flags  = set(['elmu', 'ee', 'mumu', 'SS', 'OS'])
+_counts = set(['njets', 'nbjets'])
+
+def weight_branches():
+    """
+    The weight branches of aidapy.meta (nominal first).
+    """
+    weights = ['nomWeightwLum']
+    for systW in (_systematic_weights+_systematic_btag_weights):
+        weights += systW[:-1]
+    return weights
+
+def aida_dtype(hist_dict, extra=0):
+    """
+    The branches of a synthetic AIDA tree: flags as bool, counts as
+    int32, the rest (kinematics, weights, extra filler_i branches) as
+    float32.
+
+    Parameters
+    ----------
+    hist_dict: dict
+      Histogram definitions (the variables and cuts give the branches)
+    extra: int
+      Number of filler branches
+    """
+    names = set(['elmu', 'SS', 'njets', 'nbjets', 'met', 'pT_lep1', 'pT_lep2'])
+    for hist_props in hist_dict.values():
+        names |= expression_branches(hist_props['cut'])
+        for var in hist_vars(hist_props):
+            names |= expression_branches(var)
+    dtype = []
+    for name in sorted(names):
+        if name in _flags:
+            dtype.append((name, np.bool_))
+        elif name in _counts:
+            dtype.append((name, np.int32))
+        else:
+            dtype.append((name, np.float32))
+    dtype += [(w, np.float32) for w in weight_branches()]
+    dtype += [('filler_'+str(i), np.float32) for i in range(extra)]
+    return np.dtype(dtype)
+
+def _seed(*parts):
+    return zlib.crc32('/'.join(str(p) for p in parts).encode('utf-8')) & 0xffffffff
+
+def synthetic_events(nevents, dtype, seed):
+    """
+    nevents random events of the given dtype (a structured array).
+    """
+    rng = np.random.RandomState(seed)
+    arr = np.zeros(nevents, dtype=dtype)
+    # the counts depend on njets and the weight variations on the nominal weight
+    for name in sorted(dtype.names, key=lambda n: (n not in ('njets', 'nomWeightwLum'), n)):
+        if name == 'elmu':
+            arr[name] = rng.uniform(size=nevents) < 0.7
+        elif name == 'SS':
+            arr[name] = rng.uniform(size=nevents) < 0.05
+        elif name in _flags:
+            arr[name] = rng.uniform(size=nevents) < 0.5
+        elif name == 'njets':
+            arr[name] = rng.poisson(2.0, size=nevents)
+        elif name in _counts:
+            arr[name] = rng.binomial(np.maximum(arr['njets'], 0), 0.3)
+        elif name == 'nomWeightwLum':
+            arr[name] = rng.normal(1.0, 0.2, size=nevents)*1.0e-3
+        elif name.startswith('weightSyswLum_'):
+            arr[name] = arr['nomWeightwLum']*rng.normal(1.0, 0.05, size=nevents)
+        else:
+            arr[name] = rng.exponential(50.0, size=nevents)
+    return arr
+
+def _sample_trees(production, processes):
+    """
+    file name -> (OutTreeNames, whether it is used by a FULL main
+    sample)
+    """
+    files = {}
+    for process in processes:
+        for simtype, samples in production[process].items():
+            for samptype, sample in samples.items():
+                dsids = []
+                for entry in sample['DSIDs']:
+                    dsids += range(entry[0], entry[1]+1) if isinstance(entry, list) else [entry]
+                for dsid in dsids:
+                    trees, main = files.setdefault(process+'_'+str(dsid)+'.root', (set(), [False]))
+                    trees.add(sample['OutTreeName'])
+                    if simtype == 'FULL' and samptype == 'main':
+                        main[0] = True
+    return files
+
+def write_ntuples(workdir, production_yaml, hist_yaml, processes, nevents, ntrees=2, extra=0,
+                  fake_fraction=0.1, seed=1):
+    """
+    Write the synthetic ntuples of some processes of a production YAML
+    file and a production YAML file of only those processes. Files
+    from an earlier call with the same arguments are reused.
+
+    Parameters
+    ----------
+    workdir: str
+      Directory of the files
+    production_yaml: str
+      The production YAML file (e.g. data/production.yaml)
+    hist_yaml: str
+      The histogram YAML file (for the branches)
+    processes: list(str)
+      Processes of the production file to write
+    nevents: int
+      Entries of each sample tree (and systematic tree)
+    ntrees: int
+      Number of systematic trees (the first ones of aidapy.meta)
+    extra: int
+      Number of filler branches
+    fake_fraction: float
+      Size of the fake trees relative to the others
+    seed: int
+      Random seed
+
+    Returns
+    -------
+    tuple(str, list(str), dict)
+      The production YAML file written, the systematic trees and the
+      entries of each (file path, tree name)
+    """
+    with open(production_yaml) as f:
+        production = yaml.load(f)
+    with open(hist_yaml) as f:
+        hist_dict = yaml.load(f)
+    systematics = list(_systematic_trees[:ntrees])
+    params = {'production' : os.path.abspath(production_yaml), 'hists' : os.path.abspath(hist_yaml),
+              'processes' : sorted(processes), 'nevents' : nevents, 'ntrees' : ntrees,
+              'extra' : extra, 'fake_fraction' : fake_fraction, 'seed' : seed}
+    params_path = os.path.join(workdir, 'ntuples.json')
+    prod_path   = os.path.join(workdir, 'production.yaml')
+    if os.path.exists(params_path):
+        with open(params_path) as f:
+            stored = json.load(f)
+        if stored['params'] == params:
+            entries = dict((tuple(k.split('|')), v) for k, v in stored['entries'].items())
+            return prod_path, systematics, entries
+    from root_numpy import array2root
+
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    dtype, entries = aida_dtype(hist_dict, extra), {}
+    for fname, (trees, main) in sorted(_sample_trees(production, processes).items()):
+        path  = os.path.join(workdir, fname)
+        names = ['AIDA_'+t for t in sorted(trees)]
+        if main[0]:
+            names += ['AIDA_'+t for t in systematics]
+            names += ['AIDAfk_'+t for t in ['nominal']+systematics]
+        if os.path.exists(path):
+            os.remove(path)
+        for tname in names:
+            n = int(nevents*fake_fraction) if tname.startswith('AIDAfk_') else nevents
+            array2root(synthetic_events(n, dtype, _seed(seed, fname, tname)), path, tname,
+                       mode='update')
+            entries[(path, tname)] = n
+    with open(prod_path, 'w') as f:
+        yaml.dump(dict((p, production[p]) for p in processes), f, default_flow_style=False)
+    with open(params_path, 'w') as f:
+        json.dump({'params' : params,
+                   'entries' : dict(('|'.join(k), v) for k, v in entries.items())}, f, indent=0)
+    return prod_path, systematics, entries
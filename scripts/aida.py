@@ -24,34 +24,98 @@ parser.add_argument('-s','--split-for-fit',dest='split_for_fit',nargs='+',type=s
                     help='Run the aidapy.fit.split4fit function with given histogram names')
 parser.add_argument('-n','--np-gen',dest='np_gen',action='store_true',
                     help='Flag to generate hists with numpy')
+parser.add_argument('--rdf-gen',dest='rdf_gen',action='store_true',
+                    help='Flag to generate hists with ROOT.RDataFrame (one event loop per chain)')
+parser.add_argument('--implicit-mt',dest='implicit_mt',type=int,default=0,
+                    help='Number of threads for ROOT implicit multithreading with --rdf-gen (0 is off)')
+parser.add_argument('-j','--jobs',dest='jobs',type=int,default=1,
+                    help='Number of processes to generate histograms with')
+parser.add_argument('--split',dest='split',type=int,default=1,
+                    help='Split each chain into N parts (by files or entry ranges) for the workers')
+parser.add_argument('--max-memory',dest='max_memory',type=float,default=None,
+                    help='Memory budget (in MB) per job for --np-gen; chains are read in chunks')
+parser.add_argument('--shard-dir',dest='shard_dir',type=str,default=None,
+                    help='Write each task to its own shard file in this directory (merged at the end)')
+parser.add_argument('--slot',dest='slot',type=str,default=None,
+                    help='Batch job I/N (0 <= I < N): the tasks are dealt to the N jobs longest first, '
+                    'each to the job with the least estimated time so far; run the tasks of job I '
+                    'into --shard-dir, no merge')
+parser.add_argument('--plan',dest='plan',action='store_true',default=False,
+                    help='Print the plan of a -g run (passes over the data and histograms filled) and exit')
+parser.add_argument('--dry-run',dest='dry_run',action='store_true',default=False,
+                    help='Estimate the cost (I/O, events, fills, memory, time) of each -g task from the file metadata and exit')
+parser.add_argument('--profile',dest='profile',type=str,default=None,
+                    help='Profile the -g run per tree, process and stage and write the JSON report to this file')
+parser.add_argument('--merge-shards',dest='merge_shards',nargs='+',type=str,
+                    help='Merge shard files (from --slot jobs) into the output file')
 
 args = parser.parse_args()
 if len(sys.argv) < 2:
     parser.print_help()
     exit(0)
 
+slot = None
+if args.slot:
+    try:
+        slot = tuple(int(i) for i in args.slot.split('/'))
+    except ValueError:
+        slot = ()
+    if len(slot) != 2 or not 0 <= slot[0] < slot[1]:
+        parser.error('--slot must be I/N with 0 <= I < N, got '+args.slot)
+
 import aidapy.hist as aph
 import aidapy.plot as app
 import aidapy.fit  as apf
 import yaml
 import ROOT
 
+if args.plan:
+    print(aph.format_plan(aph.plan_hists(args.yaml_config, output=args.out_file,
+                                         numpy=args.np_gen, rdf=args.rdf_gen)))
+    exit(0)
+
+if args.dry_run:
+    tasks, costs = aph.estimate_hists(args.yaml_config, output=args.out_file, numpy=args.np_gen,
+                                      rdf=args.rdf_gen, implicit_mt=args.implicit_mt,
+                                      split=args.split,
+                                      max_memory=(int(args.max_memory*1024*1024) if args.max_memory else None))
+    print(aph.format_costs(tasks, costs, jobs=args.jobs))
+    exit(0)
+
 if args.gen_hists:
-    aph.generate_hists(args.yaml_config, output=args.out_file, numpy=args.np_gen)
+    aph.generate_hists(args.yaml_config, output=args.out_file, numpy=args.np_gen,
+                       rdf=args.rdf_gen, implicit_mt=args.implicit_mt, jobs=args.jobs,
+                       split=args.split,
+                       max_memory=(int(args.max_memory*1024*1024) if args.max_memory else None),
+                       shard_dir=args.shard_dir,
+                       slot=slot,
+                       profile=args.profile)
+
+if args.merge_shards:
+    aph.merge_hist_shards(args.yaml_config, args.merge_shards, output=args.out_file)
 
 if args.gen_plots:
     if len(args.gen_plots) == 1 and '.yaml' in args.gen_plots[0]:
         with open(args.gen_plots[0]) as f:
             yaml_top = yaml.load(f)
-        for h in yaml_top:
-            app.hplot_mpl(ROOT.TFile(args.in_file,'read'),h,
+        in_file = ROOT.TFile(args.in_file,'read')
+        # only 1D histograms are plotted
+        hists   = [h for h in yaml_top if 'axes' not in yaml_top[h]]
+        # all bands in one pass over the file
+        bands   = aph.systematic_bands(in_file,hists,
+                                       proc_names=['Wt','ttbar','Fakes','WW','Diboson','Ztautau','RareSM'])
+        for h in hists:
+            app.hplot_mpl(in_file,h,band=bands[h],
                           xtitle=yaml_top[h]['mpltitles'][0],ytitle=yaml_top[h]['mpltitles'][1])
     else:
+        in_file = ROOT.TFile(args.in_file,'read')
+        bands   = aph.systematic_bands(in_file,args.gen_plots,
+                                       proc_names=['Wt','ttbar','Fakes','WW','Diboson','Ztautau','RareSM'])
         for p in args.gen_plots:
             if args.root_plots:
-                app.hplot_root(ROOT.TFile(args.in_file,'read'),p)
+                app.hplot_root(in_file,p,band=bands[p])
             else:
-                app.hplot_mpl(ROOT.TFile(args.in_file,'read'),p)
+                app.hplot_mpl(in_file,p,band=bands[p])
 
 if args.split_for_fit:
     if not args.in_file:
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the axes of aidapy.hist.binning: bin_index (compared to
+np.digitize on the bin edges) and the flow bin handling of 1D and 2D
+cells (fold_flows, inner_bins).
+"""
+
+import numpy as np
+import pytest
+
+from aidapy.hist.binning import IntegerAxis
+from aidapy.hist.binning import Binning2D
+from aidapy.hist.binning import bin_index
+from aidapy.hist.binning import binning_nbins
+from aidapy.hist.binning import binning_edges
+from aidapy.hist.binning import binning_cells
+from aidapy.hist.binning import fold_flows
+from aidapy.hist.binning import inner_bins
+
+def _reference(x, binning):
+    # ROOT convention: edges[i-1] <= x < edges[i] is bin i, 0 is the
+    # underflow and nbins+1 the overflow
+    return np.digitize(x, binning_edges(binning))
+
+@pytest.mark.parametrize('binning, x', [
+    ((8, 0.0, 16.0),               [-5.0, -0.0, 0.0, 1.9, 2.0, 15.99, 16.0, 1e9, -np.inf, np.inf]),
+    ((4, -2.0, 2.0),               np.random.RandomState(1).uniform(-3, 3, 500)),
+    (np.array([0.0, 1.0, 2.5, 10.0]), [-1.0, 0.0, 0.5, 1.0, 2.5, 9.99, 10.0, 11.0, np.inf]),
+    (IntegerAxis(0, 7),            [-3.0, -0.5, -0.4, 0.0, 0.49, 0.5, 6.9, 7.0, 7.49, 7.5, 12.0]),
+    (IntegerAxis(2, 4),            [1.2, 1.5, 2.0, 3.7, 4.4999, 4.5]),
+])
+def test_bin_index(binning, x):
+    x = np.asarray(x, dtype=np.float64)
+    np.testing.assert_array_equal(bin_index(x, binning), _reference(x, binning))
+
+@pytest.mark.parametrize('dtype', [np.int32, np.int64, np.uint8, np.bool_])
+def test_bin_index_integer_values(dtype):
+    axis = IntegerAxis(0, 3)
+    x    = np.array([0, 1, 3, 5, 200], dtype=np.int64).astype(dtype)
+    np.testing.assert_array_equal(bin_index(x, axis), _reference(x.astype(np.float64), axis))
+    neg  = np.array([-4, -1, 0, 2, 3, 4], dtype=np.int32)
+    np.testing.assert_array_equal(bin_index(neg, IntegerAxis(-2, 2)),
+                                  _reference(neg.astype(np.float64), IntegerAxis(-2, 2)))
+
+@pytest.mark.parametrize('binning', [(4, -2.0, 2.0), np.array([0.0, 1.0, 2.5, 10.0]), IntegerAxis(0, 7)])
+def test_bin_index_nan(binning):
+    # NaN in the overflow (as TAxis::FindBin), the infinities in the flow bins
+    x    = np.array([np.nan, -np.inf, np.inf, np.nan, 1.0])
+    idx  = bin_index(x, binning)
+    flow = binning_nbins(binning)+1
+    np.testing.assert_array_equal(idx[:4], [flow, 0, flow, flow])
+    assert idx[-1] == _reference(x[-1:], binning)[0]
+    y    = x[::-1]
+    np.testing.assert_array_equal(bin_index((x, y), Binning2D(binning, binning)),
+                                  idx+(flow+1)*bin_index(y, binning))
+
+def test_bin_index_2d():
+    rng     = np.random.RandomState(2)
+    binning = Binning2D(np.array([0.0, 1.0, 2.5, 10.0]), (4, -2.0, 2.0))
+    x, y    = rng.uniform(-1, 11, 300), rng.uniform(-3, 3, 300)
+    ix, iy  = _reference(x, binning.x), _reference(y, binning.y)
+    # the flattened cell index, x running fastest (ROOT order)
+    np.testing.assert_array_equal(bin_index((x, y), binning), ix+(binning.x.size+1)*iy)
+    assert bin_index((x, y), binning).max() < binning_cells(binning)
+
+def _cells(binning, nweights=None):
+    rng   = np.random.RandomState(3)
+    shape = (binning_cells(binning),) if nweights is None else (nweights, binning_cells(binning))
+    return rng.uniform(0, 1, shape)
+
+@pytest.mark.parametrize('overflow, underflow', [(True, False), (False, True), (True, True)])
+def test_fold_flows_1d(overflow, underflow):
+    binning = (5, 0.0, 1.0)
+    cells   = _cells(binning, 3)
+    ref     = cells.copy()
+    if overflow:
+        ref[:,-2] += ref[:,-1]
+        ref[:,-1]  = 0.0
+    if underflow:
+        ref[:,1] += ref[:,0]
+        ref[:,0]  = 0.0
+    out = fold_flows(cells, binning, overflow, underflow)
+    assert out is cells
+    np.testing.assert_allclose(cells, ref)
+
+@pytest.mark.parametrize('nweights', [None, 4])
+def test_fold_flows_2d(nweights):
+    binning = Binning2D(IntegerAxis(0, 2), np.array([0.0, 1.0, 2.5, 10.0]))
+    nx, ny  = 3, 3
+    cells   = _cells(binning, nweights)
+    # reference on a (..., ix, iy) grid
+    grid = np.swapaxes(cells.reshape(cells.shape[:-1]+(ny+2, nx+2)), -1, -2).copy()
+    grid[...,-2,:] += grid[...,-1,:]
+    grid[...,-1,:]  = 0.0
+    grid[...,:,-2] += grid[...,:,-1]
+    grid[...,:,-1]  = 0.0
+    grid[...,1,:]  += grid[...,0,:]
+    grid[...,0,:]   = 0.0
+    grid[...,:,1]  += grid[...,:,0]
+    grid[...,:,0]   = 0.0
+    total = cells.sum(axis=-1)
+    fold_flows(cells, binning, overflow=True, underflow=True)
+    np.testing.assert_allclose(cells, np.swapaxes(grid, -1, -2).reshape(cells.shape))
+    np.testing.assert_allclose(cells.sum(axis=-1), total)
+    np.testing.assert_allclose(inner_bins(cells, binning).sum(axis=(-1, -2)), total)
+
+def test_inner_bins():
+    binning = (5, 0.0, 1.0)
+    cells   = _cells(binning, 2)
+    np.testing.assert_array_equal(inner_bins(cells, binning), cells[:,1:-1])
+    # a view
+    inner_bins(cells, binning)[...] = 0.0
+    assert not cells[:,1:-1].any() and cells[:,[0, -1]].all()
+
+def test_inner_bins_2d():
+    binning = Binning2D((4, 0.0, 4.0), IntegerAxis(0, 2))
+    nx, ny  = 4, 3
+    cells   = _cells(binning)
+    inner   = inner_bins(cells, binning)
+    assert inner.shape == (nx, ny)
+    for ix in range(nx):
+        for iy in range(ny):
+            assert inner[ix, iy] == cells[(ix+1)+(nx+2)*(iy+1)]
+    # the same cells as a np.histogram2d of the bin centers
+    x = np.repeat(np.arange(nx)+0.5, ny)
+    y = np.tile(np.arange(ny), nx).astype(np.float64)
+    w = np.array([inner[i, j] for i in range(nx) for j in range(ny)])
+    h = np.histogram2d(x, y, bins=[binning_edges(binning.x), binning_edges(binning.y)], weights=w)[0]
+    np.testing.assert_allclose(inner, h)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the numpy histogram kernels (np_fill and np_fill_weights of
+aidapy.hist.utils) against np.histogram and np.histogram2d.
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip('ROOT')
+
+from aidapy.hist.utils import np_fill
+from aidapy.hist.utils import np_fill_weights
+from aidapy.hist.binning import IntegerAxis
+from aidapy.hist.binning import Binning2D
+from aidapy.hist.binning import binning_edges
+
+def _flow_edges(binning):
+    # the edges with the flow bins: [-inf, x0), ..., [xn, inf]
+    return np.concatenate([[-np.inf], binning_edges(binning), [np.inf]])
+
+def _reference(x, w, binning):
+    """
+    The sum of weights of each cell (ROOT order) with np.histogram
+    (np.histogram2d for 2D).
+    """
+    if isinstance(binning, Binning2D):
+        h = np.histogram2d(x[0], x[1], bins=[_flow_edges(binning.x), _flow_edges(binning.y)],
+                           weights=w)[0]
+        # ROOT order: the x index running fastest
+        return h.T.ravel()
+    return np.histogram(x, bins=_flow_edges(binning), weights=w)[0]
+
+def _values(rng, binning, n):
+    if isinstance(binning, Binning2D):
+        return (_values(rng, binning.x, n), _values(rng, binning.y, n))
+    if isinstance(binning, IntegerAxis):
+        return rng.randint(binning.first-2, binning.last+3, n)
+    edges = binning_edges(binning)
+    span  = edges[-1]-edges[0]
+    x     = rng.uniform(edges[0]-0.2*span, edges[-1]+0.2*span, n)
+    # some of the values exactly on the edges, unless the edges of a
+    # uniform axis are inexact (the index is computed like
+    # TAxis::FindBin, not from the edges)
+    if not isinstance(binning, tuple) or np.log2(span/binning[0]) % 1 == 0:
+        x[:edges.size] = edges
+    return x
+
+_binnings = [
+    (8, 0.0, 16.0),
+    (10, -1.0, 1.0),
+    np.array([0.0, 1.0, 2.5, 5.0, 10.0]),
+    IntegerAxis(0, 7),
+    Binning2D((8, 0.0, 16.0), np.array([0.0, 1.0, 2.5, 5.0, 10.0])),
+    Binning2D(IntegerAxis(0, 3), (4, -2.0, 2.0)),
+]
+
+@pytest.mark.parametrize('binning', _binnings)
+def test_np_fill(binning):
+    rng = np.random.RandomState(3)
+    x   = _values(rng, binning, 1000)
+    w   = rng.normal(1.0, 0.5, 1000)
+    sumw, sumw2, neff = np_fill(x, w, binning)
+    np.testing.assert_allclose(sumw, _reference(x, w, binning), rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(sumw2, _reference(x, w*w, binning), rtol=1e-12, atol=1e-12)
+    assert np.isclose(neff, w.sum()**2/(w*w).sum())
+
+@pytest.mark.parametrize('binning', _binnings)
+def test_np_fill_weights(binning):
+    rng = np.random.RandomState(4)
+    x   = _values(rng, binning, 1000)
+    w   = rng.normal(1.0, 0.5, (1000, 5))
+    sumw, sumw2, neff = np_fill_weights(x, w, binning)
+    assert sumw.shape == sumw2.shape == (5, _reference(x, w[:,0], binning).size)
+    for j in range(w.shape[1]):
+        np.testing.assert_allclose(sumw[j], _reference(x, w[:,j], binning), rtol=1e-12, atol=1e-12)
+        np.testing.assert_allclose(sumw2[j], _reference(x, w[:,j]**2, binning), rtol=1e-12, atol=1e-12)
+        # the same as one variation at a time
+        one = np_fill(x, w[:,j], binning)
+        np.testing.assert_allclose(sumw[j], one[0], rtol=1e-12, atol=1e-12)
+        assert np.isclose(neff[j], one[2])
+
+@pytest.mark.parametrize('binning', [(8, 0.0, 16.0), Binning2D((8, 0.0, 16.0), IntegerAxis(0, 3))])
+def test_np_fill_weights_fold(binning):
+    rng = np.random.RandomState(5)
+    x   = _values(rng, binning, 500)
+    w   = rng.uniform(0.0, 2.0, (500, 3))
+    sumw   = np_fill_weights(x, w, binning)[0]
+    folded = np_fill_weights(x, w, binning, fold_overflow=True, fold_underflow=True)[0]
+    # all the weight stays in the real bins
+    np.testing.assert_allclose(folded.sum(axis=1), sumw.sum(axis=1), rtol=1e-12)
+    np.testing.assert_allclose(folded.sum(axis=1), w.sum(axis=0), rtol=1e-12)
+    if isinstance(binning, Binning2D):
+        grid = folded.reshape(3, binning.y.nbins+2, binning.x[0]+2)
+        assert not grid[:,[0, -1],:].any() and not grid[:,:,[0, -1]].any()
+    else:
+        assert not folded[:,[0, -1]].any()
+
+def test_np_fill_weights_empty():
+    sumw, sumw2, neff = np_fill_weights(np.zeros(0), np.zeros((0, 4)), (5, 0.0, 1.0))
+    assert sumw.shape == (4, 7) and not sumw.any() and not sumw2.any() and not neff.any()
+
+def test_np_fill_weights_shape():
+    with pytest.raises(ValueError):
+        np_fill_weights(np.zeros(10), np.zeros(10), (5, 0.0, 1.0))
+    with pytest.raises(ValueError):
+        np_fill_weights(np.zeros(10), np.zeros((9, 2)), (5, 0.0, 1.0))
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the shard merge rules (merge_shards of aidapy.hist.output):
+the parts of a partial histogram are added, identical duplicates are
+skipped and other duplicates are an error.
+"""
+
+import numpy as np
+import pytest
+
+ROOT = pytest.importorskip('ROOT')
+
+from aidapy.hist.output import HistWriter
+from aidapy.hist.output import merge_shards
+
+def _hist(name, values):
+    h = ROOT.TH1D(name, name, len(values), 0, len(values))
+    h.Sumw2()
+    for i, v in enumerate(values):
+        h.SetBinContent(i+1, v)
+        h.SetBinError(i+1, 1.0)
+    return h
+
+def _contents(path, name):
+    f = ROOT.TFile(path, 'READ')
+    h = f.Get(name)
+    contents = [h.GetBinContent(i+1) for i in range(h.GetNbinsX())]
+    f.Close()
+    return contents
+
+def _shard(path, hists, digests=None, part=None):
+    # a shard as a worker writes it: the histograms, their digests and
+    # the parts file for the partial histograms
+    writer = HistWriter(str(path))
+    for name, values in hists:
+        writer.write([_hist(name, values)], digests, part(name) if callable(part) else part)
+    writer.close()
+    return str(path)
+
+def _part(i, nparts, negatives_to_zero=False):
+    return {'part': i, 'nparts': nparts, 'negatives_to_zero': negatives_to_zero}
+
+def test_partials_are_added(tmp_path):
+    digests = {'h_part': 'd0', 'h_a': 'd1'}
+    shards  = [_shard(tmp_path/'a.root', [('h_part', [1.0, -4.0, 2.0]), ('h_a', [1.0, 2.0, 3.0])],
+                      digests, lambda name: _part(0, 2) if name == 'h_part' else None),
+               _shard(tmp_path/'b.root', [('h_part', [2.0, 1.0, 0.5])], digests, _part(1, 2))]
+    output  = str(tmp_path/'out.root')
+    merge_shards(shards, output)
+    np.testing.assert_allclose(_contents(output, 'h_part'), [3.0, -3.0, 2.5])
+    np.testing.assert_allclose(_contents(output, 'h_a'), [1.0, 2.0, 3.0])
+
+def test_partials_negatives_to_zero(tmp_path):
+    digests = {'h': 'd0'}
+    shards  = [_shard(tmp_path/('s%d.root' % i), [('h', values)], digests,
+                      _part(i, 3, negatives_to_zero=True))
+               for i, values in enumerate([[1.0, -4.0], [-0.5, 1.0], [0.5, 1.0]])]
+    output  = str(tmp_path/'out.root')
+    merge_shards(shards, output)
+    # the negative bins are set to zero after all the parts are added
+    np.testing.assert_allclose(_contents(output, 'h'), [1.0, 0.0])
+
+def test_missing_part(tmp_path):
+    shards = [_shard(tmp_path/'a.root', [('h', [1.0])], {'h': 'd0'}, _part(0, 2))]
+    with pytest.raises(ValueError, match='Missing parts'):
+        merge_shards(shards, str(tmp_path/'out.root'))
+
+def test_duplicate_raises(tmp_path):
+    shards = [_shard(tmp_path/'a.root', [('h', [1.0])], {'h': 'd0'}),
+              _shard(tmp_path/'b.root', [('h', [2.0])], {'h': 'd1'})]
+    with pytest.raises(ValueError, match='Duplicate histogram h'):
+        merge_shards(shards, str(tmp_path/'out.root'))
+
+def test_duplicate_part_raises(tmp_path):
+    # the same part index twice is a duplicate too
+    shards = [_shard(tmp_path/'a.root', [('h', [1.0])], {'h': 'd0'}, _part(0, 2)),
+              _shard(tmp_path/'b.root', [('h', [1.0])], {'h': 'd0'}, _part(0, 2))]
+    with pytest.raises(ValueError, match='Duplicate histogram h'):
+        merge_shards(shards, str(tmp_path/'out.root'))
+
+def test_identical_duplicate_skipped(tmp_path):
+    shards = [_shard(tmp_path/'a.root', [('h', [1.0, 2.0])], {'h': 'd0'}),
+              _shard(tmp_path/'b.root', [('h', [1.0, 2.0])], {'h': 'd0'})]
+    output = str(tmp_path/'out.root')
+    merge_shards(shards, output)
+    np.testing.assert_allclose(_contents(output, 'h'), [1.0, 2.0])
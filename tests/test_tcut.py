@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the TCut compiler (aidapy.hist.tcut): the compiled masks and
+values are compared to the same expression written with numpy and
+evaluated with eval on a small recarray, and (with ROOT and
+root_numpy) to TTree::Draw.
+"""
+
+import numpy as np
+import pytest
+
+from aidapy.hist.tcut import compile_tcut
+from aidapy.hist.tcut import split_and
+
+def _events():
+    rng = np.random.RandomState(7)
+    n   = 200
+    arr = np.zeros(n, dtype=[('njets', np.int32), ('nbjets', np.int32), ('SS', np.bool_),
+                             ('elmu', np.bool_), ('met', np.float32), ('pT_lep1', np.float32),
+                             ('zero', np.float32)])
+    arr['njets']   = rng.poisson(2.0, n)
+    arr['nbjets']  = rng.binomial(arr['njets'], 0.3)
+    arr['SS']      = rng.uniform(size=n) < 0.2
+    arr['elmu']    = rng.uniform(size=n) < 0.7
+    arr['met']     = rng.exponential(50.0, n)
+    arr['pT_lep1'] = rng.exponential(40.0, n)
+    return arr.view(np.recarray)
+
+@pytest.fixture(scope='module')
+def events():
+    return _events()
+
+def _reference(events, expr):
+    # the branches in double precision, as TTreeFormula evaluates them
+    names = dict((name, events[name].astype(np.float64) if events[name].dtype.kind == 'f'
+                  else np.asarray(events[name])) for name in events.dtype.names)
+    names['np'] = np
+    return np.broadcast_to(eval(expr, names), events.shape)
+
+# (TCut, the same selection with numpy)
+_masks = [
+    ('njets>=1&&!SS',                   '(njets >= 1) & ~SS'),
+    ('!SS&&elmu&&(njets==0||njets>2)',  '~SS & elmu & ((njets == 0) | (njets > 2))'),
+    # && binds tighter than ||
+    ('njets==1||njets==2&&SS',          '(njets == 1) | ((njets == 2) & SS)'),
+    ('SS||elmu&&njets>3',               'SS | (elmu & (njets > 3))'),
+    # comparisons bind looser than arithmetic, * looser than the signs
+    ('njets+1*2>3',                     'njets + 2 > 3'),
+    ('(njets+1)*2>4',                   '(njets + 1)*2 > 4'),
+    ('10-njets-2>5',                    '(10 - njets) - 2 > 5'),
+    ('-njets+3>0',                      '-njets + 3 > 0'),
+    ('!(njets>2)==elmu',                '(~(njets > 2)) == elmu'),
+    ('njets%2==0',                      'njets % 2 == 0'),
+    ('met>50.5&&pT_lep1<=40',           '(met > 50.5) & (pT_lep1 <= 40)'),
+    ('TMath::Abs(met-pT_lep1)<20',      'np.abs(met - pT_lep1) < 20'),
+    ('sqrt(met*met+pT_lep1*pT_lep1)>80','np.sqrt(met*met + pT_lep1*pT_lep1) > 80'),
+    ('max(njets,nbjets+2)>=3',          'np.maximum(njets, nbjets + 2) >= 3'),
+    # non-zero values are true
+    ('njets',                           'njets != 0'),
+    ('njets-nbjets&&elmu',              '(njets - nbjets != 0) & elmu'),
+    ('true',                            'True'),
+    ('kFALSE||SS',                      'SS'),
+    ('1+2*3==7',                        'True'),
+    # bitwise operators on integers: & binds tighter than |, both
+    # looser than the comparisons and tighter than && and ||
+    ('njets&1',                         '(njets & 1) != 0'),
+    ('njets&1&&elmu',                   '((njets & 1) != 0) & elmu'),
+    ('njets&1==1',                      '(njets & 1) != 0'),
+    ('nbjets|njets&2',                  '(nbjets | (njets & 2)) != 0'),
+    ('elmu&SS||njets>3',                '(elmu & SS) | (njets > 3)'),
+    ('(njets|nbjets)>2',                '(njets | nbjets) > 2'),
+]
+
+@pytest.mark.parametrize('tcut, expr', _masks)
+def test_mask(events, tcut, expr):
+    mask = compile_tcut(tcut)(events)
+    assert mask.dtype == np.bool_
+    assert mask.shape == events.shape
+    np.testing.assert_array_equal(mask, _reference(events, expr))
+
+@pytest.mark.parametrize('tcut', [m[0] for m in _masks])
+def test_tree_draw(events, tcut):
+    pytest.importorskip('ROOT')
+    root_numpy = pytest.importorskip('root_numpy')
+    tree = root_numpy.array2tree(np.asarray(events), name='tcut_test')
+    # the entries TTree::Draw selects
+    assert int(tree.GetEntries(tcut)) == int(compile_tcut(tcut)(events).sum())
+
+# (TCut, the same value with numpy)
+_values = [
+    ('met*1.1',                         'met*1.1'),
+    ('met/pT_lep1',                     'met/pT_lep1'),
+    ('8/njets/2',                       'np.where(njets != 0, 8.0/np.where(njets != 0, njets, 1), 0)/2'),
+    # ^ and ** are the power (as in TTreeFormula), tighter than the signs
+    ('met^2',                           'met**2'),
+    ('met**2-pT_lep1',                  'met**2 - pT_lep1'),
+    ('-njets^2',                        '-(njets.astype(np.float64)**2)'),
+    ('2^3^2',                           '2.0**9'),
+    ('2^-1*njets',                      '0.5*njets'),
+    ('njets*3%2',                       '(njets*3) % 2'),
+]
+
+@pytest.mark.parametrize('tcut, expr', _values)
+def test_value(events, tcut, expr):
+    np.testing.assert_allclose(compile_tcut(tcut).evaluate(events), _reference(events, expr),
+                               rtol=1e-12)
+
+def test_division_by_zero(events):
+    np.testing.assert_array_equal(compile_tcut('met/zero').evaluate(events), 0.0)
+    np.testing.assert_array_equal(compile_tcut('1/0').evaluate(events), 0.0)
+    value = compile_tcut('njets/(njets-2)').evaluate(events)
+    twos  = events.njets == 2
+    assert twos.any()
+    np.testing.assert_array_equal(value[twos], 0.0)
+    np.testing.assert_allclose(value[~twos], events.njets[~twos]/(events.njets[~twos]-2.0))
+    # no selected events from a zero division, no warnings either
+    with np.errstate(all='raise'):
+        assert not compile_tcut('met/zero>0')(events).any()
+    np.testing.assert_array_equal(compile_tcut('njets%0').evaluate(events), 0)
+
+def test_float32_upcast(events):
+    # float32 branches are evaluated in double precision
+    value = compile_tcut('met*pT_lep1').evaluate(events)
+    assert value.dtype == np.float64
+    np.testing.assert_array_equal(value, events.met.astype(np.float64)*events.pT_lep1)
+
+def test_empty_and_constant(events):
+    assert compile_tcut('')(events).all()
+    assert compile_tcut('  ')(events).shape == events.shape
+    assert not compile_tcut('false')(events).any()
+    np.testing.assert_array_equal(compile_tcut('2*3').evaluate(events), 6)
+
+def test_branches():
+    assert compile_tcut('!SS&&TMath::Abs(met)>njets^2||true').branches == set(['SS', 'met', 'njets'])
+    assert compile_tcut('').branches == set()
+
+def test_cache():
+    assert compile_tcut('njets>=1&&elmu') is compile_tcut('njets>=1&&elmu')
+    assert compile_tcut('njets>=1&&elmu') is not compile_tcut('njets>=1 && elmu')
+
+@pytest.mark.parametrize('tcut, atoms', [
+    ('!SS&&elmu&&(njets==0||njets>2)',  ['!SS', 'elmu', '(njets==0||njets>2)']),
+    (' njets >= 1 && elmu ',            ['njets>=1', 'elmu']),
+    ('elmu',                            ['elmu']),
+    ('',                                []),
+    ('SS||elmu&&njets>1',               ['SS||elmu&&njets>1']),
+    ('(SS||elmu)&&njets>1',             ['(SS||elmu)', 'njets>1']),
+    ('elmu&SS&&njets|1',                ['elmu&SS', 'njets|1']),
+])
+def test_split_and(events, tcut, atoms):
+    assert split_and(tcut) == atoms
+    # the atoms select the same events as the cut
+    mask = np.ones(events.shape, dtype=np.bool_)
+    for atom in atoms:
+        mask &= compile_tcut(atom)(events)
+    np.testing.assert_array_equal(mask, compile_tcut(tcut)(events))
+
+@pytest.mark.parametrize('tcut', [
+    'njets>=',
+    'njets>=1)',
+    '(njets>=1',
+    'njets>=1&&',
+    '&&elmu',
+    'njets $ 1',
+    'njets 1',
+    'foo(njets)',
+    'sqrt(met,)',
+    'njets||||elmu',
+])
+def test_invalid(tcut):
+    with pytest.raises(ValueError):
+        compile_tcut(tcut)
+
+def test_not_a_string():
+    with pytest.raises(TypeError):
+        compile_tcut(1)